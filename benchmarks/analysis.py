@@ -0,0 +1,52 @@
+"""Functions which operate on the full database."""
+
+import crdb
+from crdb.experimental import convert_energy
+from crdb.experimental import energy_conversion_numbers
+
+from .common import SIZES
+from .common import Server
+from .common import generate
+from .common import skip_unrecorded
+
+
+class _Benchmark:
+    params = SIZES
+    param_names = ("rows",)
+    timeout = 600
+
+    def setup_cache(self):
+        return {size: generate(size) for size in SIZES}
+
+    def setup(self, data, size, *args):
+        self.server = Server(data[size])
+        with skip_unrecorded():
+            self.table = crdb.all()
+
+    def teardown(self, data, size, *args):
+        self.server.close()
+
+
+class ExperimentMasks(_Benchmark):
+    def time_experiment_masks(self, data, size):
+        crdb.experiment_masks(self.table)
+
+    def time_experiment_groups(self, data, size):
+        crdb.experiment_groups(self.table)
+
+
+class ConvertEnergy(_Benchmark):
+    params = (SIZES, ("EKN", "ETOT"))
+    param_names = ("rows", "target")
+
+    def time_convert_energy(self, data, size, target):
+        convert_energy(self.table, target)
+
+    def peakmem_convert_energy(self, data, size, target):
+        convert_energy(self.table, target)
+
+
+class EnergyConversionNumbers(_Benchmark):
+    # the database is in the memory cache, so this measures the computation
+    def time_energy_conversion_numbers(self, data, size):
+        energy_conversion_numbers()
@@ -0,0 +1,111 @@
+"""
+Shared setup of the benchmarks.
+
+The benchmarks do not send requests to the CRDB server. By default, requests are
+answered by a local stand-in with synthetic data of several sizes, see
+crdb.synthetic. If the environment variable CRDB_BENCHMARK_RECORDINGS points to a
+directory with responses recorded with crdb.net.Recorder, e.g. with::
+
+    pytest --record DIR
+
+the recorded responses are replayed instead, and the benchmarks run only once for
+the recorded size.
+"""
+
+import functools
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+from typing import Optional
+from typing import Union
+from urllib.parse import urlsplit
+from urllib.parse import urlunsplit
+
+from crdb import cache
+from crdb import net
+
+_SERVER_HOST = "lpsc.in2p3.fr"
+
+RECORDINGS = os.environ.get("CRDB_BENCHMARK_RECORDINGS")
+
+#: number of rows of the synthetic database, or "recorded"
+SIZES = ("recorded",) if RECORDINGS else (10_000, 100_000, 1_000_000)
+
+
+def generate(size: Union[int, str]) -> Optional[str]:
+    """Return synthetic export of the database, or None for recorded data."""
+    if size == "recorded":
+        return None
+    from crdb import synthetic
+
+    return synthetic.generate(int(size))
+
+
+class Server:
+    """
+    Answers all requests to the CRDB server without network access.
+
+    Also uses an empty cache directory, which is removed by close().
+    """
+
+    def __init__(self, data: Optional[str]):
+        self._server = None
+        if data is None:
+            assert RECORDINGS
+            transport = net.Replayer(RECORDINGS)
+        else:
+            from crdb import synthetic
+
+            self._server = synthetic.make_server(_stand_in(data))
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+            netloc = f"127.0.0.1:{self._server.server_port}"
+
+            def transport(url, timeout, headers):
+                parts = urlsplit(url)
+                if parts.hostname == _SERVER_HOST:
+                    url = urlunsplit(parts._replace(scheme="http", netloc=netloc))
+                return net._request(url, timeout, headers)
+
+        self._previous = net.set_transport(transport)
+        self._cache_dir = tempfile.TemporaryDirectory()
+        self._env = os.environ.get("CRDB_CACHE_DIR")
+        os.environ["CRDB_CACHE_DIR"] = self._cache_dir.name
+        cache.memory.clear()
+
+    def clear_cache(self):
+        """Remove all cached results from memory and disk."""
+        cache.memory.clear()
+        cache.clear()
+
+    def close(self):
+        """Stop the server and restore the previous state."""
+        net.set_transport(self._previous)
+        net.close_all()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        cache.memory.clear()
+        if self._env is None:
+            del os.environ["CRDB_CACHE_DIR"]
+        else:
+            os.environ["CRDB_CACHE_DIR"] = self._env
+        self._cache_dir.cleanup()
+
+
+@contextmanager
+def skip_unrecorded() -> Iterator[None]:
+    """Skip the benchmark if a response which it needs was not recorded."""
+    try:
+        yield
+    except ConnectionError as e:
+        raise NotImplementedError(str(e)) from e
+
+
+@functools.lru_cache(maxsize=1)
+def _stand_in(data: str):
+    # preparing the export for serving takes a while, it is reused across repeats
+    from crdb import synthetic
+
+    return synthetic.StandIn(data)
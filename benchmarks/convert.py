@@ -0,0 +1,46 @@
+"""Conversion of the csv-asimport export into a table."""
+
+import time
+
+from crdb.core import _CSV_ASIMPORT_FIELDS
+from crdb.core import _SERVER_URL
+from crdb.core import _all_url
+from crdb.core import _convert_csv
+from crdb.core import _iter_lines
+from crdb.request import _iter_chunks
+
+from .common import SIZES
+from .common import Server
+from .common import generate
+from .common import skip_unrecorded
+
+
+class ConvertCsv:
+    params = (SIZES, (False, True))
+    param_names = ("rows", "compact")
+    timeout = 600
+
+    def setup_cache(self):
+        return {size: generate(size) for size in SIZES}
+
+    def setup(self, data, size, compact):
+        server = Server(data[size])
+        try:
+            with skip_unrecorded():
+                url = _all_url(_SERVER_URL)
+                self.lines = list(_iter_lines(_iter_chunks(url, 120, False)))
+        finally:
+            server.close()
+
+    def time_convert_csv(self, data, size, compact):
+        _convert_csv(self.lines, _CSV_ASIMPORT_FIELDS, compact)
+
+    def peakmem_convert_csv(self, data, size, compact):
+        _convert_csv(self.lines, _CSV_ASIMPORT_FIELDS, compact)
+
+    def track_rows_per_second(self, data, size, compact):
+        t = time.perf_counter()
+        table = _convert_csv(self.lines, _CSV_ASIMPORT_FIELDS, compact)
+        return len(table) / (time.perf_counter() - t)
+
+    track_rows_per_second.unit = "rows/s"
@@ -0,0 +1,13 @@
+"""Import time, measured in a fresh interpreter."""
+
+
+def timeraw_import_crdb():
+    return "import crdb"
+
+
+def timeraw_import_crdb_cli():
+    return "import crdb.cli"
+
+
+def timeraw_import_crdb_core():
+    return "import crdb.core"
@@ -0,0 +1,69 @@
+"""Render time of the plotting functions."""
+
+import numpy as np
+
+import crdb
+from crdb.local import _time_series_mask
+
+from .common import SIZES
+from .common import Server
+from .common import generate
+from .common import skip_unrecorded
+
+
+class _Benchmark:
+    params = SIZES
+    param_names = ("rows",)
+    timeout = 600
+
+    def setup_cache(self):
+        return {size: generate(size) for size in SIZES}
+
+    def setup(self, data, size):
+        try:
+            import matplotlib
+
+            matplotlib.use("Agg")
+            from matplotlib import pyplot as plt
+        except ImportError:
+            raise NotImplementedError("matplotlib is not installed")
+        self.plt = plt
+        server = Server(data[size])
+        try:
+            with skip_unrecorded():
+                self.table = self.select(crdb.all().copy())
+        finally:
+            server.close()
+
+    def render(self, draw):
+        fig, ax = self.plt.subplots()
+        draw(self.table)
+        fig.canvas.draw()
+        self.plt.close(fig)
+
+
+class DrawTable(_Benchmark):
+    def select(self, table):
+        # the most common quantity and energy type
+        key = np.char.add(np.char.add(table.quantity, "|"), table.e_type)
+        values, counts = np.unique(key, return_counts=True)
+        return table[key == values[np.argmax(counts)]]
+
+    def time_draw_table(self, data, size):
+        from crdb.mpl import draw_table
+
+        self.render(draw_table)
+
+
+class DrawTimeseries(_Benchmark):
+    def select(self, table):
+        table = table[_time_series_mask(table)]
+        if len(table) == 0:
+            raise NotImplementedError("no time series")
+        values, counts = np.unique(table.quantity, return_counts=True)
+        return table[table.quantity == values[np.argmax(counts)]]
+
+    def time_draw_timeseries(self, data, size):
+        from crdb.mpl import draw_timeseries
+
+        self.render(draw_timeseries)
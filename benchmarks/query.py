@@ -0,0 +1,83 @@
+"""Latency of crdb.query() and crdb.all() with a cold and a warm cache."""
+
+import crdb
+from crdb import cache
+
+from .common import SIZES
+from .common import Server
+from .common import generate
+from .common import skip_unrecorded
+
+QUANTITY = "B/C"
+
+
+class _Benchmark:
+    params = SIZES
+    param_names = ("rows",)
+    timeout = 600
+    # each measurement is a single call after a fresh setup, so that a cold cache
+    # stays cold
+    number = 1
+    repeat = 5
+    warmup_time = 0
+
+    def setup_cache(self):
+        return {size: generate(size) for size in SIZES}
+
+    def setup(self, data, size):
+        self.server = Server(data[size])
+
+    def teardown(self, data, size):
+        self.server.close()
+
+
+class QueryCold(_Benchmark):
+    def setup(self, data, size):
+        super().setup(data, size)
+        with skip_unrecorded():
+            # the first query prepares the stand-in, which should not be measured
+            crdb.query(QUANTITY)
+        self.server.clear_cache()
+
+    def time_query(self, data, size):
+        crdb.query(QUANTITY)
+
+
+class QueryWarm(_Benchmark):
+    def setup(self, data, size):
+        super().setup(data, size)
+        with skip_unrecorded():
+            crdb.query(QUANTITY)
+
+    def time_query_memory(self, data, size):
+        crdb.query(QUANTITY)
+
+    def time_query_disk(self, data, size):
+        cache.memory.clear()
+        crdb.query(QUANTITY)
+
+
+class AllCold(_Benchmark):
+    def time_all(self, data, size):
+        crdb.all()
+
+    def peakmem_all(self, data, size):
+        crdb.all()
+
+
+class AllWarm(_Benchmark):
+    def setup(self, data, size):
+        super().setup(data, size)
+        with skip_unrecorded():
+            crdb.all()
+
+    def time_all_memory(self, data, size):
+        crdb.all()
+
+    def time_all_disk(self, data, size):
+        cache.memory.clear()
+        crdb.all()
+
+    def peakmem_all_disk(self, data, size):
+        cache.memory.clear()
+        crdb.all()
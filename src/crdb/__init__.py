@@ -1,30 +1,69 @@
 """CRDB Python frontend."""
 
-from importlib.metadata import version
-
-from crdb.core import COMBINE
-from crdb.core import ELEMENTS
-from crdb.core import all
-from crdb.core import bibliography
-from crdb.core import clear_cache
-from crdb.core import experiment_masks
-from crdb.core import query
-from crdb.core import reference_urls
-from crdb.core import solar_system_composition
-from crdb.core import valid_quantities
+from typing import TYPE_CHECKING
+from typing import Any
+from typing import List
+
+if TYPE_CHECKING:
+    from crdb.core import COMBINE
+    from crdb.core import ELEMENTS
+    from crdb.core import all
+    from crdb.core import bibliography
+    from crdb.core import clear_cache
+    from crdb.core import experiment_groups
+    from crdb.core import experiment_masks
+    from crdb.core import iter_all
+    from crdb.core import iter_query
+    from crdb.core import query
+    from crdb.core import reference_urls
+    from crdb.core import solar_system_composition
+    from crdb.core import valid_quantities
+    from crdb.database import Database
+    from crdb.observe import set_observer
+
+    __version__: str
 
 __all__ = (
     "__version__",
     "COMBINE",
     "ELEMENTS",
+    "Database",
     "all",
     "bibliography",
     "clear_cache",
+    "experiment_groups",
     "experiment_masks",
+    "iter_all",
+    "iter_query",
     "query",
     "reference_urls",
+    "set_observer",
     "solar_system_composition",
     "valid_quantities",
 )
 
-__version__ = version("crdb")
+# The public API is imported on first access, so that importing crdb and running
+# the command line interface does not pay for importing numpy.
+_MODULES = {name: "crdb.core" for name in __all__}
+_MODULES["Database"] = "crdb.database"
+_MODULES["set_observer"] = "crdb.observe"
+del _MODULES["__version__"]
+
+
+def __getattr__(name: str) -> Any:
+    if name == "__version__":
+        from importlib.metadata import version
+
+        value = version("crdb")
+    elif name in _MODULES:
+        import importlib
+
+        value = getattr(importlib.import_module(_MODULES[name]), name)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(__all__))
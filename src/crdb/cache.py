@@ -0,0 +1,567 @@
+"""
+Disk cache for CRDB tables and server responses.
+
+Results are cached in a content-addressed store. A normalized request, usually the
+URL sent to the server, is mapped to a cache key. Each key has a small reference
+file in ``refs``, which points to a blob in ``blobs`` and stores the validators of
+the server response: the ETag and Last-Modified headers and a hash of the payload.
+These are used to ask the server whether the cached result is still up-to-date.
+Blobs are named after the hash of their content, so identical results of different
+requests are stored only once.
+
+Tables are stored in a native binary format: the blob contains the record array as
+a ``table.npy`` file and, for compact tables, one ``.npy`` file per category array.
+Cached tables are opened as memory maps, so loading takes constant time, pages are
+read on demand, and processes which read the same table share the page cache of
+the operating system. Modifying a loaded table does not change the cache.
+
+The total size of the blobs is limited. When the limit is exceeded, the least
+recently used blobs are deleted. The limit is 1 GB by default and can be changed
+with the environment variable ``CRDB_CACHE_SIZE``, e.g. ``CRDB_CACHE_SIZE=200M``.
+
+The cache is located in ``~/.cache/crdb``. This can be changed with the environment
+variable ``CRDB_CACHE_DIR``.
+
+In front of the disk cache, each process keeps the most recently used tables in
+memory, see :class:`MemoryCache`. Tables from the memory cache are read-only, use
+``table.copy()`` to get a table which can be modified.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+__all__ = (
+    "MemoryCache",
+    "age",
+    "cache_dir",
+    "clear",
+    "digest",
+    "evict",
+    "load",
+    "load_arrays",
+    "load_bytes",
+    "load_meta",
+    "make_key",
+    "max_size",
+    "memory",
+    "save",
+    "save_arrays",
+    "save_bytes",
+    "touch",
+    "usage",
+)
+
+_DEFAULT_MAX_SIZE = 1024**3
+_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+class MemoryCache:
+    """
+    Bounded in-memory LRU cache of tables.
+
+    Tables are stored as read-only arrays and returned as views, so that callers
+    cannot modify the shared entries. This class is thread-safe.
+
+    Parameters
+    ----------
+    max_entries : int, optional
+        Maximum number of tables. Default is 32.
+    """
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        #: number of successful lookups
+        self.hits = 0
+        #: number of failed lookups, including stale entries
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[np.recarray, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return number of tables."""
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        """Return whether there is a table for the key, which may be stale."""
+        return key in self._entries
+
+    def get(
+        self, key: str, max_age: Optional[timedelta] = None
+    ) -> Optional[np.recarray]:
+        """
+        Return read-only view of the cached table or None.
+
+        Parameters
+        ----------
+        key : str
+            Cache key.
+        max_age : timedelta, optional
+            If set, tables which were validated longer ago than this are ignored.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (
+                max_age is None or time.time() - entry[1] < max_age.total_seconds()
+            ):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _read_only_view(entry[0])
+            self.misses += 1
+        return None
+
+    def put(
+        self, key: str, table: np.recarray, age: Optional[timedelta] = None
+    ) -> np.recarray:
+        """
+        Store table and return a read-only view of it.
+
+        Parameters
+        ----------
+        key : str
+            Cache key.
+        table : array
+            CRDB table.
+        age : timedelta, optional
+            Time since the table was validated with the server. Default is zero.
+        """
+        table = _read_only_view(table)
+        validated = time.time() - (age.total_seconds() if age is not None else 0)
+        with self._lock:
+            self._entries[key] = (table, validated)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return _read_only_view(table)
+
+    def clear(self) -> None:
+        """Remove all tables and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def keys(self) -> List[str]:
+        """Return keys from least to most recently used."""
+        with self._lock:
+            return list(self._entries)
+
+
+#: memory cache of this process
+memory = MemoryCache()
+
+
+def cache_dir() -> Path:
+    """Return path of the cache directory."""
+    path = os.environ.get("CRDB_CACHE_DIR")
+    if path:
+        return Path(path)
+    return Path.home() / ".cache" / "crdb"
+
+
+def max_size() -> int:
+    """Return maximum size of the cache in bytes."""
+    value = os.environ.get("CRDB_CACHE_SIZE", "").strip().upper()
+    if not value:
+        return _DEFAULT_MAX_SIZE
+    m = re.fullmatch(r"([0-9]+(?:\.[0-9]*)?) *([KMGT]?)I?B?", value)
+    if not m:
+        raise ValueError(f"invalid value CRDB_CACHE_SIZE={value}")
+    return int(float(m.group(1)) * _UNITS[m.group(2)])
+
+
+def make_key(*parts: Any) -> str:
+    """Return cache key for the given parts, which must have a stable repr."""
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+def load(key: str, stale_after: Optional[timedelta] = None) -> Optional[np.recarray]:
+    """
+    Return cached table or None.
+
+    Parameters
+    ----------
+    key : str
+        Cache key.
+    stale_after : timedelta, optional
+        If set, entries older than this are ignored.
+
+    Returns
+    -------
+    Memory-mapped table or None, if the entry does not exist or is stale.
+    """
+    import numpy as np
+
+    from crdb.compact import _from_parts
+
+    path = _resolve(key, stale_after)
+    if path is None:
+        return None
+    try:
+        table = _load_array(path / "table.npy")
+        categories = {
+            p.stem: np.load(p) for p in path.glob("*.npy") if p.name != "table.npy"
+        }
+    except (OSError, ValueError):
+        # missing or damaged entry
+        return None
+    if categories:
+        return _from_parts(table, categories)
+    return table.view(np.recarray)
+
+
+def load_bytes(key: str, stale_after: Optional[timedelta] = None) -> Optional[bytes]:
+    """
+    Return cached payload or None.
+
+    Parameters
+    ----------
+    key : str
+        Cache key.
+    stale_after : timedelta, optional
+        If set, entries older than this are ignored.
+
+    Returns
+    -------
+    Payload or None, if the entry does not exist or is stale.
+    """
+    path = _resolve(key, stale_after)
+    if path is None:
+        return None
+    try:
+        return (path / "payload").read_bytes()
+    except OSError:
+        return None
+
+
+def load_arrays(
+    key: str, stale_after: Optional[timedelta] = None
+) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Return cached arrays or None.
+
+    Parameters
+    ----------
+    key : str
+        Cache key.
+    stale_after : timedelta, optional
+        If set, entries older than this are ignored.
+
+    Returns
+    -------
+    Dict of memory-mapped arrays or None, if the entry does not exist or is stale.
+    """
+    path = _resolve(key, stale_after)
+    if path is None:
+        return None
+    try:
+        return {p.stem: _load_array(p) for p in path.glob("*.npy")}
+    except (OSError, ValueError):
+        return None
+
+
+def save(key: str, table: np.recarray, meta: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Store table in cache.
+
+    Parameters
+    ----------
+    key : str
+        Cache key.
+    table : array
+        CRDB table.
+    meta : dict, optional
+        Meta data of the entry, which must be serializable as JSON.
+    """
+    import numpy as np
+
+    from crdb.compact import CompactTable
+
+    a = np.ascontiguousarray(table.view(np.ndarray))
+    categories = table.categories if isinstance(table, CompactTable) else {}
+    digest = hashlib.sha256(str(a.dtype).encode())
+    digest.update(a.view(np.uint8).data)
+    for name in sorted(categories):
+        digest.update(f"{name}:{categories[name].dtype}".encode())
+        digest.update(np.ascontiguousarray(categories[name]).view(np.uint8).data)
+
+    def write(path: Path) -> None:
+        for name, c in categories.items():
+            np.save(path / f"{name}.npy", c)
+        np.save(path / "table.npy", a)
+
+    _store(key, digest.hexdigest(), write, meta)
+
+
+def save_bytes(key: str, data: bytes, meta: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Store payload in cache.
+
+    Parameters
+    ----------
+    key : str
+        Cache key.
+    data : bytes
+        Payload.
+    meta : dict, optional
+        Meta data of the entry, which must be serializable as JSON.
+    """
+
+    def write(path: Path) -> None:
+        (path / "payload").write_bytes(data)
+
+    _store(key, hashlib.sha256(data).hexdigest() + "-payload", write, meta)
+
+
+def save_arrays(
+    key: str, arrays: Dict[str, np.ndarray], meta: Optional[Dict[str, Any]] = None
+) -> None:
+    """
+    Store named arrays in cache.
+
+    Parameters
+    ----------
+    key : str
+        Cache key.
+    arrays : dict
+        Maps names to numeric or string arrays.
+    meta : dict, optional
+        Meta data of the entry, which must be serializable as JSON.
+    """
+    import numpy as np
+
+    arrays = {k: np.ascontiguousarray(v) for (k, v) in arrays.items()}
+    digest = hashlib.sha256()
+    for name in sorted(arrays):
+        digest.update(f"{name}:{arrays[name].dtype}:{arrays[name].shape}".encode())
+        digest.update(arrays[name].view(np.uint8).data)
+
+    def write(path: Path) -> None:
+        for name, a in arrays.items():
+            np.save(path / f"{name}.npy", a)
+
+    _store(key, digest.hexdigest() + "-arrays", write, meta)
+
+
+def load_meta(key: str) -> Dict[str, Any]:
+    """Return meta data of the entry or an empty dict."""
+    ref = _read_ref(key)
+    return ref["meta"] if ref else {}
+
+
+def digest(key: str) -> Optional[str]:
+    """Return hash of the content of the entry or None."""
+    ref = _read_ref(key)
+    return ref["blob"] if ref else None
+
+
+def age(key: str) -> Optional[timedelta]:
+    """Return time since the entry was stored or last validated, or None."""
+    try:
+        mtime = _ref(key).stat().st_mtime
+    except OSError:
+        return None
+    return timedelta(seconds=time.time() - mtime)
+
+
+def touch(key: str, meta: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Mark entry as up-to-date.
+
+    Parameters
+    ----------
+    key : str
+        Cache key.
+    meta : dict, optional
+        If set, replace the meta data of the entry.
+    """
+    ref = _read_ref(key)
+    if ref is None:
+        return
+    if meta is not None:
+        ref["meta"] = meta
+    _write_ref(key, ref)
+
+
+def usage() -> int:
+    """Return size of the cached data in bytes."""
+    return sum(size for (_, _, size) in _blobs())
+
+
+def evict(limit: Optional[int] = None) -> None:
+    """
+    Delete least recently used data until the cache fits into the limit.
+
+    Parameters
+    ----------
+    limit : int, optional
+        Maximum size in bytes. Default is the value returned by max_size().
+    """
+    _evict(max_size() if limit is None else limit)
+
+
+def clear() -> None:
+    """Delete all cached data, including the memory cache."""
+    memory.clear()
+    for name in ("refs", "blobs"):
+        shutil.rmtree(cache_dir() / name, ignore_errors=True)
+
+
+def _ref(key: str) -> Path:
+    return cache_dir() / "refs" / f"{key}.json"
+
+
+def _read_ref(key: str) -> Optional[Dict[str, Any]]:
+    try:
+        return json.loads(_ref(key).read_text())  # type: ignore
+    except (OSError, ValueError):
+        return None
+
+
+def _write_ref(key: str, ref: Dict[str, Any]) -> None:
+    # write atomically, so that concurrent readers never see an incomplete file
+    path = _ref(key)
+    tmp = path.with_name(f".{key}-{os.getpid()}-{threading.get_ident()}")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp.write_text(json.dumps(ref))
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def _resolve(key: str, stale_after: Optional[timedelta]) -> Optional[Path]:
+    # return path of the blob of the entry and mark the blob as recently used
+    ref = _read_ref(key)
+    if ref is None:
+        return None
+    if stale_after is not None:
+        a = age(key)
+        if a is None or a > stale_after:
+            return None
+    path = cache_dir() / "blobs" / ref["blob"]
+    try:
+        os.utime(path)
+    except OSError:
+        # blob was evicted
+        return None
+    return path
+
+
+def _store(
+    key: str,
+    blob: str,
+    write: Callable[[Path], None],
+    meta: Optional[Dict[str, Any]],
+) -> None:
+    # blobs are written to a temporary directory and moved into place, so that
+    # concurrent readers never see an incomplete blob; caching is an optimization,
+    # so we give up silently if the cache is not writable
+    path = cache_dir() / "blobs" / blob
+    try:
+        # identical content may be stored already
+        os.utime(path)
+    except OSError:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = Path(tempfile.mkdtemp(dir=path.parent, prefix=".tmp-"))
+        except OSError:
+            return
+        try:
+            write(tmp)
+            os.replace(tmp, path)
+        except OSError:
+            # another process stored the same blob at the same time
+            pass
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    _write_ref(key, {"blob": blob, "meta": meta or {}})
+    _evict(max_size(), keep=blob)
+
+
+def _blobs() -> Iterator[Tuple[str, float, int]]:
+    # yield name, time of last use, and size of each blob
+    try:
+        paths = list((cache_dir() / "blobs").iterdir())
+    except OSError:
+        return
+    for path in paths:
+        if path.name.startswith("."):
+            continue
+        try:
+            mtime = path.stat().st_mtime
+            size = sum(p.stat().st_size for p in path.iterdir())
+        except OSError:
+            continue
+        yield path.name, mtime, size
+
+
+def _evict(limit: int, keep: str = "") -> None:
+    blobs = sorted(_blobs(), key=lambda x: x[1])
+    total = sum(size for (_, _, size) in blobs)
+    deleted = False
+    for name, _, size in blobs:
+        if total <= limit:
+            break
+        if name == keep:
+            continue
+        shutil.rmtree(cache_dir() / "blobs" / name, ignore_errors=True)
+        total -= size
+        deleted = True
+    if deleted:
+        # remove references to deleted blobs
+        blob_dir = cache_dir() / "blobs"
+        for path in (cache_dir() / "refs").glob("*.json"):
+            ref = _read_ref(path.stem)
+            if ref is not None and not (blob_dir / ref["blob"]).exists():
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+
+def _read_only_view(table: np.recarray) -> np.recarray:
+    from crdb.compact import CompactTable
+
+    view = table.view(type(table))
+    view.setflags(write=False)
+    if isinstance(view, CompactTable):
+        categories = {}
+        for name, c in view.categories.items():
+            c = c.view()
+            c.setflags(write=False)
+            categories[name] = c
+        view.categories = categories
+    return view
+
+
+def _load_array(path: Path) -> np.ndarray:
+    import numpy as np
+
+    # copy-on-write gives users a writable array without touching the file
+    try:
+        return np.load(path, mmap_mode="c")
+    except ValueError:
+        # empty arrays cannot be memory-mapped
+        return np.load(path)
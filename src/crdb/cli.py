@@ -1,16 +1,113 @@
 """Command line interface for CRDB."""
 
 import argparse
-import inspect
-import re
 import sys
 import traceback
+from typing import Any, Dict, Optional, List, Sequence
 
-import crdb
-from crdb.core import _server_request
-from crdb.core import _url
-from crdb.core import query
-from typing import Optional, List
+# Options of the query, these correspond to the arguments of crdb.request._url and
+# are listed here, so that the parser can be built without importing the library.
+_QUERY_ARGUMENTS = (
+    (
+        "quantity",
+        str,
+        None,
+        "Element, isotope, particle, or mass group, or ratio of those, e.g. 'H', "
+        "'B/C'. For valid names, see the crdb.valid_quantities().",
+    ),
+    (
+        "energy_type",
+        str,
+        "R",
+        "Energy unit for the requested quantity. Default is R. Valid values: EKN, "
+        "EK, R, ETOT, ETOTN.",
+    ),
+    (
+        "combo_level",
+        int,
+        1,
+        "One of 0, 1, 2. Default is 1. Add combinations (ratio, products) of native "
+        "data (from the same sub-exp at the same energy) that match quantities in "
+        "list (e.g. compute B/C from native B and C). Three levels of combos are "
+        "enabled: 0 (native data only, no combo), 1 (exact combos), or 2 (exact and "
+        "approximate combos): in level 1, the mean energy (or energy bin) of the two "
+        "quantities must be within 5%%, whereas for level 2, it must be within 20%%.",
+    ),
+    (
+        "energy_convert_level",
+        int,
+        1,
+        "One of 0, 1, 2. Default is 1. Add data obtained from an exact or approximate "
+        "energy_type conversion (from native to queried). Three levels of conversion "
+        "are enabled: 0 (native data only, no conversion), 1 (exact conversion only, "
+        "which applies to isotopic and leptonic fluxes), and 2 (exact and "
+        "approximate conversions, the later applying to flux of elements and of "
+        "groups of elements).",
+    ),
+    ("flux_rescaling", float, 0.0, "Flux is multiplied by E^flux_rescaling."),
+    (
+        "exp_dates",
+        str,
+        "",
+        "Comma-separated list (optional time intervals) of sub-experiment names.",
+    ),
+    ("energy_start", float, 0.0, "Lower limit for energy_type."),
+    ("energy_stop", float, 0.0, "Upper limit for energy_type."),
+    (
+        "time_start",
+        str,
+        "",
+        "Lower limit for interval selection. Format: YYYY[/MM] (2014, 2010/06).",
+    ),
+    (
+        "time_stop",
+        str,
+        "",
+        "Upper limit for interval selection. Format: YYYY[/MM] (2020, 2019/06).",
+    ),
+    (
+        "time_series",
+        str,
+        "",
+        "Whether to discard, select only, or keep time series data in query CRDB "
+        "keywords ('no', 'only', 'all'). Default is 'no'.",
+    ),
+    (
+        "format",
+        str,
+        "",
+        "Output format; one of 'usine', 'galprop', 'csv', 'csv-asimport'. "
+        "Default is 'csv-asimport'.",
+    ),
+    (
+        "modulation",
+        str,
+        "",
+        "Source of Solar modulation values; one of 'USO05', 'USO17', 'GHE17'. "
+        "Default is 'GHE17'.",
+    ),
+    (
+        "server_url",
+        str,
+        "http://lpsc.in2p3.fr/crdb",
+        "URL to send the request to. Default is http://lpsc.in2p3.fr/crdb). This is "
+        "an expert option, users do not need to change this.",
+    ),
+)
+
+
+class _Version(argparse.Action):
+    # like action="version", but the version is only looked up when it is needed,
+    # because importlib.metadata is slow to import
+
+    def __init__(self, option_strings: Sequence[str], dest: str, **kwargs: Any):
+        super().__init__(option_strings, dest, nargs=0, **kwargs)
+
+    def __call__(self, parser: argparse.ArgumentParser, *args: Any) -> None:
+        import crdb
+
+        print(f"crdb-{crdb.__version__}")
+        parser.exit()
 
 
 def main(args: Optional[List[str]] = None) -> None:
@@ -19,53 +116,267 @@ def main(args: Optional[List[str]] = None) -> None:
 
     Returns unprocessed DB output to stdout.
     """
-    parser = argparse.ArgumentParser(description=main.__doc__)
-
-    assert isinstance(query.__doc__, str)
-    descriptions = {
-        k: re.sub(r"\s+", " ", v.strip())
-        for (k, v) in re.findall(
-            r"^ {4}([a-z_]+): *[a-z, ]+\n((?: {8}.+\n)+)", query.__doc__, re.MULTILINE
-        )
-    }
-    descriptions["format"] = (
-        "Output format; one of 'usine', 'galprop', 'csv', 'csv-asimport'. "
-        "Default is 'csv-asimport'."
-    )
-
-    for name, par in inspect.signature(_url).parameters.items():
-        name2 = name.replace("_", "-")
-        h = descriptions.get(name, "").replace("%", "%%")
-        tp = par.annotation
-        if isinstance(tp, str):
-            tp = eval(tp)
-        kwargs = {
-            "type": tp,
-            "help": h,
-        }
-        if par.default is not inspect.Parameter.empty:
-            kwargs["default"] = par.default
-        parser.add_argument(f"--{name2}" if "default" in kwargs else name2, **kwargs)
+    if args is None:
+        args = sys.argv[1:]
+    if args and args[0] == "batch":
+        _batch(args[1:])
+        return
+    if args and args[0] == "serve":
+        _serve(args[1:])
+        return
 
-    parser.add_argument(
-        "--timeout",
-        type=int,
-        default=120,
-        help="Timeout for server request in seconds. Default is 120.",
+    parser = argparse.ArgumentParser(
+        description=main.__doc__,
+        epilog="Use 'crdb batch -h' to learn how to run several queries at once, and "
+        "'crdb serve -h' to learn how to run a local mirror of the server.",
     )
+    _add_query_arguments(parser)
+    _add_timings_argument(parser)
     parser.add_argument(
         "--version",
-        action="version",
-        version=f"crdb-{crdb.__version__}",
+        action=_Version,
+        default=argparse.SUPPRESS,
         help="Print version of crdb Python library.",
     )
 
     args = parser.parse_args(args=args)
-    kwargs = {k.replace("-", "_"): v for (k, v) in vars(args).items() if k != "timeout"}
+
+    # the request does not need numpy, which takes a long time to import
+    from crdb.request import _server_request
+
     try:
-        url = _url(**kwargs)
+        url = _query_url(args)
     except ValueError as e:
         sys.stderr.write("".join(traceback.format_exception_only(e)))  # type:ignore
         sys.exit(1)
     data = _server_request(url, timeout=args.timeout)
     print("\n".join(data))
+    if args.timings:
+        _print_timings()
+
+
+def _batch(args: List[str]) -> None:
+    """
+    Run several queries concurrently.
+
+    Each response is streamed to its own file in the output directory, or written
+    to stdout after a header line with the query, as soon as it arrives. Cached
+    responses and open connections are reused across queries.
+    """
+    import contextlib
+    import os
+    import re
+    import shlex
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from concurrent.futures import as_completed
+
+    from crdb.request import _iter_payload
+
+    parser = argparse.ArgumentParser(prog="crdb batch", description=_batch.__doc__)
+    parser.add_argument(
+        "quantity",
+        nargs="*",
+        help="Quantities to query with the options given here.",
+    )
+    parser.add_argument(
+        "-f",
+        "--file",
+        type=argparse.FileType("r"),
+        action="append",
+        default=[],
+        help="File with one query per line, written like the arguments of the "
+        "crdb command, e.g. 'B/C --energy-type EKN'. The options given here are "
+        "the defaults for these queries. Empty lines and lines starting with # are "
+        "ignored. Use - to read from stdin. Can be given several times.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=4,
+        help="Maximum number of concurrent requests. Default is 4.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        help="Write each response to a file in this directory, which is named "
+        "after the quantity and energy type, e.g. B_C-EKN.csv. Responses are "
+        "written to stdout otherwise.",
+    )
+    _add_query_arguments(parser, quantity=False)
+    _add_timings_argument(parser)
+
+    args = parser.parse_args(args=args)
+    if args.jobs < 1:
+        parser.error(f"invalid number of jobs {args.jobs}")
+
+    defaults = vars(args).copy()
+    for name in ("quantity", "file", "jobs", "output_dir", "timings"):
+        del defaults[name]
+
+    query_parser = argparse.ArgumentParser(prog="crdb batch", add_help=False)
+    _add_query_arguments(query_parser)
+    query_parser.set_defaults(**defaults)
+
+    queries = [(q, argparse.Namespace(quantity=q, **defaults)) for q in args.quantity]
+    for file in args.file:
+        with file:
+            for line in file:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    queries.append((line, query_parser.parse_args(shlex.split(line))))
+    if not queries:
+        parser.error("no queries given")
+
+    urls = []
+    for label, query in queries:
+        try:
+            urls.append(_query_url(query))
+        except ValueError as e:
+            sys.stderr.write(f"{label}: {e}\n")
+            sys.exit(1)
+
+    paths: List[str] = []
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        counts: Dict[str, int] = {}
+        for _, query in queries:
+            name = re.sub(
+                r"[^\w+.-]", "_", f"{query.quantity}-{query.energy_type.upper()}"
+            )
+            counts[name] = counts.get(name, 0) + 1
+            if counts[name] > 1:
+                name += f"-{counts[name]}"
+            ext = "csv" if query.format in ("", "csv", "csv-asimport") else "txt"
+            paths.append(os.path.join(args.output_dir, f"{name}.{ext}"))
+
+    lock = threading.Lock()
+
+    def run(i: int) -> None:
+        label, query = queries[i]
+        chunks = _iter_payload(urls[i], query.timeout, progress=False)
+        if paths:
+            try:
+                with open(paths[i], "wb") as f:
+                    for chunk in chunks:
+                        f.write(chunk)
+            except BaseException:
+                # the file is not created if the request fails
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(paths[i])
+                raise
+        else:
+            text = b"".join(chunks).decode("utf-8")
+            if not text.endswith("\n"):
+                text += "\n"
+            with lock:
+                sys.stdout.write(f"==> {label} <==\n{text}")
+                sys.stdout.flush()
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {pool.submit(run, i): label for (i, (label, _)) in enumerate(queries)}
+        for future in as_completed(futures):
+            error = future.exception()
+            if error is not None:
+                failed += 1
+                sys.stderr.write(f"{futures[future]}: {error}\n")
+    if args.timings:
+        _print_timings()
+    if failed:
+        sys.exit(1)
+
+
+def _serve(args: List[str]) -> None:
+    """
+    Run a local mirror of the CRDB server.
+
+    The mirror answers queries from a snapshot of the full database, which is
+    loaded from the cache or downloaded once at startup. Point clients to the
+    mirror with the server_url argument of crdb.query() and crdb.all(), or with
+    the --server-url option.
+    """
+    parser = argparse.ArgumentParser(prog="crdb serve", description=_serve.__doc__)
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="Host name or address to listen on. Default is 127.0.0.1, use 0.0.0.0 "
+        "to accept connections from other machines.",
+    )
+    parser.add_argument(
+        "--port", type=int, default=8000, help="Port to listen on. Default is 8000."
+    )
+    parser.add_argument(
+        "--timeout",
+        type=int,
+        default=120,
+        help="Timeout for server request in seconds. Default is 120.",
+    )
+    parser.add_argument(
+        "--server-url",
+        default="https://lpsc.in2p3.fr/crdb",
+        help="URL of the server to load the database from. Default is "
+        "https://lpsc.in2p3.fr/crdb.",
+    )
+    args = parser.parse_args(args=args)
+
+    from crdb.mirror import Mirror
+    from crdb.mirror import make_server
+
+    mirror = Mirror(timeout=args.timeout, server_url=args.server_url)
+    server = make_server(mirror, args.host, args.port)
+    sys.stderr.write(
+        f"serving {len(mirror.db)} rows at http://{args.host}:{server.server_port}\n"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def _add_query_arguments(
+    parser: argparse.ArgumentParser, quantity: bool = True
+) -> None:
+    for name, tp, default, h in _QUERY_ARGUMENTS:
+        name2 = name.replace("_", "-")
+        if default is None:
+            if quantity:
+                parser.add_argument(name2, type=tp, help=h)
+        else:
+            parser.add_argument(f"--{name2}", type=tp, default=default, help=h)
+
+    parser.add_argument(
+        "--timeout",
+        type=int,
+        default=120,
+        help="Timeout for server request in seconds. Default is 120.",
+    )
+
+
+def _add_timings_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="Print a summary of the time spent in requests, downloads, and the "
+        "cache to stderr when done.",
+    )
+
+
+def _print_timings() -> None:
+    from crdb.observe import summary
+
+    sys.stderr.write(summary.report() + "\n")
+
+
+def _query_url(args: argparse.Namespace) -> str:
+    from crdb.request import _url
+
+    kwargs = {
+        k.replace("-", "_"): v
+        for (k, v) in vars(args).items()
+        if k not in ("timeout", "timings")
+    }
+    return _url(**kwargs)
@@ -0,0 +1,303 @@
+"""
+Compact tables with dictionary-encoded string columns.
+
+Most string columns of a CRDB table contain the same few values over and over, for
+example the name of the sub-experiment or the datetime range. A compact table stores
+a small integer code per row for these columns and keeps the unique values in a
+separate array, which reduces the memory footprint by about an order of magnitude.
+
+String columns of a compact table are returned as :class:`StringColumn` objects.
+They support the common operations, e.g.::
+
+    tab = crdb.query("B/C", compact=True)
+    mask = tab.sub_exp == "AMS02 (2011/05-2016/05)"
+    refs = np.unique(tab.ads)
+
+Other numpy functions see the decoded string array.
+"""
+
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+from numpy.typing import NDArray
+
+__all__ = ("CompactTable", "StringColumn", "compact", "concatenate")
+
+
+class StringColumn:
+    """
+    Dictionary-encoded string column.
+
+    Stores one integer code per row and a sorted array of unique values. Comparing
+    the column with a string and calling numpy.unique work directly on the codes;
+    other operations see the decoded string array.
+    """
+
+    __hash__ = None  # type: ignore
+
+    def __init__(self, codes: NDArray, categories: NDArray):
+        self.codes = codes
+        self.categories = categories
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Return dtype of the decoded column."""
+        return self.categories.dtype
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        """Return shape of the column."""
+        return self.codes.shape
+
+    @property
+    def ndim(self) -> int:
+        """Return number of dimensions of the column."""
+        return self.codes.ndim
+
+    def __len__(self) -> int:
+        """Return number of rows."""
+        return len(self.codes)
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over decoded values."""
+        cat = self.categories.tolist()
+        return (cat[c] for c in self.codes.tolist())
+
+    def __getitem__(self, key: Any) -> Union[str, "StringColumn"]:
+        """Return decoded value or sub-column."""
+        codes = self.codes[key]
+        if np.ndim(codes) == 0:
+            return self.categories[codes]  # type: ignore
+        return StringColumn(codes, self.categories)
+
+    def __array__(self, dtype: Any = None, copy: Any = None) -> NDArray:
+        """Return decoded string array."""
+        a = self.categories[self.codes]
+        return a if dtype is None else a.astype(dtype)
+
+    def __eq__(self, other: Any) -> NDArray:  # type: ignore
+        """Compare element-wise, this is fast for a single string."""
+        if isinstance(other, str):
+            code = self._code(other)
+            if code < 0:
+                return np.zeros(self.shape, dtype=bool)
+            return self.codes == code
+        return np.asarray(self) == _decode(other)
+
+    def __ne__(self, other: Any) -> NDArray:  # type: ignore
+        """Compare element-wise, this is fast for a single string."""
+        return ~(self == other)
+
+    def __array_ufunc__(
+        self, ufunc: Any, method: str, *args: Any, **kwargs: Any
+    ) -> Any:
+        """Apply ufunc to decoded string array."""
+        args = tuple(_decode(x) for x in args)
+        return getattr(ufunc, method)(*args, **kwargs)
+
+    def __array_function__(
+        self, func: Any, types: Any, args: Any, kwargs: Dict[str, Any]
+    ) -> Any:
+        """Compute numpy.unique on codes, otherwise use decoded string array."""
+        if func is np.unique and len(args) == 1 and kwargs.get("axis") is None:
+            # categories are sorted and unique, so the unique codes map one-to-one
+            # to the unique strings in the same order
+            r = np.unique(self.codes, **kwargs)
+            if isinstance(r, tuple):
+                return (self.categories[r[0]],) + r[1:]
+            return self.categories[r]
+        args = tuple(_decode(x) for x in args)
+        kwargs = {k: _decode(v) for (k, v) in kwargs.items()}
+        return func(*args, **kwargs)
+
+    def __repr__(self) -> str:
+        """Return string representation."""
+        return f"StringColumn({np.asarray(self)!r})"
+
+    def tolist(self) -> List[str]:
+        """Return decoded column as a list of str."""
+        return list(self)
+
+    def _code(self, value: str) -> int:
+        i = int(np.searchsorted(self.categories, value))
+        if i < len(self.categories) and self.categories[i] == value:
+            return i
+        return -1
+
+
+class CompactTable(np.recarray):
+    """
+    Record array with dictionary-encoded string columns.
+
+    This behaves like the record array returned by crdb.query() and crdb.all(), but
+    string columns are stored as integer codes. Accessing a string column by attribute
+    or by name returns a :class:`StringColumn`. Rows, which are returned by an integer
+    index or by iterating over the table, are decoded. Use :meth:`expand` to convert
+    the table back to a normal record array.
+    """
+
+    categories: Dict[str, NDArray]
+
+    def __array_finalize__(self, obj: Any) -> None:
+        """Inherit categories from the parent array."""
+        super().__array_finalize__(obj)
+        self.categories = getattr(obj, "categories", {})
+
+    def __getattribute__(self, attr: str) -> Any:
+        """Return string columns as StringColumn."""
+        categories = np.ndarray.__getattribute__(self, "__dict__").get("categories")
+        if categories and attr in categories:
+            return StringColumn(np.ndarray.__getitem__(self, attr), categories[attr])
+        return super().__getattribute__(attr)
+
+    def __getitem__(self, key: Any) -> Any:
+        """Return string columns as StringColumn and rows with decoded strings."""
+        if isinstance(key, str) and key in self.categories:
+            return StringColumn(np.ndarray.__getitem__(self, key), self.categories[key])
+        if (
+            isinstance(key, (int, np.integer))
+            and not isinstance(key, bool)
+            and self.dtype.names is not None
+        ):
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError(f"index {key} is out of bounds")
+            return self[key : key + 1].expand()[0]
+        return super().__getitem__(key)
+
+    def __iter__(self) -> Iterator[Any]:
+        """Iterate over rows with decoded strings."""
+        if self.dtype.names is None:
+            return super().__iter__()
+        return iter(self.expand())
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        """Pickle table with categories."""
+        # ndarray.__reduce__ does not preserve instance attributes
+        return (_from_parts, (self.view(np.ndarray), self.categories))
+
+    def expand(self) -> np.recarray:
+        """Return table as a normal record array with plain string columns."""
+        dtype = []
+        for name in self.dtype.names:
+            if name in self.categories:
+                dtype.append((name, self.categories[name].dtype))
+            else:
+                dtype.append((name, self.dtype[name]))
+        result = np.recarray(self.shape, dtype)
+        for name in self.dtype.names:
+            result[name] = np.asarray(self[name])
+        return result
+
+
+def compact(table: np.recarray) -> CompactTable:
+    """
+    Return CRDB table with dictionary-encoded string columns.
+
+    Parameters
+    ----------
+    table : array
+        CRDB table.
+
+    Returns
+    -------
+    CompactTable
+    """
+    if isinstance(table, CompactTable):
+        return table
+    columns = {}
+    categories = {}
+    for name in table.dtype.names:
+        a = table[name]
+        if a.dtype.kind == "U":
+            categories[name], a = np.unique(a, return_inverse=True)
+            a = a.astype(_code_dtype(len(categories[name])))
+        columns[name] = a
+    return _encoded_table(columns, categories)
+
+
+def concatenate(tables: Sequence[np.recarray]) -> np.recarray:
+    """
+    Concatenate CRDB tables.
+
+    Compact tables are merged into a compact table with the union of the categories,
+    all other tables are concatenated with numpy.concatenate.
+
+    Parameters
+    ----------
+    tables : sequence of array
+        CRDB tables. Either all of them or none must be compact.
+
+    Returns
+    -------
+    array
+    """
+    if not any(isinstance(t, CompactTable) for t in tables):
+        return np.concatenate(tables).view(np.recarray)  # type: ignore
+    if not all(isinstance(t, CompactTable) for t in tables):
+        raise ValueError("cannot concatenate compact and normal tables")
+
+    columns = {}
+    categories = {}
+    for name in tables[0].dtype.names:
+        parts = [t.view(np.ndarray)[name] for t in tables]
+        if name in tables[0].categories:
+            cats = [t.categories[name] for t in tables]
+            categories[name] = np.unique(np.concatenate(cats))
+            parts = [
+                np.searchsorted(categories[name], c)[p] for (c, p) in zip(cats, parts)
+            ]
+        columns[name] = np.concatenate(parts)
+    return _encoded_table(columns, categories)
+
+
+def _encode(values: Sequence[str], dtype: Any) -> Tuple[NDArray, NDArray]:
+    # dictionary-encode strings; np.unique on the distinct values takes care of
+    # strings which become equal after truncation to the dtype
+    index: Dict[str, int] = {}
+    first = np.fromiter(
+        (index.setdefault(v, len(index)) for v in values), np.intp, len(values)
+    )
+    categories, inverse = np.unique(np.array(list(index), dtype), return_inverse=True)
+    return inverse[first].astype(_code_dtype(len(categories))), categories
+
+
+def _encoded_table(
+    columns: Dict[str, NDArray], categories: Dict[str, NDArray]
+) -> CompactTable:
+    # columns maps field names to arrays, string fields must contain the codes
+    n = len(next(iter(columns.values())))
+    dtype = [(name, a.dtype, a.shape[1:]) for (name, a) in columns.items()]
+    result = np.empty(n, dtype).view(CompactTable)
+    for name, a in columns.items():
+        np.ndarray.__setitem__(result, name, a)
+    result.categories = {k: categories[k] for k in columns if k in categories}
+    return result
+
+
+def _from_parts(table: NDArray, categories: Dict[str, NDArray]) -> CompactTable:
+    result = table.view(CompactTable)
+    result.categories = categories
+    return result
+
+
+def _code_dtype(n: int) -> np.dtype:
+    for t in (np.uint8, np.uint16, np.uint32):
+        if n <= np.iinfo(t).max + 1:
+            return np.dtype(t)
+    return np.dtype(np.uint64)
+
+
+def _decode(x: Any) -> Any:
+    if isinstance(x, StringColumn):
+        return np.asarray(x)
+    if isinstance(x, (list, tuple)):
+        return type(x)(_decode(y) for y in x)
+    return x
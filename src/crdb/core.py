@@ -2,23 +2,45 @@
 
 from __future__ import annotations
 
+import codecs
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 import csv
 from datetime import datetime, timedelta
+import itertools
 import re
-import ssl
-import urllib.request as rq
+import time
+import warnings
 from pathlib import Path
+from typing import Any
 from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
+from typing import NamedTuple
+from typing import Optional
 from typing import Sequence
 from typing import Tuple
 from typing import Union
 from typing import Set
 
-import cachier
 import numpy as np
 from numpy.typing import NDArray
 
+from crdb import cache as _cache
+from crdb.compact import _encode
+from crdb.compact import _encoded_table
+from crdb.compact import compact as _compact
+from crdb.compact import concatenate as _concatenate
+from crdb.observe import _emit
+from crdb.request import _PARALLEL_RANGES
+from crdb.request import _REVALIDATE_AFTER
+from crdb.request import _REVALIDATE_UNCONDITIONAL_AFTER
+from crdb.request import _iter_chunks
+from crdb.request import _open
+from crdb.request import _read_chunks
+from crdb.request import _url
+
 ELEMENTS = {
     'H': 1,
     'He': 2,
@@ -172,6 +194,19 @@ _CSV_FIELDS = (
     ("is_upper_limit", "?"),  # IS UPPER LIMIT
 )
 
+# columns which are computed from the datetime column when a table is converted
+_DATETIME_FIELDS = (
+    ("time_start", "M8[s]"),  # start of the envelope of all time ranges
+    ("time_stop", "M8[s]"),  # end of the envelope of all time ranges
+    ("time_ranges", "i2"),  # number of time ranges
+)
+
+# increment when the columns of converted tables change, this invalidates the cache
+_TABLE_VERSION = 2
+
+_SERVER_URL = "https://lpsc.in2p3.fr/crdb"
+_ALL_URL = f"{_SERVER_URL}/_export_all_data.php?format=csv-asimport"
+
 # fields set to None here are skipped during parsing
 _CSV_ASIMPORT_FIELDS = (
     ("exp", "U64"),  # EXP-NAME
@@ -198,7 +233,6 @@ _CSV_ASIMPORT_FIELDS = (
 )
 
 
-@cachier.cachier(stale_after=timedelta(days=30))
 def query(
     quantity: Union[str, Sequence[str]],
     *,
@@ -215,6 +249,10 @@ def query(
     modulation: str = "",
     timeout: int = 120,
     server_url: str = "http://lpsc.in2p3.fr/crdb",
+    compact: bool = False,
+    backend: str = "server",
+    max_workers: int = 4,
+    revalidate: bool = False,
 ) -> np.recarray:
     """
     Query CRDB and return table as a numpy array.
@@ -226,8 +264,8 @@ def query(
     quantity: str or sequence of str
         Element, isotope, particle, or mass group, or ratio of those, e.g. 'H', 'B/C'.
         For valid names, see the crdb.valid_quantities(). Multiple quantities can be
-        bundled in a sequence for convenience, but this is not more efficient than
-        running multiple queries by hand.
+        bundled in a sequence, these are then requested concurrently and the results
+        are concatenated in the input order.
     energy_type: str, optional
         Energy unit for the requested quantity. Default is R.
         Valid values: EKN, EK, R, ETOT, ETOTN.
@@ -267,13 +305,31 @@ def query(
     server_url: str, optional
         URL to send the request to. Default is http://lpsc.in2p3.fr/crdb). This is an
         expert option, users do not need to change this.
+    compact: bool, optional
+        If true, return a crdb.compact.CompactTable, which stores string columns as
+        integer codes plus a table of unique values. This uses much less memory.
+        Default is false.
+    revalidate: bool, optional
+        If true, ask the server whether a cached result is still up-to-date, even if
+        it was validated recently. Default is false.
+    backend: str, optional
+        Where the query is executed; one of 'server', 'local'. Default is 'server'.
+        With 'local', the query is answered from the full database returned by
+        crdb.all() without further server requests, see crdb.local.select() for
+        limitations.
+    max_workers: int, optional
+        Maximum number of concurrent server requests when several quantities are
+        queried. Default is 4. With 1, the requests are made one after another. This
+        has no effect for the local backend.
 
     Returns
     -------
     numpy record array with the database content
 
     Energies are in GeV or GV. Solar modulation values are in MV. Distances are in
-    AU. Fluxes are in sr s m2 energy_unit.
+    AU. Fluxes are in sr s m2 energy_unit. The time ranges in the datetime column are
+    also available as datetime64 columns time_start and time_stop, which hold the
+    envelope of all ranges, and time_ranges, which holds the number of ranges.
 
     Raises
     ------
@@ -288,16 +344,30 @@ def query(
 
     Notes
     -----
-    This function caches identical queries for 30 days. If you need to reset the cache,
-    do::
+    This function caches results on disk. A cached result is revalidated with the
+    server once per day or when revalidate is true, and only downloaded again if the
+    data on the server has changed. Results which the server sent without ETag or
+    Last-Modified header can only be revalidated by downloading them again, so this
+    happens once per month. If the server cannot be reached during an automatic
+    revalidation, the cached result is used. Cached tables are kept in memory and
+    loaded from disk as memory maps, see crdb.cache for details. The returned table
+    may be read-only, use table.copy() if you need to modify it. If you need to reset
+    the cache, do::
 
         from crdb import clear_cache
 
         clear_cache()
     """
+    if backend not in ("server", "local"):
+        raise ValueError(f"invalid backend {backend}")
+
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1")
+
     if not isinstance(quantity, str):
-        results = [
-            query(
+
+        def run(q: str) -> np.recarray:
+            return query(
                 quantity=q,
                 energy_type=energy_type,
                 combo_level=combo_level,
@@ -312,11 +382,83 @@ def query(
                 modulation=modulation,
                 server_url=server_url,
                 timeout=timeout,
+                compact=compact,
+                backend=backend,
+                revalidate=revalidate,
             )
-            for q in quantity
-        ]
-        return np.concatenate(results).view(np.recarray)  # type:ignore
 
+        quantity = list(quantity)
+        if backend == "local" or max_workers == 1 or len(quantity) < 2:
+            # the local backend is bound by the CPU, threads do not help
+            results = [run(q) for q in quantity]
+        else:
+            with ThreadPoolExecutor(min(max_workers, len(quantity))) as pool:
+                results = list(pool.map(run, quantity))
+        return _concatenate(results)
+
+    if backend == "local":
+        from crdb.local import select
+
+        return select(
+            all(
+                timeout=timeout,
+                compact=compact,
+                revalidate=revalidate,
+                server_url=server_url,
+            ),
+            quantity,
+            energy_type=energy_type,
+            combo_level=combo_level,
+            energy_convert_level=energy_convert_level,
+            flux_rescaling=flux_rescaling,
+            exp_dates=exp_dates,
+            energy_start=energy_start,
+            energy_stop=energy_stop,
+            time_start=time_start,
+            time_stop=time_stop,
+            time_series=time_series,
+            modulation=modulation,
+        )
+
+    return _query(
+        quantity,
+        energy_type=energy_type,
+        combo_level=combo_level,
+        energy_convert_level=energy_convert_level,
+        flux_rescaling=flux_rescaling,
+        exp_dates=exp_dates,
+        energy_start=energy_start,
+        energy_stop=energy_stop,
+        time_start=time_start,
+        time_stop=time_stop,
+        time_series=time_series,
+        modulation=modulation,
+        timeout=timeout,
+        server_url=server_url,
+        compact=compact,
+        revalidate=revalidate,
+    )
+
+
+def _query(
+    quantity: str,
+    *,
+    energy_type: str,
+    combo_level: int,
+    energy_convert_level: int,
+    flux_rescaling: float,
+    exp_dates: str,
+    energy_start: float,
+    energy_stop: float,
+    time_start: str,
+    time_stop: str,
+    time_series: str,
+    modulation: str,
+    timeout: int,
+    server_url: str,
+    compact: bool,
+    revalidate: bool,
+) -> np.recarray:
     url = _url(
         quantity=quantity,
         energy_type=energy_type,
@@ -334,19 +476,12 @@ def query(
         server_url=server_url,
     )
 
-    data = _server_request(url, timeout)
-
-    # check for errors and display them
-    if len(data) == 1:
-        raise ValueError(data[0])
-
-    table = _convert_csv(data, _CSV_ASIMPORT_FIELDS)
-
-    return table
+    return _cached_table(url, timeout, compact, revalidate)
 
 
-def _url(
-    quantity: str,
+def iter_query(
+    quantity: Union[str, Sequence[str]],
+    *,
     energy_type: str = "R",
     combo_level: int = 1,
     energy_convert_level: int = 1,
@@ -357,186 +492,364 @@ def _url(
     time_start: str = "",
     time_stop: str = "",
     time_series: str = "",
-    format: str = "",
     modulation: str = "",
+    timeout: int = 120,
     server_url: str = "http://lpsc.in2p3.fr/crdb",
-) -> str:
-    """Build a query URL for the CRDB server."""
-    num, *rest = quantity.split("/")
-    if len(rest) > 1:
-        raise ValueError("ratio contains more than one / operator")
-
-    num = num.strip()
-    den = rest[0].strip() if rest else ""
+    batch_size: int = 10000,
+) -> Iterator[np.recarray]:
+    """
+    Query CRDB and yield the table in batches while it is downloaded.
 
-    # "+" must be escaped in URL, see
-    # https://en.wikipedia.org/wiki/Percent-encoding
-    num = num.replace("+", "%2B")
-    den = den.replace("+", "%2B")
+    This is the streaming counterpart of crdb.query(), which accepts the same
+    parameters. The server response is parsed while it is downloaded, so the first
+    batch is available before the transfer is finished and the full response is never
+    held in memory. Results are not cached.
 
-    # workaround for empty error message from CRDB
-    valid_energy_types = ("EKN", "EK", "R", "ETOT", "ETOTN")
-    if energy_type.upper() not in valid_energy_types:
-        raise ValueError("energy_type must be one of " + ",".join(valid_energy_types))
+    Parameters
+    ----------
+    quantity: str or sequence of str
+        Element, isotope, particle, or mass group, or ratio of those, e.g. 'H', 'B/C'.
+        Multiple quantities are queried one after another.
+    batch_size: int, optional
+        Number of rows per batch. The last batch of each quantity may be shorter.
+        Default is 10000.
 
-    if combo_level not in (0, 1, 2):
-        raise ValueError(f"invalid combo_level {combo_level}")
+    Yields
+    ------
+    numpy record array with batch_size rows of the database content
 
-    if energy_convert_level not in (0, 1, 2):
-        raise ValueError(f"invalid energy_convert_level {energy_convert_level}")
+    Raises
+    ------
+    ValueError
+        An invalid parameter value triggers a ValueError.
 
-    if flux_rescaling < 0 or flux_rescaling > 2.5:
-        raise ValueError(f"invalid flux_rescaling {flux_rescaling}")
+    ConnectionError
+        If no connection to the server can be established.
 
-    if time_series and time_series not in ("no", "only", "all"):
-        raise ValueError(f"invalid time_series {time_series}")
+    TimeoutError
+        If the server does not respond within the timeout time.
+    """
+    quantities = [quantity] if isinstance(quantity, str) else quantity
+    for q in quantities:
+        url = _url(
+            quantity=q,
+            energy_type=energy_type,
+            combo_level=combo_level,
+            energy_convert_level=energy_convert_level,
+            flux_rescaling=flux_rescaling,
+            exp_dates=exp_dates,
+            energy_start=energy_start,
+            energy_stop=energy_stop,
+            time_start=time_start,
+            time_stop=time_stop,
+            time_series=time_series,
+            format="csv-asimport",
+            modulation=modulation,
+            server_url=server_url,
+        )
 
-    if format and format not in ("usine", "galprop", "csv", "csv-asimport"):
-        raise ValueError(f"invalid format {format}")
+        lines = _iter_lines(_iter_chunks(url, timeout))
 
-    if modulation and modulation not in ("USO05", "USO17", "GHE17"):
-        raise ValueError(f"invalid modulation {modulation}")
+        # check for errors and display them
+        first = next(lines)
+        second = next(lines, None)
+        if second is None:
+            raise ValueError(first)
 
-    # do the query
-    kwargs: Dict[str, Union[str, float, int]] = {
-        "num": num,
-        "energy_type": energy_type.upper(),
-    }
-    if den:
-        kwargs["den"] = den
-    if combo_level != 1:
-        kwargs["combo_level"] = combo_level
-    if energy_convert_level != 1:
-        kwargs["energy_convert_level"] = energy_convert_level
-    if flux_rescaling:
-        kwargs["flux_rescaling"] = flux_rescaling
-    if exp_dates:
-        kwargs["exp_dates"] = exp_dates
-    if energy_start:
-        kwargs["energy_start"] = energy_start
-    if energy_stop:
-        kwargs["energy_stop"] = energy_stop
-    if time_start:
-        kwargs["time_start"] = time_start
-    if time_stop:
-        kwargs["time_stop"] = time_stop
-    if time_series:
-        kwargs["time_series"] = time_series
-    if format:
-        kwargs["format"] = format
-    if modulation:
-        kwargs["modulation"] = modulation
-
-    url = f"{server_url}/rest.php?" + "&".join(
-        ["{0}={1}".format(k, v) for (k, v) in kwargs.items()]
-    )
-    return url
+        yield from _iter_csv(
+            itertools.chain((first, second), lines), _CSV_ASIMPORT_FIELDS, batch_size
+        )
 
 
-@cachier.cachier(stale_after=timedelta(days=30))
-def _server_request(url: str, timeout: int) -> List[str]:
-    # if there is a timeout error, we hide original long traceback from the internal
-    # libs and instead show a simple traceback
+def _cached_table(
+    url: str,
+    timeout: int,
+    compact: bool,
+    revalidate: bool,
+    sync_url: Optional[str] = None,
+) -> np.recarray:
+    # return table from memory cache, disk cache, or server
+    key = _table_key(url, compact)
+    if not revalidate:
+        table = _cache.memory.get(key, _REVALIDATE_AFTER)
+        if table is not None:
+            _emit("cache", url, layer="memory", result="hit")
+            return table
+        result = "stale" if key in _cache.memory else "miss"
+        _emit("cache", url, layer="memory", result=result)
+    table = _load_table(key, url, timeout, compact, revalidate, sync_url)
+    return _cache.memory.put(key, table, _cache.age(key))
+
+
+def _table_key(url: str, compact: bool) -> str:
+    return _cache.make_key("table", _TABLE_VERSION, url, compact)
+
+
+def _all_url(server_url: str) -> str:
+    return f"{server_url}/_export_all_data.php?format=csv-asimport"
+
+
+def _load_table(
+    key: str,
+    url: str,
+    timeout: int,
+    compact: bool,
+    revalidate: bool,
+    sync_url: Optional[str],
+) -> np.recarray:
+    # cached tables are revalidated with a conditional request, the payload hash
+    # catches unchanged data if the server does not support ETag or Last-Modified;
+    # if sync_url is set, the table is the full export of that server, which can be
+    # updated incrementally
+    start = time.perf_counter()
+    table = _cache.load(key)
+    meta = _cache.load_meta(key) if table is not None else {}
+    seconds = time.perf_counter() - start
+    if table is None:
+        _emit("cache", url, layer="disk", result="miss", seconds=seconds)
+    else:
+        age = _cache.age(key)
+        if meta.get("etag") or meta.get("last_modified"):
+            interval = _REVALIDATE_AFTER
+        else:
+            interval = _REVALIDATE_UNCONDITIONAL_AFTER
+        if not revalidate and age is not None and age < interval:
+            _emit("cache", url, layer="disk", result="hit", seconds=seconds)
+            return table
+        _emit("cache", url, layer="disk", result="stale", seconds=seconds)
+
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+    manifest = None
+    probed = False
     try:
-        context = ssl._create_unverified_context()
-        response = rq.urlopen(url, context=context, timeout=timeout)
-        connection_error = False
-    except Exception:
-        import traceback
-
-        traceback.print_exc()
-        connection_error = True
-
-    if connection_error:
-        raise ConnectionError(
-            "Please check if you can connect to https://lpsc.in2p3.fr/crdb with your "
-            f"browser. If that works, something is wrong with url = '{url}', "
-            "please report this as an issue at "
-            "https://github.com/crdb-project/crdb/issues"
+        if sync_url:
+            from crdb import sync
+
+            # the manifest is fetched first, so that it is never newer than the data;
+            # if the server had no manifest, it is not asked again unless the table is
+            # downloaded for the first time or revalidate is true
+            if table is None or revalidate or meta.get("manifest", {}) is not None:
+                try:
+                    manifest = sync.fetch_manifest(sync_url, timeout)
+                    probed = True
+                except (ConnectionError, TimeoutError):
+                    # the request for the data reports the error
+                    pass
+            if table is not None and manifest is not None and meta.get("manifest"):
+                updated = sync.update(
+                    table, meta["manifest"], manifest, sync_url, timeout, compact
+                )
+                if updated is table:
+                    _cache.touch(key)
+                    return table
+                table = updated
+                start = time.perf_counter()
+                _cache.save(key, table, {**meta, "manifest": manifest})
+                seconds = time.perf_counter() - start
+                _emit("cache", url, layer="disk", result="store", seconds=seconds)
+                return table
+        response = _open(url, timeout, headers)
+        if response.status == 304:
+            # we only send conditional requests if there is a cached table
+            assert table is not None
+            response.read()
+            _cache.touch(key)
+            return table
+        digest = hashlib.sha256()
+        chunks = _read_chunks(
+            response, url, timeout, parallel=_PARALLEL_RANGES, restart=True
         )
+        data = list(_iter_lines(_hashed(chunks, digest)))
+    except (ConnectionError, TimeoutError):
+        if table is None or revalidate:
+            raise
+        warnings.warn("could not revalidate cached result, using cached version")
+        return table
+
+    new_meta: Dict[str, Any] = {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "sha256": digest.hexdigest(),
+    }
+    if sync_url and (probed or meta.get("manifest", {}) is None):
+        # None means that the server does not publish a manifest
+        new_meta["manifest"] = manifest
+    if table is not None and new_meta["sha256"] == meta.get("sha256"):
+        _cache.touch(key, new_meta)
+        return table
 
-    blocksize = 256**2
-    Mb = 1024**2
-    nbytes = 0
-    chunks = []
-    while True:
-        timeout_error = False
-        try:
-            chunk = response.read(blocksize)
-        except TimeoutError:
-            timeout_error = True
-        if timeout_error:
-            raise TimeoutError(
-                f"server did not respond within timeout={timeout} to url={url}"
-            )
-        nbytes += len(chunk)
-        if not chunk:
-            break
-        chunks.append(chunk)
-        if chunks:  # show progress if there is more than one chunk
-            print(f"\r{nbytes / Mb:.2f} Mb downloaded", end="", flush=True)
-    if len(chunks) > 1:
-        print()
+    # check for errors and display them
+    if len(data) == 1:
+        raise ValueError(data[0])
+
+    start = time.perf_counter()
+    table = _convert_csv(data, _CSV_ASIMPORT_FIELDS, compact)
+    _emit("parse", url, rows=len(table), seconds=time.perf_counter() - start)
+    start = time.perf_counter()
+    _cache.save(key, table, new_meta)
+    _emit(
+        "cache", url, layer="disk", result="store", seconds=time.perf_counter() - start
+    )
+    return table
+
+
+def _hashed(chunks: Iterable[bytes], digest: "hashlib._Hash") -> Iterator[bytes]:
+    for chunk in chunks:
+        digest.update(chunk)
+        yield chunk
 
-    if len(chunks) == 1 and (not chunks[0] or chunks[0].isspace()):
-        raise ValueError("empty server response")
 
-    s = b"".join(chunks).decode("utf-8")
-    return s.split("\n")
+def _iter_lines(chunks: Iterable[bytes]) -> Iterator[str]:
+    # incremental version of bytes.decode("utf-8").split("\n"), which yields
+    # complete lines as soon as their chunk arrives
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    rest = ""
+    for chunk in chunks:
+        lines = (rest + decoder.decode(chunk)).split("\n")
+        rest = lines.pop()
+        yield from lines
+    yield rest + decoder.decode(b"", final=True)
 
 
 def _convert_csv(
     data: List[str],
     fields: Sequence[Union[None, Tuple[str, str], Tuple[str, str, Tuple[int]]]],
+    compact: bool = False,
 ) -> np.recarray:
     # convert text to numpy record array
-    mapping: List[Union[None, str, Tuple[str, int]]] = []
-    for f in fields:
-        if f is None:
-            mapping.append(None)
-        elif len(f) == 3:
-            (n,) = f[2]  # type:ignore
-            for k in range(n):
-                mapping.append((f[0], k))
-        else:
-            mapping.append(f[0])
-    fields = [x for x in fields if x is not None]
-
     for start, line in enumerate(data):
         if not line.startswith("#"):
             break
 
-    table = np.recarray(len(data) - start - 1, fields)
-    for idx, row in enumerate(csv.reader(data[start:-1])):
-        val: Union[str, int]
-        for val, key in zip(row, mapping):
-            if key is None:
-                continue
-            if isinstance(key, tuple):
-                key, pos = key
-                table[idx][key][pos] = val
-            else:
-                if key == "is_upper_limit":
-                    val = int(val)
-                table[idx][key] = val
-
-    # workaround: replace &amp; in sub_exp strings
-    sub_exps = np.unique(table["sub_exp"])
-    code = "&amp;"
-    for sub_exp in sub_exps:
-        if code not in sub_exp:
+    rows = [_csv_row(line) for line in data[start:-1] if line]
+    return _convert_rows(rows, fields, compact)
+
+
+def _iter_csv(
+    lines: Iterable[str],
+    fields: Sequence[Union[None, Tuple[str, str], Tuple[str, str, Tuple[int]]]],
+    batch_size: int,
+) -> Iterator[np.recarray]:
+    # streaming version of _convert_csv, which converts batches of batch_size rows;
+    # like _convert_csv, it skips the header and the last line
+    if batch_size < 1:
+        raise ValueError(f"invalid batch_size {batch_size}")
+    rows: List[List[str]] = []
+    header = True
+    previous = None
+    for line in lines:
+        if previous is not None:
+            header = header and previous.startswith("#")
+            if previous and not header:
+                rows.append(_csv_row(previous))
+                if len(rows) == batch_size:
+                    yield _convert_rows(rows, fields)
+                    rows = []
+        previous = line
+    if rows:
+        yield _convert_rows(rows, fields)
+
+
+def _csv_row(line: str) -> List[str]:
+    # plain str.split is much faster than csv.reader, which is only needed for
+    # lines with quoted fields; the columns are then converted in bulk
+    if '"' not in line:
+        return line.split(",")
+    return next(csv.reader((line,)))
+
+
+def _convert_rows(
+    rows: List[List[str]],
+    fields: Sequence[Union[None, Tuple[str, str], Tuple[str, str, Tuple[int]]]],
+    compact: bool = False,
+) -> np.recarray:
+    dtype = [x for x in fields if x is not None]
+    has_datetime = any(x[0] == "datetime" for x in dtype)
+    if has_datetime:
+        dtype += _DATETIME_FIELDS
+    if not rows:
+        table = np.recarray(0, dtype)
+        return _compact(table) if compact else table
+
+    # zip truncates to the shortest row, so a short row shows up here
+    mapping = _csv_mapping(fields)
+    columns = list(zip(*rows))
+    if len(columns) < len(mapping):
+        raise ValueError(
+            f"malformed CSV data: expected {len(mapping)} columns, got {len(columns)}"
+        )
+
+    arrays: Dict[str, NDArray] = {}
+    categories: Dict[str, NDArray] = {}
+    types = {f[0]: np.dtype(f[1:] if len(f) == 3 else f[1]) for f in dtype}
+    for col, key in zip(columns, mapping):
+        if key is None:
             continue
-        mask = table["sub_exp"] == sub_exp
-        table["sub_exp"][mask] = sub_exp.replace(code, "&")
+        if isinstance(key, tuple):
+            key, pos = key
+            if key not in arrays:
+                arrays[key] = np.empty((len(rows),) + types[key].shape)
+            arrays[key][:, pos] = np.array(col, dtype=types[key].base)
+        elif key == "is_upper_limit":
+            arrays[key] = np.array(col, dtype=int).astype(bool)
+        elif types[key].kind == "U":
+            if key == "sub_exp":
+                # workaround: replace &amp; in sub_exp strings
+                code = "&amp;"
+                fix = {s: s.replace(code, "&") for s in set(col) if code in s}
+                if fix:
+                    col = tuple(fix.get(s, s) for s in col)
+            if compact:
+                arrays[key], categories[key] = _encode(col, types[key])
+            else:
+                arrays[key] = np.array(col, dtype=types[key])
+        else:
+            arrays[key] = np.array(col, dtype=types[key])
+
+    if has_datetime:
+        # time ranges are parsed once per distinct value
+        if compact:
+            codes, values = arrays["datetime"], categories["datetime"]
+        else:
+            codes, values = _encode(arrays["datetime"].tolist(), types["datetime"])
+        arrays.update(_datetime_columns(codes, values))
 
     # workaround: err_stat_minus or err_sys_minus may be negative
     for x in ("sta", "sys"):
         field = f"err_{x}"
-        table[field] = np.abs(table[field])
+        arrays[field] = np.abs(arrays[field])
+
+    if compact:
+        return _encoded_table(arrays, categories)
 
+    table = np.recarray(len(rows), dtype)
+    for key, a in arrays.items():
+        table[key] = a
     return table
 
 
+def _csv_mapping(
+    fields: Sequence[Union[None, Tuple[str, str], Tuple[str, str, Tuple[int]]]],
+) -> List[Union[None, str, Tuple[str, int]]]:
+    # map CSV columns to table fields
+    mapping: List[Union[None, str, Tuple[str, int]]] = []
+    for f in fields:
+        if f is None:
+            mapping.append(None)
+        elif len(f) == 3:
+            (n,) = f[2]  # type:ignore
+            for k in range(n):
+                mapping.append((f[0], k))
+        else:
+            mapping.append(f[0])
+    return mapping
+
+
 def get_mean_datetime(timerange: str) -> Tuple[datetime, timedelta]:
     """
     Return the average time for a given time range.
@@ -565,6 +878,200 @@ def get_mean_datetime(timerange: str) -> Tuple[datetime, timedelta]:
     return dt1 + (dt2 - dt1) / 2, (dt2 - dt1) / 2
 
 
+def get_mean_datetimes(table: Any) -> Tuple[NDArray, NDArray]:
+    """
+    Return the average times for the time ranges of a table.
+
+    This is the vectorized version of get_mean_datetime(). Entries with multiple
+    time ranges are represented by the envelope of all ranges.
+
+    Parameters
+    ----------
+    table : array
+        CRDB table or array of CRDB time ranges.
+
+    Returns
+    -------
+    center : array of datetime64
+        Center of the time range.
+    half_width : array of timedelta64
+        Half of the duration of the time range.
+    """
+    if getattr(table, "dtype", None) is None or table.dtype.names is None:
+        start, stop = _datetime_envelope(np.asarray(table))
+    else:
+        start, stop = _datetime_envelope(table)
+    half_width = (stop - start).astype("m8[ms]") / 2
+    return start + half_width, half_width
+
+
+def _datetime_envelope(table: Any) -> Tuple[NDArray, NDArray]:
+    # start and stop of the envelope of all time ranges of each entry; table is a
+    # CRDB table or an array of time ranges
+    names = getattr(table.dtype, "names", None) or ()
+    if "time_start" in names:
+        return np.asarray(table.time_start), np.asarray(table.time_stop)
+    codes, values = _factorize(table.datetime if names else table)
+    start, stop, _ = _parse_time_ranges(values.tolist())
+    return start[codes], stop[codes]
+
+
+def _datetime_columns(codes: NDArray, values: NDArray) -> Dict[str, NDArray]:
+    # compute columns of _DATETIME_FIELDS from dictionary-encoded datetime column
+    start, stop, count = _parse_time_ranges(values.tolist())
+    return {
+        "time_start": start[codes],
+        "time_stop": stop[codes],
+        "time_ranges": count[codes],
+    }
+
+
+def _parse_time_ranges(values: List[str]) -> Tuple[NDArray, NDArray, NDArray]:
+    # return start and stop of the envelope of all time ranges and the number of time
+    # ranges of each value, values look like "<range>;<range>;..."
+    ranges = [v.split(";") for v in values]
+    count = np.fromiter(map(len, ranges), np.int16, len(ranges))
+    flat = list(itertools.chain.from_iterable(ranges))
+    start, stop = _parse_time_range_array(flat)
+    if len(flat) == len(values):
+        return start, stop, count
+    offsets = np.cumsum(count) - count
+    start = np.minimum.reduceat(start, offsets)
+    stop = np.maximum.reduceat(stop, offsets)
+    return start, stop, count
+
+
+def _parse_time_range_array(ranges: List[str]) -> Tuple[NDArray, NDArray]:
+    # vectorized parsing of "YYYY/MM/DD-HHMMSS:YYYY/MM/DD-HHMMSS"; values which do
+    # not match this format exactly are parsed one by one with _parse_datetime
+    n = len(ranges)
+    size = len("YYYY/MM/DD-HHMMSS:YYYY/MM/DD-HHMMSS")
+    valid = np.fromiter(map(len, ranges), np.intp, n) == size
+    a = np.array(ranges, dtype=f"U{size}").view(np.uint32).reshape(n, size)
+    a = a.astype(np.int64) - ord("0")
+    separators = {4: "/", 7: "/", 10: "-", 17: ":", 22: "/", 25: "/", 28: "-"}
+    for i in range(size):
+        if i in separators:
+            valid &= a[:, i] == ord(separators[i]) - ord("0")
+        else:
+            valid &= (a[:, i] >= 0) & (a[:, i] <= 9)
+    a[~valid] = 0
+
+    def number(i: int, k: int) -> NDArray:
+        return a[:, i : i + k] @ 10 ** np.arange(k - 1, -1, -1)
+
+    result = []
+    for offset in (0, 18):
+        year = number(offset, 4)
+        month = number(offset + 5, 2)
+        day = number(offset + 8, 2)
+        hour = number(offset + 11, 2)
+        minute = number(offset + 13, 2)
+        second = number(offset + 15, 2)
+        first = (year - 1970).astype("M8[Y]").astype("M8[M]") + (month - 1)
+        first = first.astype("M8[D]")
+        days = (first.astype("M8[M]") + 1).astype("M8[D]") - first
+        valid &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= days.astype(int))
+        valid &= (hour < 24) & (minute < 60) & (second < 60)
+        t = (first + (day - 1)).astype("M8[s]")
+        result.append(t + (hour * 3600 + minute * 60 + second))
+    start, stop = result
+    for i in np.flatnonzero(~valid):
+        s1, _, s2 = ranges[i].partition(":")
+        start[i] = _parse_datetime(s1)
+        stop[i] = _parse_datetime(s2)
+    return start, stop
+
+
+def _parse_datetime(s: str) -> np.datetime64:
+    # YYYY/MM/DD-HHMMSS, returns NaT for invalid input
+    s = s.strip()
+    try:
+        return np.datetime64(
+            f"{s[:4]}-{s[5:7]}-{s[8:10]}T{s[11:13]}:{s[13:15]}:{s[15:17]}", "s"
+        )
+    except ValueError:
+        return np.datetime64("NaT", "s")
+
+
+class ExperimentGroups(NamedTuple):
+    """
+    Grouping of table rows by experiment.
+
+    The rows of group k are ``order[offsets[k]:offsets[k + 1]]``.
+    """
+
+    #: group index for each row
+    labels: NDArray
+    #: experiment name of each group, in order of first appearance in the table
+    names: List[str]
+    #: row indices sorted by group, rows within a group keep their order
+    order: NDArray
+    #: start of each group in order, with a final entry equal to the number of rows
+    offsets: NDArray
+
+
+def experiment_groups(
+    table: np.recarray, combine: Sequence[str] = COMBINE
+) -> ExperimentGroups:
+    """
+    Group table rows by experiment.
+
+    This computes the same grouping as experiment_masks(), but returns one integer
+    label per row instead of one mask per experiment.
+
+    Parameters
+    ----------
+    table : array
+        CRDB database table.
+    combine : sequence of str, optional
+        Further combine all experiments which these common prefixes.
+        The default is to combine all experiments listed in crdb.COMBINE.
+
+    Returns
+    -------
+    ExperimentGroups
+        Named tuple with fields labels, names, order, and offsets.
+    """
+    inverse, sub_exps = _factorize(table.sub_exp)
+    exps = [_experiment_name(x) for x in sub_exps.tolist()]
+    # sub_exps is sorted, so all names with a common prefix form a contiguous range;
+    # the first matching prefix wins, so we assign in reverse order
+    lo = np.searchsorted(sub_exps, combine)
+    hi = np.searchsorted(sub_exps, [c + chr(0x10FFFF) for c in combine])
+    for c, i, j in reversed(list(zip(combine, lo, hi))):
+        exps[i:j] = [c] * (j - i)
+    names, sub_exp_label = np.unique(np.array(exps, dtype=str), return_inverse=True)
+    labels = sub_exp_label.reshape(-1)[inverse]
+
+    # relabel groups in order of first appearance
+    _, first = np.unique(labels, return_index=True)
+    rank = np.empty(len(first), dtype=np.intp)
+    rank[np.argsort(first)] = np.arange(len(first))
+    labels = rank[labels]
+    names = names[np.argsort(first)]
+
+    order = np.argsort(labels, kind="stable")
+    offsets = np.zeros(len(names) + 1, dtype=np.intp)
+    np.cumsum(np.bincount(labels, minlength=len(names)), out=offsets[1:])
+    return ExperimentGroups(labels, names.tolist(), order, offsets)
+
+
+def _factorize(col: Any) -> Tuple[NDArray, NDArray]:
+    # return integer codes and sorted unique values of a string column
+    if isinstance(col, np.ndarray):
+        # hashing is much faster than sorting long strings
+        return _encode(col.tolist(), col.dtype)
+    # StringColumn computes this on the integer codes
+    values, codes = np.unique(col, return_inverse=True)
+    return codes.reshape(-1), values
+
+
+def _experiment_name(sub_exp: str) -> str:
+    # experiment name without the data taking period, e.g. "AMS02 (2011/05)"
+    return sub_exp.partition("(")[0].strip()
+
+
 def experiment_masks(
     table: np.recarray, combine: Sequence[str] = COMBINE
 ) -> Dict[str, NDArray]:
@@ -586,31 +1093,18 @@ def experiment_masks(
     -------
     Dict[str, NDArray]
         Dictionary which maps the experiment name to its table mask.
-    """
-    d = {}
-    for key in np.unique(table.sub_exp):
-        for c in combine:
-            if key.startswith(c):
-                d[key] = c
-                break
-        else:
-            c = key[: key.index("(")]
-            d[key] = c.strip()
 
-    result = {}
-    for i, t in enumerate(table):
-        c = d[t.sub_exp]
-        if c not in result:
-            result[c] = np.zeros(len(table), dtype=bool)
-        result[c][i] = True
-    return result
+    See Also
+    --------
+    experiment_groups : Same grouping with one label per row, which uses less memory.
+    """
+    labels, names, _, _ = experiment_groups(table, combine)
+    return {name: labels == k for (k, name) in enumerate(names)}
 
 
 def clear_cache() -> None:
     """Delete the local CRDB cache."""
-    _server_request.clear_cache()
-    all.clear_cache()
-    query.clear_cache()
+    _cache.clear()
 
 
 def reference_urls(table: np.recarray) -> List[str]:
@@ -641,21 +1135,37 @@ def bibliography(table: np.recarray) -> Dict[str, str]:
     return result
 
 
-@cachier.cachier(stale_after=timedelta(days=30))
-def all(timeout: int = 120) -> NDArray:
+def all(
+    timeout: int = 120,
+    compact: bool = False,
+    revalidate: bool = False,
+    server_url: str = _SERVER_URL,
+) -> np.recarray:
     """Return the full raw CRDB database as a table.
 
     Parameters
     ----------
     timeout: int, optional
         Timeout for server response in seconds. Default is 120.
+    compact: bool, optional
+        If true, return a crdb.compact.CompactTable, which stores string columns as
+        integer codes plus a table of unique values. This uses much less memory.
+        Default is false.
+    revalidate: bool, optional
+        If true, ask the server whether a cached result is still up-to-date, even if
+        it was validated recently. Default is false.
+    server_url: str, optional
+        URL of the server. Default is https://lpsc.in2p3.fr/crdb. This is an expert
+        option, users do not need to change this.
 
     Returns
     -------
     numpy record array with the database content
 
     Energies are in GeV or GV. Solar modulation values are in MV. Distances are in
-    AU. Fluxes are in sr s m2 energy_unit.
+    AU. Fluxes are in sr s m2 energy_unit. The time ranges in the datetime column are
+    also available as datetime64 columns time_start and time_stop, which hold the
+    envelope of all ranges, and time_ranges, which holds the number of ranges.
 
     Raises
     ------
@@ -667,16 +1177,59 @@ def all(timeout: int = 120) -> NDArray:
 
     Notes
     -----
-    This function caches identical queries for 30 days. If you need to reset the cache,
-    do::
+    This function caches results on disk. A cached result is revalidated with the server
+    once per day or when revalidate is true, and only downloaded again if the data on
+    the server has changed. Results which the server sent without ETag or Last-Modified
+    header can only be revalidated by downloading them again, so this happens once per
+    month. If the server cannot be reached during an automatic revalidation, the cached
+    result is used. If a server other than the official one publishes a manifest of the
+    export, only the changed parts of the database are downloaded, see crdb.sync for
+    details. Downloads which fail with a temporary error are retried with exponential
+    backoff and resumed where they stopped, if the server supports range requests,
+    otherwise they are started over; large downloads are fetched in several parts in
+    parallel, if the server supports it. The download fails if it is not complete after
+    five times the timeout. Cached tables are kept in memory and loaded from disk as
+    memory maps, see crdb.cache for details. The returned table is read-only, use
+    table.copy() if you need to modify it. If you need to reset the cache, do::
 
         from crdb import clear_cache
 
         clear_cache()
     """
-    url = "https://lpsc.in2p3.fr/crdb/_export_all_data.php?format=csv-asimport"
-    data = _server_request(url, timeout)
-    return _convert_csv(data, _CSV_ASIMPORT_FIELDS)
+    # the official server does not publish a manifest, see crdb.sync
+    sync_url = None if server_url == _SERVER_URL else server_url
+    return _cached_table(_all_url(server_url), timeout, compact, revalidate, sync_url)
+
+
+def iter_all(timeout: int = 120, batch_size: int = 10000) -> Iterator[np.recarray]:
+    """
+    Yield the full raw CRDB database in batches while it is downloaded.
+
+    This is the streaming counterpart of crdb.all(). The server response is parsed
+    while it is downloaded, so the first batch is available before the transfer is
+    finished and the full database is never held in memory. Results are not cached.
+
+    Parameters
+    ----------
+    timeout: int, optional
+        Timeout for server response in seconds. Default is 120.
+    batch_size: int, optional
+        Number of rows per batch. The last batch may be shorter. Default is 10000.
+
+    Yields
+    ------
+    numpy record array with batch_size rows of the database content
+
+    Raises
+    ------
+    ConnectionError
+        If no connection to the server can be established.
+
+    TimeoutError
+        If the server does not respond within the timeout time.
+    """
+    lines = _iter_lines(_iter_chunks(_ALL_URL, timeout))
+    yield from _iter_csv(lines, _CSV_ASIMPORT_FIELDS, batch_size)
 
 
 def solar_system_composition() -> Dict[str, List[Tuple[int, float]]]:
@@ -0,0 +1,480 @@
+"""
+Indexed CRDB database.
+
+:class:`Database` holds the full database with the rows sorted by quantity,
+sub-experiment, and energy, and indices which map quantities, experiments, and
+references to their rows. Selections then take constant time instead of a scan over
+the whole table, e.g.::
+
+    db = crdb.Database()
+    tab = db["B/C"]
+    tab = db["B/C", "AMS02 (2011/05-2016/05)"]
+    tab = db.by_experiment("AMS02")
+    tab = db.by_reference("2016PhRvL.117w1103A")
+
+The rows of a quantity, and of a sub-experiment within a quantity, are contiguous,
+so these selections return views into the table. The rows of an experiment or a
+reference are spread over several quantities, they are gathered with an index in
+time proportional to the number of selected rows.
+
+For each quantity and energy type, an interval index over the energy bins answers
+range, overlap, and nearest-energy lookups for many energy windows at once, e.g.::
+
+    idx = db.energy_index("B/C", "R")
+    m = idx.overlap([1, 10, 100], [10, 100, 1000])
+    tab = db.table[m.rows[m.offsets[1] : m.offsets[2]]]  # bins overlapping 10-100 GV
+
+The indices and the order of the rows are stored in the cache next to the table
+returned by crdb.all(), so they are computed only once per version of the database.
+The sorted table itself is not stored, it is gathered from the cached table.
+"""
+
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+from numpy.typing import NDArray
+
+from crdb import cache as _cache
+from crdb.cache import _read_only_view
+from crdb.core import _SERVER_URL
+from crdb.core import _all_url
+from crdb.core import _experiment_name
+from crdb.core import _factorize
+from crdb.core import _table_key
+from crdb.core import all as _all
+
+__all__ = ("Database", "EnergyIndex", "Matches")
+
+# increment when the layout of the index changes
+_INDEX_VERSION = 3
+
+# arrays of the index which are passed to EnergyIndex
+_ENERGY_INDEX = (
+    "energy_e",
+    "energy_rows",
+    "bin_low",
+    "bin_high",
+    "bin_reach",
+    "bin_rows",
+)
+
+
+class Matches(NamedTuple):
+    """
+    Rows matched by a batch of energy windows.
+
+    The rows matched by window k are ``rows[offsets[k]:offsets[k + 1]]``, they index
+    Database.table.
+    """
+
+    #: start of the matches of each window, with a final entry equal to len(rows)
+    offsets: NDArray
+    #: row indices of the matches of all windows
+    rows: NDArray
+
+
+class EnergyIndex:
+    """
+    Interval index over the energy bins of one quantity and energy type.
+
+    Use Database.energy_index() to get an instance. The lookup methods accept
+    scalars or arrays of energies and handle all windows in one vectorized call.
+    Energies are in the units of the table.
+    """
+
+    def __init__(
+        self,
+        e: NDArray,
+        e_rows: NDArray,
+        low: NDArray,
+        high: NDArray,
+        reach: NDArray,
+        bin_rows: NDArray,
+    ):
+        # e is sorted, e_rows are the corresponding rows of the table; low is sorted,
+        # high and bin_rows correspond to low, reach is the running maximum of high
+        self._e = e
+        self._e_rows = e_rows
+        self._low = low
+        self._high = high
+        self._reach = reach
+        self._bin_rows = bin_rows
+
+    def __len__(self) -> int:
+        """Return number of rows."""
+        return len(self._e)
+
+    def range(self, lo: Any, hi: Any) -> Matches:
+        """
+        Return rows with lo <= e <= hi.
+
+        Parameters
+        ----------
+        lo : array_like
+            Lower ends of the windows.
+        hi : array_like
+            Upper ends of the windows.
+
+        Returns
+        -------
+        Matches
+            Matches of each window, sorted by energy.
+        """
+        lo, hi = _windows(lo, hi)
+        i = np.searchsorted(self._e, lo, side="left")
+        j = np.searchsorted(self._e, hi, side="right")
+        window, k = _expand(i, j)
+        return Matches(_offsets(window, len(lo)), self._e_rows[k])
+
+    def overlap(self, lo: Any, hi: Any) -> Matches:
+        """
+        Return rows whose energy bin overlaps with the window [lo, hi].
+
+        Parameters
+        ----------
+        lo : array_like
+            Lower ends of the windows.
+        hi : array_like
+            Upper ends of the windows.
+
+        Returns
+        -------
+        Matches
+            Matches of each window, sorted by lower end of the bin.
+        """
+        lo, hi = _windows(lo, hi)
+        # all bins before i end below lo, all bins from j on start above hi
+        i = np.searchsorted(self._reach, lo, side="left")
+        j = np.searchsorted(self._low, hi, side="right")
+        window, k = _expand(i, j)
+        mask = self._high[k] >= lo[window]
+        window = window[mask]
+        return Matches(_offsets(window, len(lo)), self._bin_rows[k[mask]])
+
+    def nearest(self, e: Any) -> NDArray:
+        """
+        Return rows with the energy nearest to e.
+
+        Parameters
+        ----------
+        e : array_like
+            Energies.
+
+        Returns
+        -------
+        array of int
+            Row index for each energy.
+        """
+        e = np.asarray(e, dtype=float)
+        n = len(self._e)
+        k = np.searchsorted(self._e, e)
+        left = np.clip(k - 1, 0, n - 1)
+        right = np.clip(k, 0, n - 1)
+        k = np.where(e - self._e[left] <= self._e[right] - e, left, right)
+        return self._e_rows[k]
+
+
+class Database:
+    """
+    CRDB table with indices for fast selections.
+
+    Parameters
+    ----------
+    table : array, optional
+        CRDB table in the format returned by crdb.all(). If None, the full database
+        is loaded with crdb.all() and the indices are cached. Default is None.
+    timeout : int, optional
+        Timeout for server response in seconds. Default is 120.
+    compact : bool, optional
+        Whether to use a compact table, see crdb.all(). Default is false.
+    revalidate : bool, optional
+        Whether to revalidate a cached table, see crdb.all(). Default is false.
+    server_url : str, optional
+        URL of the server. Default is https://lpsc.in2p3.fr/crdb.
+
+    Notes
+    -----
+    The options timeout, compact, revalidate, and server_url are passed to
+    crdb.all() and ignored if a table is passed. The table and all selections are
+    read-only, use table.copy() if you need to modify them.
+    """
+
+    #: table sorted by quantity, sub-experiment, and energy
+    table: np.recarray
+
+    def __init__(
+        self,
+        table: Optional[np.recarray] = None,
+        timeout: int = 120,
+        compact: bool = False,
+        revalidate: bool = False,
+        server_url: str = _SERVER_URL,
+    ):
+        if table is None:
+            table = _all(timeout, compact, revalidate, server_url)
+            blob = _cache.digest(_table_key(_all_url(server_url), compact))
+            table, index = _cached_index(table, blob)
+        else:
+            table, index = _build_index(table)
+        self.table = _read_only_view(table)
+        self._index = index
+        self._quantities = _lookup(index["quantities"])
+        self._sub_exps = _lookup(index["sub_exps"])
+        self._exps = _lookup(index["exps"])
+        self._refs = _lookup(index["refs"])
+        quantities = index["quantities"][index["energy_quantities"]]
+        self._energy_groups = {
+            key: i
+            for (i, key) in enumerate(
+                zip(quantities.tolist(), index["energy_e_types"].tolist())
+            )
+        }
+
+    def __len__(self) -> int:
+        """Return number of rows."""
+        return len(self.table)
+
+    def __contains__(self, quantity: str) -> bool:
+        """Return whether the database contains the quantity."""
+        return quantity in self._quantities
+
+    def __getitem__(self, key: Union[str, Tuple[str, str]]) -> np.recarray:
+        """
+        Return view of the rows of a quantity.
+
+        Parameters
+        ----------
+        key : str or (str, str)
+            Quantity or pair of quantity and sub-experiment.
+
+        Raises
+        ------
+        KeyError
+            If the quantity or the sub-experiment is not in the database.
+        """
+        quantity, sub_exp = (key, None) if isinstance(key, str) else key
+        k = self._quantities.get(quantity)
+        if k is None:
+            raise KeyError(quantity)
+        offsets = self._index["quantity_offsets"]
+        lo, hi = int(offsets[k]), int(offsets[k + 1])
+        if sub_exp is not None:
+            code = self._sub_exps.get(sub_exp)
+            if code is None:
+                raise KeyError(sub_exp)
+            # sub-experiments are sorted within a quantity
+            codes = self._index["sub_exp_codes"][lo:hi]
+            i, j = np.searchsorted(codes, [code, code + 1])
+            lo, hi = lo + int(i), lo + int(j)
+        return self.table[lo:hi]
+
+    def by_experiment(self, name: str) -> np.recarray:
+        """
+        Return rows of an experiment or sub-experiment.
+
+        Parameters
+        ----------
+        name : str
+            Name of a sub-experiment, e.g. "AMS02 (2011/05-2016/05)", or of an
+            experiment, e.g. "AMS02", which selects all its sub-experiments.
+
+        Returns
+        -------
+        Table sorted by sub-experiment, quantity, and energy.
+
+        Raises
+        ------
+        KeyError
+            If the name is not in the database.
+        """
+        k = self._sub_exps.get(name)
+        if k is not None:
+            lo, hi = self._index["sub_exp_bounds"][k]
+        else:
+            k = self._exps.get(name)
+            if k is None:
+                raise KeyError(name)
+            lo, hi = self._index["exp_offsets"][k : k + 2]
+        return self.table[self._index["exp_rows"][lo:hi]]
+
+    def by_reference(self, ads: str) -> np.recarray:
+        """
+        Return rows of a publication.
+
+        Parameters
+        ----------
+        ads : str
+            ADS reference key of the publication.
+
+        Returns
+        -------
+        Table sorted by quantity, sub-experiment, and energy.
+
+        Raises
+        ------
+        KeyError
+            If the reference is not in the database.
+        """
+        k = self._refs.get(ads)
+        if k is None:
+            raise KeyError(ads)
+        lo, hi = self._index["ref_offsets"][k : k + 2]
+        return self.table[self._index["ref_rows"][lo:hi]]
+
+    def energy_index(self, quantity: str, e_type: str) -> EnergyIndex:
+        """
+        Return interval index over the energy bins of a quantity.
+
+        Parameters
+        ----------
+        quantity : str
+            Quantity, e.g. "B/C".
+        e_type : str
+            Energy type, e.g. "R" or "EKN".
+
+        Raises
+        ------
+        KeyError
+            If the database contains no data for this quantity and energy type.
+        """
+        k = self._energy_groups.get((quantity, e_type))
+        if k is None:
+            raise KeyError((quantity, e_type))
+        lo, hi = self._index["energy_offsets"][k : k + 2]
+        return EnergyIndex(*(self._index[name][lo:hi] for name in _ENERGY_INDEX))
+
+    @property
+    def quantities(self) -> List[str]:
+        """Return sorted list of quantities."""
+        return list(self._quantities)
+
+    @property
+    def experiments(self) -> List[str]:
+        """Return sorted list of experiments."""
+        return list(self._exps)
+
+    @property
+    def references(self) -> List[str]:
+        """Return sorted list of ADS reference keys."""
+        return list(self._refs)
+
+
+def _lookup(names: NDArray) -> Dict[str, int]:
+    return {name: i for (i, name) in enumerate(names.tolist())}
+
+
+def _offsets(codes: NDArray, n: int) -> NDArray:
+    # start of each group in rows sorted by codes, plus the total number of rows
+    offsets = np.zeros(n + 1, dtype=np.intp)
+    np.cumsum(np.bincount(codes, minlength=n), out=offsets[1:])
+    return offsets
+
+
+def _windows(lo: Any, hi: Any) -> Tuple[NDArray, NDArray]:
+    lo, hi = np.broadcast_arrays(
+        np.asarray(lo, dtype=float), np.asarray(hi, dtype=float)
+    )
+    return lo.reshape(-1), hi.reshape(-1)
+
+
+def _expand(i: NDArray, j: NDArray) -> Tuple[NDArray, NDArray]:
+    # return window numbers and positions for the ranges i[k] <= position < j[k]
+    n = np.maximum(j - i, 0)
+    window = np.repeat(np.arange(len(n)), n)
+    start = np.cumsum(n) - n
+    k = np.arange(len(window)) + np.repeat(i - start, n)
+    return window, k
+
+
+def _energy_index(table: np.recarray, q_codes: NDArray) -> Dict[str, NDArray]:
+    # groups of rows with the same quantity and energy type, sorted by energy and by
+    # lower end of the energy bin, respectively
+    t_codes, e_types = _factorize(table.e_type)
+    groups = q_codes.astype(np.intp) * len(e_types) + t_codes
+    keys, counts = np.unique(groups, return_counts=True)
+    offsets = np.zeros(len(keys) + 1, dtype=np.intp)
+    np.cumsum(counts, out=offsets[1:])
+
+    e = np.asarray(table.e)
+    e_bin = np.asarray(table.e_bin)
+    energy_rows = np.lexsort((e, groups))
+    bin_rows = np.lexsort((e_bin[:, 0], groups))
+    high = e_bin[bin_rows, 1]
+    reach = np.empty_like(high)
+    for lo, hi in zip(offsets[:-1], offsets[1:]):
+        # fmax ignores NaN
+        np.fmax.accumulate(high[lo:hi], out=reach[lo:hi])
+    return {
+        "energy_quantities": keys // max(len(e_types), 1),
+        "energy_e_types": e_types[keys % max(len(e_types), 1)],
+        "energy_offsets": offsets,
+        "energy_e": e[energy_rows],
+        "energy_rows": energy_rows,
+        "bin_low": e_bin[bin_rows, 0],
+        "bin_high": high,
+        "bin_reach": reach,
+        "bin_rows": bin_rows,
+    }
+
+
+def _build_index(table: np.recarray) -> Tuple[np.recarray, Dict[str, NDArray]]:
+    q_codes, quantities = _factorize(table.quantity)
+    s_codes, sub_exps = _factorize(table.sub_exp)
+    order = np.lexsort((np.asarray(table.e), s_codes, q_codes))
+    table = table[order]
+    q_codes = q_codes[order]
+    s_codes = s_codes[order]
+
+    # rows of each experiment are ordered by sub-experiment, so that both form
+    # contiguous ranges in exp_rows
+    names = np.array([_experiment_name(x) for x in sub_exps.tolist()], sub_exps.dtype)
+    exp_of_sub_exp, exps = _factorize(names)
+    e_codes = exp_of_sub_exp[s_codes]
+    exp_rows = np.lexsort((s_codes, e_codes))
+    counts = np.bincount(s_codes, minlength=len(sub_exps))
+    groups = np.lexsort((np.arange(len(sub_exps)), exp_of_sub_exp))
+    starts = np.empty(len(sub_exps), dtype=np.intp)
+    starts[groups] = np.cumsum(counts[groups]) - counts[groups]
+
+    r_codes, refs = _factorize(table.ads)
+
+    index = {
+        "quantities": quantities,
+        "quantity_offsets": _offsets(q_codes, len(quantities)),
+        "sub_exps": sub_exps,
+        "sub_exp_codes": s_codes,
+        "sub_exp_bounds": np.stack([starts, starts + counts], axis=1),
+        "exps": exps,
+        "exp_offsets": _offsets(e_codes, len(exps)),
+        "exp_rows": exp_rows,
+        "refs": refs,
+        "ref_offsets": _offsets(r_codes, len(refs)),
+        "ref_rows": np.argsort(r_codes, kind="stable"),
+        # rows of the original table in the order of the sorted table
+        "order": order,
+    }
+    index.update(_energy_index(table, q_codes))
+    return table, index
+
+
+def _cached_index(
+    table: np.recarray, blob: Optional[str]
+) -> Tuple[np.recarray, Dict[str, NDArray]]:
+    # blob identifies the content of the cached table returned by crdb.all()
+    if blob is None:
+        return _build_index(table)
+    # only the permutation is stored, a sorted copy of the table would double the
+    # size of the cache
+    key = _cache.make_key("database", _INDEX_VERSION, blob, "index")
+    index = _cache.load_arrays(key)
+    if index is not None and len(index["order"]) == len(table):
+        return table[index["order"]], index
+    sorted_table, index = _build_index(table)
+    _cache.save_arrays(key, index)
+    return sorted_table, index
@@ -5,17 +5,22 @@ The functions in this module are not stable and their API can
 change at any time. Use with caution.
 """
 
-from typing import Dict, Tuple, Union
+import re
+from typing import Dict, Iterable, Tuple
 
 import numpy as np
 from numpy.typing import NDArray
 
 from crdb import ELEMENTS, valid_quantities
 from crdb import solar_system_composition
+from crdb.compact import CompactTable
 
 NUCLEON_MASS = 0.9389187543299999  # GeV
 ELECTRON_MASS = 0.51099895e-3  # GeV
 
+_E_TYPES = ("R", "EK", "EKN", "ETOT", "ETOTN")
+_LEPTONS = ("e-", "e+", "e-+e+")
+
 
 def energy_conversion_numbers() -> Dict[str, Tuple[int, float]]:
     """
@@ -25,23 +30,12 @@ def energy_conversion_numbers() -> Dict[str, Tuple[int, float]]:
     -------
     dict
         Maps the quantity name to a tuple (Z, A), where Z is the atomic number and A is
-        the number of nucleons. Returns (1, NaN) for electrons and positrons.
+        the number of nucleons. For elements, A is the average over the isotopes in the
+        solar system. Returns (1, NaN) for electrons and positrons.
     """
-    comp = solar_system_composition()
-    result = {k: (1, np.nan) for k in ("e-", "e+", "e-+e+")}
-    for key, z in ELEMENTS.items():
-        if key in comp:
-            a, w = np.transpose(comp[key])
-            a_mean = np.average(a, weights=w)
-        else:
-            a_mean = np.nan
-        result[key] = (z, a_mean)
-
-    for key in valid_quantities():
-        if key.endswith("-bar") and key[:-4] in result:
-            result[key] = result[key[:-4]]
-
-    return result
+    return _conversion_numbers(
+        list(_LEPTONS) + list(ELEMENTS) + sorted(valid_quantities())
+    )
 
 
 def convert_energy(
@@ -50,71 +44,145 @@ def convert_energy(
     """
     Convert e_type of all convertible quantities to target and removes the rest.
 
+    The conversions use relativistic kinematics with the rest mass m, which is
+    A * NUCLEON_MASS for nuclei and ELECTRON_MASS for leptons: the total energy is
+    ETOT = EK + m and the rigidity is R = sqrt(ETOT^2 - m^2) / Z. Values and
+    uncertainties are divided by the derivative of the new energy with respect to the
+    old energy.
+
     Parameters
     ----------
     table : array
         CRDB table.
     target : str, optional
-        What to convert the e_axis to.
+        What to convert the e_axis to. One of R, EK, EKN, ETOT, ETOTN.
     approximate : bool, optional
         Whether approximate conversion is allowed. An approximate conversion
         happens when an elemental flux with an unknown isotopic composition
-        is converted and the effective number of nucleons is required.
-        Default is true.
+        is converted and the effective number of nucleons is required. This is the
+        case for all conversions of elements and their anti-particles, except
+        between EKN and ETOTN. Default is true.
 
     Returns
     -------
     Converted table.
     """
-    ecn = energy_conversion_numbers()
-
-    result = table.copy()
-    for i, t in enumerate(result):
-        z, a = ecn.get(t.quantity, (np.nan, np.nan))
-        if t.e_type == "R":
-            if target == "R":
-                pass
-            elif target == "EK":
-                _convert_energy(result, i, z)
-                result[i].e_type = target
-            elif target == "EKN":
-                _convert_energy(result, i, z / a)
-                result[i].e_type = target
-            else:
-                assert False
-        elif t.e_type == "EK":
-            if target == "R":
-                _convert_energy(result, i, 1 / z)
-                result[i].e_type = target
-            elif target == "EK":
-                pass
-            elif target == "EKN":
-                _convert_energy(result, i, 1 / a)
-                result[i].e_type = target
-            else:
-                assert False
-        elif t.e_type == "EKN":
-            if target == "R":
-                _convert_energy(result, i, a / z)
-                result[i].e_type = target
-            elif target == "EK":
-                _convert_energy(result, i, a)
-                result[i].e_type = target
-            elif target == "EKN":
-                pass
-            else:
-                assert False
-
-    return result[~np.isnan(result.value) & (result.e_type == target)]
+    if target not in _E_TYPES:
+        raise ValueError(f"target must be one of {', '.join(_E_TYPES)}")
+
+    quantities, inverse = np.unique(table.quantity, return_inverse=True)
+    ecn = _conversion_numbers(quantities)
+    za = np.array([ecn.get(q, (np.nan, np.nan)) for q in quantities], dtype=float)
+    z, a = za.reshape(-1, 2)[inverse].T
+    # anti-particles have the same Z and A as their particles
+    names = [q[:-4] if q.endswith("-bar") else q for q in quantities.tolist()]
+    is_lepton = np.isin(names, _LEPTONS)[inverse]
+    mass = np.where(is_lepton, ELECTRON_MASS, a * NUCLEON_MASS)
+
+    e_type = np.asarray(table.e_type)
+    target_type = np.full(len(e_type), target)
+    col = np.s_[:, np.newaxis]
+    total = _total_energy(table.e, e_type, z, a, mass)
+    e = _from_total_energy(total, target_type, z, a, mass)
+    e_bin = _from_total_energy(
+        _total_energy(table.e_bin, e_type[col], z[col], a[col], mass[col]),
+        target_type[col],
+        z[col],
+        a[col],
+        mass[col],
+    )
+    # derivative of the new energy with respect to the old energy
+    with np.errstate(divide="ignore", invalid="ignore"):
+        f = _derivative(total, target_type, z, a, mass) / _derivative(
+            total, e_type, z, a, mass
+        )
+    same = e_type == target
+    e[same] = table.e[same]
+    e_bin[same] = table.e_bin[same]
+    f[same] = 1
+
+    ok = same | (np.isfinite(f) & np.isfinite(e))
+    if not approximate:
+        # the mass of elements depends on A, which is an average over isotopes;
+        # only EKN and ETOTN differ by NUCLEON_MASS, independent of A
+        is_element = np.isin(names, list(ELEMENTS))[inverse]
+        per_nucleon = np.isin(e_type, ("EKN", "ETOTN")) & (target in ("EKN", "ETOTN"))
+        ok &= same | per_nucleon | ~is_element
+
+    result = table[ok].copy()
+    f = f[ok]
+    result.e = e[ok]
+    result.e_bin = e_bin[ok]
+    result.value /= f
+    result.err_sta /= f[col]
+    result.err_sys /= f[col]
+    result = result[~np.isnan(result.value)]
+
+    if isinstance(result, CompactTable):
+        # all rows now have the same e_type
+        np.ndarray.__setitem__(result, "e_type", 0)
+        result.categories = dict(result.categories)
+        result.categories["e_type"] = np.array([target], dtype=e_type.dtype)
+    else:
+        result.e_type = target
+    return result
 
 
-def _convert_energy(
-    tab: np.recarray, mask: Union[int, NDArray], f: Union[float, NDArray]
-) -> None:
-    if np.ndim(f) > 0:
-        f.shape = (len(f), 1)  # type:ignore
-    tab[mask].e *= f
-    tab[mask].e_bin *= f
-    tab[mask].value /= f
-    tab[mask].err_sta /= f
-    tab[mask].err_sys /= f
+def _total_energy(
+    x: NDArray, e_type: NDArray, z: NDArray, a: NDArray, mass: NDArray
+) -> NDArray:
+    # total energy of a particle with energy x of type e_type
+    with np.errstate(invalid="ignore"):
+        return np.select(
+            [e_type == "R", e_type == "EK", e_type == "EKN", e_type == "ETOT"],
+            [np.hypot(z * x, mass), x + mass, a * x + mass, x],
+            np.where(e_type == "ETOTN", a * x, np.nan),
+        )
+
+
+def _from_total_energy(
+    total: NDArray, e_type: NDArray, z: NDArray, a: NDArray, mass: NDArray
+) -> NDArray:
+    # energy of type e_type of a particle with the total energy
+    with np.errstate(divide="ignore", invalid="ignore"):
+        momentum = np.sqrt(total**2 - mass**2)
+        return np.select(
+            [e_type == "R", e_type == "EK", e_type == "EKN", e_type == "ETOT"],
+            [momentum / z, total - mass, (total - mass) / a, total],
+            np.where(e_type == "ETOTN", total / a, np.nan),
+        )
+
+
+def _derivative(
+    total: NDArray, e_type: NDArray, z: NDArray, a: NDArray, mass: NDArray
+) -> NDArray:
+    # derivative of the energy of type e_type with respect to the total energy
+    with np.errstate(divide="ignore", invalid="ignore"):
+        momentum = np.sqrt(total**2 - mass**2)
+        return np.select(
+            [e_type == "R", e_type == "EK", e_type == "EKN", e_type == "ETOT"],
+            [total / (z * momentum), 1.0, 1 / a, 1.0],
+            np.where(e_type == "ETOTN", 1 / a, np.nan),
+        )
+
+
+def _conversion_numbers(names: Iterable[str]) -> Dict[str, Tuple[int, float]]:
+    # (Z, A) for leptons, elements, isotopes, and their anti-particles
+    comp = solar_system_composition()
+    result: Dict[str, Tuple[int, float]] = {}
+    for name in names:
+        key = name[:-4] if name.endswith("-bar") else name
+        if key in _LEPTONS:
+            result[name] = (1, np.nan)
+        elif key in ELEMENTS:
+            if key in comp:
+                a, w = np.transpose(comp[key])
+                a_mean = np.average(a, weights=w)
+            else:
+                a_mean = np.nan
+            result[name] = (ELEMENTS[key], a_mean)
+        else:
+            m = re.match(r"^([0-9]+)([A-Z][a-z]?)$", key)
+            if m and m.group(2) in ELEMENTS:
+                result[name] = (ELEMENTS[m.group(2)], float(m.group(1)))
+    return result
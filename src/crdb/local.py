@@ -0,0 +1,308 @@
+"""
+Local query engine.
+
+The functions in this module answer queries from a CRDB table which is already in
+memory, usually the full database returned by crdb.all(). No server requests are
+made. This is used by crdb.query() when called with ``backend="local"``.
+"""
+
+from typing import List
+from typing import Sequence
+from typing import Set
+from typing import Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from crdb.compact import CompactTable
+from crdb.compact import compact as _compact
+from crdb.compact import concatenate as _concatenate
+from crdb.core import _datetime_envelope
+from crdb.core import _url
+
+__all__ = ("select",)
+
+# sub-experiments which cover less than this are candidates for time series
+_TIME_SERIES_MAX_DURATION = np.timedelta64(365, "D")
+# minimum number of short sub-experiments per experiment and quantity which form a
+# time series
+_TIME_SERIES_MIN_COUNT = 3
+
+
+def select(
+    table: np.recarray,
+    quantity: str,
+    *,
+    energy_type: str = "R",
+    combo_level: int = 1,
+    energy_convert_level: int = 1,
+    flux_rescaling: float = 0.0,
+    exp_dates: str = "",
+    energy_start: float = 0.0,
+    energy_stop: float = 0.0,
+    time_start: str = "",
+    time_stop: str = "",
+    time_series: str = "",
+    modulation: str = "",
+) -> np.recarray:
+    """
+    Select data from a CRDB table like the CRDB server does.
+
+    The parameters have the same meaning as in crdb.query().
+
+    With combo_level > 0, ratios are also computed from native data of the same
+    sub-experiment, if the sub-experiment has no native data for the ratio: from the
+    fluxes of numerator and denominator, from the inverse ratio, or as a product of
+    two ratios num/X and X/den. Points are matched if their mean energies agree
+    within 5 % (combo_level=1) or 20 % (combo_level=2). The resulting point uses the
+    energy, energy bin, and meta data of the first factor. Errors are propagated
+    linearly and added in quadrature.
+
+    Some information is not contained in the table and is approximated:
+
+    - Time series are identified heuristically: a sub-experiment is part of a time
+      series if it covers less than one year and if its experiment has at least
+      three such sub-experiments for the same quantity.
+    - Only the default Solar modulation values are available.
+
+    Parameters
+    ----------
+    table : array
+        CRDB table, usually the output of crdb.all().
+    quantity : str
+        Element, isotope, particle, or mass group, or ratio of those, e.g. 'H', 'B/C'.
+    **kwargs :
+        See crdb.query().
+
+    Returns
+    -------
+    numpy record array with the selected data
+
+    Raises
+    ------
+    ValueError
+        An invalid parameter value or a quantity which is not in the table.
+    """
+    # validate parameters like the server does
+    _url(
+        quantity,
+        energy_type=energy_type,
+        combo_level=combo_level,
+        energy_convert_level=energy_convert_level,
+        flux_rescaling=flux_rescaling,
+        exp_dates=exp_dates,
+        energy_start=energy_start,
+        energy_stop=energy_stop,
+        time_start=time_start,
+        time_stop=time_stop,
+        time_series=time_series,
+        modulation=modulation,
+    )
+    if modulation and modulation != "GHE17":
+        raise ValueError(f"modulation {modulation} is not available locally")
+
+    quantity = "/".join(x.strip() for x in quantity.split("/"))
+    energy_type = energy_type.upper()
+
+    def prepare(q: str) -> np.recarray:
+        t = table[table.quantity == q]
+
+        if not time_series or time_series == "no":
+            t = t[~_time_series_mask(t)]
+        elif time_series == "only":
+            t = t[_time_series_mask(t)]
+
+        if exp_dates:
+            t = t[_exp_dates_mask(t, exp_dates)]
+
+        if time_start or time_stop:
+            start, stop = _datetime_envelope(t)
+            mask = np.ones(len(t), dtype=bool)
+            if time_start:
+                mask &= start >= _parse_time_limit(time_start)
+            if time_stop:
+                mask &= stop <= _parse_time_limit(time_stop, 1)
+            t = t[mask]
+
+        return _convert(t, energy_type, energy_convert_level)
+
+    available = set(np.unique(table.quantity))
+    sources = [[(quantity, 1)]]
+    if combo_level and "/" in quantity:
+        sources += _combo_sources(quantity, available)
+    sources = [s for s in sources if all(q in available for (q, _) in s)]
+    if not sources:
+        raise ValueError(f"quantity {quantity} not found")
+
+    parts = []
+    covered: Set[str] = set()
+    tolerance = (0.05, 0.2)[combo_level - 1] if combo_level else 0.0
+    for source in sources:
+        if len(source) == 1 and source[0][1] == 1:
+            t = prepare(quantity)
+        else:
+            t = _combine(
+                quantity, [(prepare(q), p) for (q, p) in source], tolerance, covered
+            )
+        covered.update(np.unique(t.sub_exp))
+        parts.append(t)
+    result = _concatenate(parts)
+
+    if energy_start:
+        result = result[result.e >= energy_start]
+    if energy_stop:
+        result = result[result.e <= energy_stop]
+
+    if flux_rescaling and "/" not in quantity:
+        result = result.copy()
+        f = result.e**flux_rescaling
+        result.value *= f
+        result.err_sta *= f[:, np.newaxis]
+        result.err_sys *= f[:, np.newaxis]
+
+    return result
+
+
+def _convert(table: np.recarray, energy_type: str, level: int) -> np.recarray:
+    native = table.e_type == energy_type
+    if level == 0 or np.all(native):
+        return table[native]
+
+    from crdb.experimental import convert_energy
+
+    other = table[~native]
+    if len(other) == 0:
+        return table[native]
+    # level 1 only allows conversions which do not depend on the unknown isotopic
+    # composition of elements
+    converted = convert_energy(other, energy_type, approximate=level == 2)
+    return _concatenate([table[native], converted])
+
+
+def _combo_sources(quantity: str, available: Set[str]) -> List[List[Tuple[str, int]]]:
+    # combinations which yield the ratio num/den, as lists of (quantity, power)
+    num, den = quantity.split("/")
+    sources = [[(num, 1), (den, -1)], [(f"{den}/{num}", -1)]]
+    for q in sorted(available):
+        n, _, x = q.partition("/")
+        if n == num and x and x != den:
+            sources.append([(q, 1), (f"{x}/{den}", 1)])
+    return sources
+
+
+def _combine(
+    quantity: str,
+    factors: List[Tuple[np.recarray, int]],
+    tolerance: float,
+    exclude: Set[str],
+) -> np.recarray:
+    # compute product of powers of the factors for points of the same sub-experiment
+    # which match in energy; the first factor provides energy and meta data
+    first = factors[0][0]
+    if isinstance(first, CompactTable):
+        factors = [(t.expand(), p) for (t, p) in factors]
+    result = factors[0][0]
+    result = result[~np.isin(result.sub_exp, list(exclude))]
+    indices = [np.arange(len(result))]
+    for t, _ in factors[1:]:
+        ia, ib = _match(result, t, tolerance)
+        result = result[ia]
+        indices = [i[ia] for i in indices] + [ib]
+
+    result = result.copy()
+    result.quantity = quantity
+    result.value = 1
+    rel = {"err_sta": np.zeros((len(result), 2)), "err_sys": np.zeros((len(result), 2))}
+    upper_limit = np.zeros(len(result), dtype=bool)
+    valid = np.ones(len(result), dtype=bool)
+    for (t, p), i in zip(factors, indices):
+        t = t[i]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result.value *= t.value**p
+            for key in rel:
+                r = getattr(t, key) / t.value[:, np.newaxis]
+                # lower and upper error swap for negative powers
+                rel[key] += r[:, ::-1] ** 2 if p < 0 else r**2
+        if p > 0:
+            upper_limit |= t.is_upper_limit
+        else:
+            valid &= ~t.is_upper_limit
+    for key in rel:
+        setattr(result, key, np.abs(result.value)[:, np.newaxis] * np.sqrt(rel[key]))
+    result.is_upper_limit = upper_limit
+    result = result[valid]
+    return _compact(result) if isinstance(first, CompactTable) else result
+
+
+def _match(a: np.recarray, b: np.recarray, tolerance: float) -> Tuple[NDArray, NDArray]:
+    # find for each point in a the point in b of the same sub-experiment which is
+    # nearest in energy; pairs which do not match within tolerance are dropped
+    ia = np.flatnonzero(a.e > 0)
+    ib = np.flatnonzero(b.e > 0)
+    if len(ia) == 0 or len(ib) == 0:
+        return ia[:0], ib[:0]
+    a = a[ia]
+    b = b[ib]
+    _, codes = np.unique(
+        np.concatenate([np.asarray(a.sub_exp), np.asarray(b.sub_exp)]),
+        return_inverse=True,
+    )
+    ka = codes[: len(a)]
+    kb = codes[len(a) :]
+    # map (sub-experiment, log(energy)) to a single sortable number, so that one
+    # searchsorted call finds the neighbors within the same sub-experiment
+    la = np.log(a.e)
+    lb = np.log(b.e)
+    offset = 2 * max(np.max(np.abs(la)), np.max(np.abs(lb))) + 1
+    va = ka * offset + la
+    vb = kb * offset + lb
+    order = np.argsort(vb)
+    vb = vb[order]
+    i = np.searchsorted(vb, va)
+    lo = np.maximum(i - 1, 0)
+    hi = np.minimum(i, len(vb) - 1)
+    j = order[np.where(np.abs(vb[lo] - va) <= np.abs(vb[hi] - va), lo, hi)]
+    ok = (kb[j] == ka) & (np.abs(b.e[j] / a.e - 1) <= tolerance)
+    return ia[ok], ib[j[ok]]
+
+
+def _time_series_mask(table: np.recarray) -> NDArray:
+    start, stop = _datetime_envelope(table)
+    short = (stop - start) < _TIME_SERIES_MAX_DURATION
+    if not np.any(short):
+        return short
+    # count distinct short sub-experiments per experiment and quantity
+    _, exp_idx = np.unique(table.exp, return_inverse=True)
+    quantities, q_idx = np.unique(table.quantity, return_inverse=True)
+    key_idx = exp_idx * len(quantities) + q_idx
+    _, sub_idx = np.unique(table.sub_exp, return_inverse=True)
+    pairs = np.unique(np.stack([key_idx[short], sub_idx[short]]), axis=1)
+    counts = np.bincount(pairs[0], minlength=key_idx.max() + 1)
+    return short & (counts[key_idx] >= _TIME_SERIES_MIN_COUNT)
+
+
+def _exp_dates_mask(table: np.recarray, exp_dates: str) -> NDArray:
+    # items with a time interval select sub-experiments, items without select
+    # experiments
+    mask = np.zeros(len(table), dtype=bool)
+    names = [x.strip() for x in exp_dates.split(",") if x.strip()]
+    sub_exp = _normalize(table.sub_exp)
+    for name in names:
+        if "(" in name:
+            mask |= sub_exp == _normalize([name])[0]
+        else:
+            mask |= table.exp == name
+    return mask
+
+
+def _normalize(names: Sequence[str]) -> NDArray:
+    # remove all whitespace, so that "AMS02 (2011/05)" matches "AMS02(2011/05)"
+    values, inverse = np.unique(names, return_inverse=True)
+    return np.array(["".join(v.split()) for v in values])[inverse]
+
+
+def _parse_time_limit(s: str, offset: int = 0) -> np.datetime64:
+    # format is YYYY[/MM]; offset shifts by one year or month to get the exclusive
+    # upper limit
+    t = np.datetime64(s.strip().replace("/", "-"))
+    return (t + offset).astype("datetime64[s]")
@@ -0,0 +1,338 @@
+"""
+Local mirror of the CRDB server.
+
+The mirror answers requests from a snapshot of the full database, which is kept in
+memory as a :class:`crdb.Database`. It serves
+
+- ``rest.php``, the query interface used by crdb.query() and the command line
+  interface, in the formats 'csv' and 'csv-asimport',
+- ``_export_all_data.php`` and ``_export_manifest.php``, which are used by
+  crdb.all() to download and update the full database, see crdb.sync.
+
+Start the mirror with ``crdb serve`` and pass its URL as server_url, e.g.::
+
+    $ crdb serve --host 0.0.0.0 --port 8000
+
+    tab = crdb.query("B/C", server_url="http://mirror.example.org:8000")
+
+Queries are answered with crdb.local.select(), so the same approximations apply.
+Columns of the csv-asimport format which are not part of the table, like the
+description of a sub-experiment, are left empty. Responses carry an ETag, so that
+clients revalidate their cache without downloading unchanged data.
+"""
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+from urllib.parse import parse_qsl
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from crdb.compact import concatenate as _concatenate
+from crdb.core import _CSV_ASIMPORT_FIELDS
+from crdb.core import _CSV_FIELDS
+from crdb.core import _SERVER_URL
+from crdb.core import _csv_mapping
+from crdb.core import _factorize
+from crdb.database import Database
+from crdb.local import select as _select
+
+__all__ = ("Mirror", "Reply", "make_server")
+
+# header lines of the CSV formats, the client skips lines which start with #
+_CSV_ASIMPORT_HEADER = (
+    "# EXP-NAME,EXP-TYPE,EXP-HTML,EXP-STARTYEAR,SUBEXP-NAME,SUBEXP-DESCRIPTION,"
+    "SUBEXP-ESCALE_RELERR,SUBEXP-INFO,SUBEXP-DISTANCE,SUBEXP-DATES,PUBLI-HTML,"
+    "PUBLI-DATAORIGIN,DATA-QTY,DATA-EAXIS,DATA-E_MEAN,DATA-E_BIN_L,DATA-E_BIN_U,"
+    "DATA-VAL,DATA-VAL_ERRSTAT_L,DATA-VAL_ERRSTAT_U,DATA-VAL_ERRSYST_L,"
+    "DATA-VAL_ERRSYST_U,DATA-ISUPPERLIM,phi"
+)
+_CSV_HEADER = (
+    "# DATA-QTY,SUBEXP-NAME,DATA-EAXIS,DATA-E_MEAN,EBIN_LOW,EBIN_HIGH,VALUE,"
+    "ERR_STAT-,ERR_STAT+,ERR_SYST-,ERR_SYST+,ADS,phi,DISTANCE,DATIMES,ISUPPERLIM"
+)
+
+# parameters of rest.php besides num, den, and format, with their types
+_QUERY_PARAMETERS = (
+    ("energy_type", str),
+    ("combo_level", int),
+    ("energy_convert_level", int),
+    ("flux_rescaling", float),
+    ("exp_dates", str),
+    ("energy_start", float),
+    ("energy_stop", float),
+    ("time_start", str),
+    ("time_stop", str),
+    ("time_series", str),
+    ("modulation", str),
+)
+
+# maximum number of query responses which are kept in memory
+_MAX_REPLIES = 256
+# responses of at least this size are also stored with gzip compression
+_GZIP_MIN_SIZE = 1 << 16
+
+
+class Reply(NamedTuple):
+    """Response of the mirror to a request."""
+
+    #: HTTP status code
+    status: int
+    #: response body
+    body: bytes
+    #: entity tag of the body, including the quotes
+    etag: str
+    #: gzip compressed body, or None if the body is small
+    gzipped: Optional[bytes]
+
+
+class Mirror:
+    """
+    Answers requests to the CRDB server from a local database.
+
+    The reply to a request depends only on the path and query of the URL, so that
+    the mirror can be used with any HTTP server. Use make_server() to get a server
+    which uses the mirror.
+
+    Parameters
+    ----------
+    db : Database, optional
+        Database to serve. If None, the full database is loaded from the cache or
+        from the server. Default is None.
+    timeout : int, optional
+        Timeout for server response in seconds, used if db is None. Default is 120.
+    server_url : str, optional
+        URL of the server to load the database from, used if db is None. Default is
+        https://lpsc.in2p3.fr/crdb.
+
+    Notes
+    -----
+    This class is thread-safe.
+    """
+
+    def __init__(
+        self,
+        db: Optional[Database] = None,
+        timeout: int = 120,
+        server_url: str = _SERVER_URL,
+    ):
+        if db is None:
+            db = Database(timeout=timeout, server_url=server_url)
+        self.db = db
+
+        # the full export is partitioned by reference like the upstream export, the
+        # rows are formatted once
+        table = db.table
+        lines = _csv_lines(table, _CSV_ASIMPORT_FIELDS)
+        codes, refs = _factorize(table.ads)
+        order = np.argsort(codes, kind="stable")
+        offsets = np.searchsorted(codes[order], np.arange(len(refs) + 1))
+        self._partitions = {
+            ref: "\n".join(lines[i] for i in order[lo:hi].tolist())
+            for (ref, lo, hi) in zip(refs.tolist(), offsets[:-1], offsets[1:])
+        }
+        self._export = _reply(
+            "\n".join([_CSV_ASIMPORT_HEADER, *self._partitions.values(), ""])
+        )
+        self._manifest = _reply(
+            "".join(
+                f"{ref},{hashlib.sha256(part.encode()).hexdigest()[:16]}\n"
+                for (ref, part) in self._partitions.items()
+            )
+        )
+        self._replies: "OrderedDict[str, Reply]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def respond(self, target: str) -> Reply:
+        """
+        Return reply to a request.
+
+        Parameters
+        ----------
+        target : str
+            Path and query of the request URL, e.g. "/crdb/rest.php?num=B&den=C".
+            Only the last component of the path is used.
+
+        Returns
+        -------
+        Reply
+            Invalid queries are answered like the CRDB server does, with status 200
+            and a body which consists of the error message.
+        """
+        url = urlsplit(target)
+        name = url.path.rpartition("/")[2]
+        params = dict(parse_qsl(url.query))
+        if name == "_export_manifest.php":
+            return self._manifest
+        if name == "_export_all_data.php":
+            return self._export_data(params)
+        if name != "rest.php":
+            return _reply(f"{url.path} not found", 404)
+
+        with self._lock:
+            reply = self._replies.get(url.query)
+            if reply is not None:
+                self._replies.move_to_end(url.query)
+                return reply
+        reply = self._query(params)
+        with self._lock:
+            self._replies[url.query] = reply
+            if len(self._replies) > _MAX_REPLIES:
+                self._replies.popitem(last=False)
+        return reply
+
+    def _export_data(self, params: Dict[str, str]) -> Reply:
+        format = params.get("format", "csv-asimport")
+        if format != "csv-asimport":
+            return _reply(f"format {format} is not available in the export")
+        if "ads" not in params:
+            return self._export
+        refs = [x for x in params["ads"].split(",") if x in self._partitions]
+        return _reply(
+            "\n".join([_CSV_ASIMPORT_HEADER, *(self._partitions[x] for x in refs), ""])
+        )
+
+    def _query(self, params: Dict[str, str]) -> Reply:
+        num = params.get("num", "")
+        den = params.get("den", "")
+        quantity = f"{num}/{den}" if den else num
+        format = params.get("format", "csv-asimport")
+        try:
+            if format in ("usine", "galprop"):
+                raise ValueError(f"format {format} is not available in the mirror")
+            if format not in ("csv", "csv-asimport"):
+                raise ValueError(f"invalid format {format}")
+            kwargs: Dict[str, Any] = {
+                name: tp(params[name])
+                for (name, tp) in _QUERY_PARAMETERS
+                if name in params
+            }
+            table = _select(self._candidates(quantity), quantity, **kwargs)
+        except ValueError as e:
+            return _reply(str(e))
+        if format == "csv":
+            lines = [_CSV_HEADER, *_csv_lines(table, _CSV_FIELDS), ""]
+        else:
+            lines = [_CSV_ASIMPORT_HEADER, *_csv_lines(table, _CSV_ASIMPORT_FIELDS), ""]
+        return _reply("\n".join(lines))
+
+    def _candidates(self, quantity: str) -> np.recarray:
+        # rows of all quantities which select() may use to compute the quantity,
+        # taken from the index instead of scanning the full table
+        num, _, den = "/".join(x.strip() for x in quantity.split("/")).partition("/")
+        names = {num}
+        if den:
+            names.update((den, f"{num}/{den}", f"{den}/{num}"))
+            names.update(
+                q
+                for q in self.db.quantities
+                if q.startswith(f"{num}/") or q.endswith(f"/{den}")
+            )
+        parts = [self.db[q] for q in sorted(names) if q in self.db]
+        return _concatenate(parts) if parts else self.db.table[:0]
+
+
+def make_server(
+    mirror: Optional[Mirror] = None,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+) -> ThreadingHTTPServer:
+    """
+    Return HTTP server which answers requests with a mirror.
+
+    Call serve_forever() on the returned server to start it. Each request is
+    handled in its own thread.
+
+    Parameters
+    ----------
+    mirror : Mirror, optional
+        Mirror which answers the requests. If None, a mirror of the full database
+        is created. Default is None.
+    host : str, optional
+        Host name or address to listen on. Default is 127.0.0.1, use 0.0.0.0 to
+        accept connections from other machines.
+    port : int, optional
+        Port to listen on. Use 0 to pick a free port. Default is 8000.
+    """
+    if mirror is None:
+        mirror = Mirror()
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.mirror = mirror  # type: ignore
+    return server
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        reply = self.server.mirror.respond(self.path)  # type: ignore
+        if self.headers.get("If-None-Match") == reply.etag:
+            self.send_response(304)
+            self.send_header("ETag", reply.etag)
+            self.end_headers()
+            return
+        body = reply.body
+        self.send_response(reply.status)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("ETag", reply.etag)
+        if reply.gzipped is not None and "gzip" in self.headers.get(
+            "Accept-Encoding", ""
+        ):
+            body = reply.gzipped
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _reply(text: str, status: int = 200) -> Reply:
+    body = text.encode("utf-8")
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    gzipped = gzip.compress(body, 1) if len(body) >= _GZIP_MIN_SIZE else None
+    return Reply(status, body, etag, gzipped)
+
+
+def _csv_lines(
+    table: np.recarray,
+    fields: Sequence[Union[None, Tuple[str, str], Tuple[str, str, Tuple[int]]]],
+) -> List[str]:
+    # inverse of core._convert_rows; floats are written with repr, which round-trips
+    n = len(table)
+    columns: List[List[str]] = []
+    for key in _csv_mapping(fields):
+        if key is None:
+            columns.append([""] * n)
+            continue
+        if isinstance(key, tuple):
+            key, pos = key
+            col = np.asarray(table[key])[:, pos]
+        else:
+            col = table[key]
+        if col.dtype.kind == "U":
+            # strings are formatted once per distinct value
+            codes, values = _factorize(col)
+            strings = np.array([_quote(x) for x in values.tolist()], dtype=object)
+            columns.append(strings[codes].tolist())
+        elif col.dtype.kind == "b":
+            columns.append(["1" if x else "0" for x in col.tolist()])
+        else:
+            columns.append([repr(x) for x in col.tolist()])
+    return [",".join(row) for row in zip(*columns)]
+
+
+def _quote(s: str) -> str:
+    if "," in s or '"' in s or "\n" in s:
+        return '"' + s.replace('"', '""') + '"'
+    return s
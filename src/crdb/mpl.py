@@ -3,11 +3,15 @@
 import warnings
 from pathlib import Path
 import numpy as np
-from typing import Any, Optional, Union
+from typing import Any, Dict, Optional, Sequence, Union
+from matplotlib import dates as mdates
 from matplotlib import pyplot as plt
+from matplotlib.collections import PathCollection
 from matplotlib.lines import Line2D
-from crdb.core import get_mean_datetime
-from datetime import datetime
+from matplotlib.markers import CARETDOWNBASE
+from crdb.core import COMBINE
+from crdb.core import experiment_groups
+from crdb.core import get_mean_datetimes
 
 
 def draw_table(
@@ -42,16 +46,7 @@ def draw_table(
     kwargs :
         Other keyword arguments are forwarded to matplotlib.pyplot.errorbar.
     """
-    e_types = np.unique(table.e_type)
-    if len(e_types) > 1:
-        et = set(e_types)
-        is_warning = et == {"EK", "ETOT"}
-        word = "potentially " if is_warning else ""
-        msg = f"table contains {word}incompatbile e_types {et}"
-        if is_warning:
-            warnings.warn(msg, RuntimeWarning)
-        else:
-            raise ValueError(msg)
+    _check_e_types(table)
 
     x = table.e / xunit
     y = table.value * factor
@@ -88,37 +83,20 @@ def draw_timeseries(
     kwargs :
         Other keyword arguments are forwarded to matplotlib.pyplot.errorbar.
     """
-    multiple_ranges = 0
-    x = []
-    xerr = []
-    for dt in table.datetime:
-        if ";" in dt:
-            multiple_ranges += 1
-            x1: Optional[datetime] = None
-            x2: Optional[datetime] = None
-            for dti in dt.split(";"):
-                cx, dx = get_mean_datetime(dti)
-                if x1 is None or cx - dx < x1:
-                    x1 = cx - dx
-                if x2 is None or cx + dx > x2:
-                    x2 = cx + dx
-            dx = (x2 - x1) / 2  # type:ignore
-            cx = x1 + 0.5 * dx  # type:ignore
-        else:
-            cx, dx = get_mean_datetime(dt)
-        x.append(cx)
-        xerr.append(dx)
+    if "time_ranges" in table.dtype.names:
+        multiple_ranges = np.count_nonzero(table.time_ranges > 1)
+    else:
+        multiple_ranges = sum(";" in dt for dt in table.datetime)
     if multiple_ranges:
         msg = (
             f"input contains {multiple_ranges} points with multiple time ranges, "
             "we use minimum and maximum to construct an interval"
         )
         warnings.warn(msg, RuntimeWarning)
-    x = np.array(x)
+    x, xerr = get_mean_datetimes(table)
     y = table.value * factor
     ysta = np.transpose(table.err_sta) * factor
     ysys = np.transpose(table.err_sys) * factor
-    xerr = np.transpose(xerr)  # type:ignore
     is_ul = table.is_upper_limit
     kwargs["marker"] = "."
     return _draw_with_errorbars(
@@ -126,6 +104,129 @@ def draw_timeseries(
     )
 
 
+def draw_experiments(
+    table: np.recarray,
+    factor: float = 1.0,
+    show_bin: bool = False,
+    xunit: float = 1.0,
+    sys_lw: float = 5,
+    time_series: bool = False,
+    max_points: Optional[int] = None,
+    combine: Sequence[str] = COMBINE,
+    **kwargs: Any,
+) -> Dict[str, PathCollection]:
+    """
+    Draw all experiments in the table with statistical and systematic error bars.
+
+    This produces the same plot as calling draw_table() or draw_timeseries() for
+    each experiment, but is much faster for large tables, since the error bars of
+    each experiment are drawn as a single line with gaps and the points as one
+    scatter plot.
+
+    Parameters
+    ----------
+    table : array
+        CRDB table.
+    factor : array-like, optional
+        Optional scaling factor for the y-coordinates. Default is 1.
+    show_bin : bool, optional
+        If true, show horizontal error bars to indicate the energy bin or the time
+        range.
+    xunit: float, optional
+        Use this to change the default scale of the energy axis (GeV or GV). For
+        example, setting xunit = 1e3 produces a plot in TeV or TV. Default is 1.
+    sys_lw : float, optional
+        Line width for the error bar that represents systematic uncertainties.
+    time_series : bool, optional
+        If true, draw the values as a function of time, like draw_timeseries().
+        Default is false.
+    max_points : int, optional
+        If set, draw at most this many points per experiment, which are picked at
+        equal steps from the points sorted by x, e.g. every third point. Clustered
+        points therefore stay clustered. Use this to thin out dense time series.
+        Default is to draw all points.
+    combine : sequence of str, optional
+        Experiments are grouped with crdb.experiment_groups(), this is passed on.
+    kwargs :
+        Other keyword arguments are forwarded to matplotlib.pyplot.scatter. The line
+        width of the statistical error bars is set with ``lw`` or ``linewidth``.
+        The default marker is "o", or "." for time series.
+
+    Returns
+    -------
+    dict
+        Maps experiment names to the scatter plot of each experiment.
+    """
+    if not time_series:
+        _check_e_types(table)
+
+    factor = np.broadcast_to(factor, table.shape)
+    groups = experiment_groups(table, combine)
+    if time_series:
+        x, dx = get_mean_datetimes(table)
+        x, x1, x2 = (mdates.date2num(a) for a in (x, x - dx, x + dx))
+    else:
+        x = table.e / xunit
+        x1, x2 = np.transpose(table.e_bin / xunit)
+    keep = _decimate(x, groups.labels, max_points)
+    labels = groups.labels[keep]
+    x, x1, x2 = x[keep], x1[keep], x2[keep]
+    y = (table.value * factor)[keep]
+    ysta = np.abs(table.err_sta * factor[:, np.newaxis])[keep]
+    ysys = np.abs(table.err_sys * factor[:, np.newaxis])[keep]
+    is_ul = table.is_upper_limit[keep]
+    is_pt = ~is_ul
+
+    colors = plt.rcParams["axes.prop_cycle"].by_key()["color"]
+    lw = kwargs.pop("lw", kwargs.pop("linewidth", plt.rcParams["lines.linewidth"]))
+    kwargs.setdefault("marker", "." if time_series else "o")
+    kwargs.setdefault("s", plt.rcParams["lines.markersize"] ** 2)
+
+    # statistical error bars of points and upper limits, optionally the bins
+    ylo = np.where(is_ul, 0.8 * y, y - ysta[:, 0])
+    yhi = np.where(is_ul, y, y + ysta[:, 1])
+    ax = plt.gca()
+    result = {}
+    order = np.argsort(labels, kind="stable")
+    offsets = np.searchsorted(labels[order], np.arange(len(groups.names) + 1))
+    for k, name in enumerate(groups.names):
+        i = order[offsets[k] : offsets[k + 1]]
+        color = colors[k % len(colors)]
+        pt = i[is_pt[i]]
+        ax.plot(
+            *_segments(x[pt], y[pt] - ysys[pt, 0], x[pt], y[pt] + ysys[pt, 1]),
+            color=color,
+            lw=sys_lw,
+            alpha=0.5,
+            solid_capstyle="butt",
+        )
+        stat = [_segments(x[i], ylo[i], x[i], yhi[i])]
+        if show_bin:
+            stat.append(_segments(x1[i], y[i], x2[i], y[i]))
+        ax.plot(
+            *np.concatenate(stat, axis=1),
+            color=color,
+            lw=lw,
+            solid_capstyle="butt",
+        )
+        ul = i[is_ul[i]]
+        if len(ul):
+            ax.plot(
+                x[ul],
+                0.8 * y[ul],
+                color=color,
+                ls="none",
+                marker=CARETDOWNBASE,
+            )
+        result[name] = ax.scatter(
+            x[pt], y[pt], color=color, label=name, zorder=3, **kwargs
+        )
+    if time_series:
+        ax.xaxis_date()
+    ax.autoscale_view()
+    return result
+
+
 def draw_references(
     table: np.recarray,
     color: str = "0.5",
@@ -201,6 +302,51 @@ def draw_logo(
     iax.imshow(img)
 
 
+def _check_e_types(table: np.recarray) -> None:
+    e_types = np.unique(table.e_type)
+    if len(e_types) > 1:
+        et = set(e_types)
+        is_warning = et == {"EK", "ETOT"}
+        word = "potentially " if is_warning else ""
+        msg = f"table contains {word}incompatbile e_types {et}"
+        if is_warning:
+            warnings.warn(msg, RuntimeWarning)
+        else:
+            raise ValueError(msg)
+
+
+def _segments(
+    x1: np.ndarray, y1: np.ndarray, x2: np.ndarray, y2: np.ndarray
+) -> np.ndarray:
+    # line segments from (x1, y1) to (x2, y2) as a single line with gaps; drawing
+    # one line is much faster than a LineCollection, which transforms each segment
+    # separately on logarithmic axes
+    nan = np.full_like(x1, np.nan)
+    x = np.stack([x1, x2, nan], axis=-1).reshape(-1)
+    y = np.stack([y1, y2, nan], axis=-1).reshape(-1)
+    return np.stack([x, y])
+
+
+def _decimate(
+    x: np.ndarray, labels: np.ndarray, max_points: Optional[int]
+) -> np.ndarray:
+    # return indices of at most max_points points per group, every k-th point in x
+    # order, not points which are evenly spaced in x
+    if max_points is None:
+        return np.arange(len(x))
+    if max_points < 1:
+        raise ValueError("max_points must be positive")
+    order = np.lexsort((x, labels))
+    counts = np.bincount(labels)
+    start = np.cumsum(counts) - counts
+    n = counts[labels[order]]
+    pos = np.arange(len(x)) - start[labels[order]]
+    # keep the first point of each of max_points bins of equal size, this keeps all
+    # points of groups which have fewer points
+    first = (pos * max_points) // n != ((pos - 1) * max_points) // n
+    return np.sort(order[first])
+
+
 def _draw_with_errorbars(
     x: np.ndarray,
     y: np.ndarray,
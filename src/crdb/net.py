@@ -0,0 +1,477 @@
+"""
+HTTP transport for server requests.
+
+Connections to the CRDB server are kept open and reused by later requests, which
+saves the TCP and TLS handshakes. Responses are requested with gzip or deflate
+transfer compression and decompressed while they are streamed. Servers which ignore
+the Accept-Encoding header are handled transparently.
+
+This module is thread-safe. Each request uses its own connection; idle connections
+are shared through a pool.
+
+Proxies are configured like for urllib, with the environment variables http_proxy,
+https_proxy, and no_proxy. HTTPS requests are tunneled through the proxy.
+
+The transport which sends the requests can be replaced with set_transport(). A
+Recorder stores the responses of the server in a directory, from which a Replayer
+answers the same requests later without network access, e.g.::
+
+    net.set_transport(net.Recorder("responses"))
+    crdb.all()  # download and record
+
+    net.set_transport(net.Replayer("responses"))
+    crdb.all(revalidate=True)  # replay
+"""
+
+import base64
+import hashlib
+import http.client
+import io
+import os
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+from pathlib import Path
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+from urllib.parse import unquote
+from urllib.parse import urljoin
+from urllib.parse import urlsplit
+
+from crdb.observe import _emit
+
+__all__ = (
+    "Recorder",
+    "Replayer",
+    "Response",
+    "Transport",
+    "close_all",
+    "open_url",
+    "set_transport",
+)
+
+# maximum number of idle connections which are kept per host
+_MAX_IDLE = 4
+_MAX_REDIRECTS = 5
+_REDIRECTS = (301, 302, 303, 307, 308)
+
+# scheme, host, and port of the server, and the URL of the proxy or ""
+_Key = Tuple[str, str, Optional[int], str]
+
+# request headers which are not sent when responses are recorded
+_CONDITIONAL = ("if-none-match", "if-modified-since")
+# response headers which are not recorded, because the body is stored as a whole
+_HOP_BY_HOP = ("connection", "keep-alive", "transfer-encoding", "content-length")
+
+_pool: Dict[_Key, List[http.client.HTTPConnection]] = {}
+_lock = threading.Lock()
+
+
+class Response:
+    """
+    Response of the server.
+
+    The body is read with :meth:`iter_chunks`. The connection is returned to the pool
+    when the body was read completely and closed otherwise.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        key: _Key,
+        connection: Optional[http.client.HTTPConnection],
+        response: http.client.HTTPResponse,
+    ):
+        self.url = url
+        self.status = response.status
+        self.headers = response.headers
+        #: number of bytes received so far, before decompression
+        self.bytes_received = 0
+        #: time.perf_counter() when the request was sent
+        self.started = time.perf_counter()
+        self._key = key
+        self._connection: Optional[http.client.HTTPConnection] = connection
+        self._response = response
+        self._closed = False
+
+    def iter_chunks(self, blocksize: int = 256**2) -> Iterator[bytes]:
+        """
+        Yield decompressed chunks of the body.
+
+        Parameters
+        ----------
+        blocksize : int, optional
+            Number of bytes to read from the connection at once.
+        """
+        decoder = _Decoder(self.headers.get("Content-Encoding", ""))
+        for data in self.iter_raw(blocksize):
+            chunk = decoder.decompress(data)
+            if chunk:
+                yield chunk
+        chunk = decoder.flush()
+        if chunk:
+            yield chunk
+
+    def iter_raw(self, blocksize: int = 256**2) -> Iterator[bytes]:
+        """
+        Yield chunks of the body as sent by the server, without decompression.
+
+        Parameters
+        ----------
+        blocksize : int, optional
+            Number of bytes to read from the connection at once.
+        """
+        complete = False
+        try:
+            while True:
+                data = self._response.read(blocksize)
+                if not data:
+                    break
+                self.bytes_received += len(data)
+                yield data
+            # http.client does not report a connection which was closed before the
+            # announced length of the body was sent
+            if self._response.length and not self._closed:
+                raise http.client.IncompleteRead(b"", self._response.length)
+            complete = True
+        finally:
+            if complete:
+                self._release()
+            else:
+                self.close()
+
+    def read(self) -> bytes:
+        """Return the decompressed body."""
+        return b"".join(self.iter_chunks())
+
+    def _read_raw(self) -> bytes:
+        # body as sent by the server, without decompression
+        data = self._response.read()
+        self.bytes_received += len(data)
+        self._release()
+        return data
+
+    def close(self) -> None:
+        """Close the connection without returning it to the pool."""
+        self._closed = True
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _release(self) -> None:
+        if self._connection is None:
+            return
+        if self._response.will_close:
+            self.close()
+            return
+        with _lock:
+            idle = _pool.setdefault(self._key, [])
+            if len(idle) < _MAX_IDLE:
+                idle.append(self._connection)
+                self._connection = None
+        self.close()
+
+
+def open_url(
+    url: str, timeout: float, headers: Optional[Dict[str, str]] = None
+) -> Response:
+    """
+    Send GET request and return the response.
+
+    Redirects are followed. The caller must read the body with
+    Response.iter_chunks() or call Response.close().
+
+    Parameters
+    ----------
+    url : str
+        URL with scheme http or https.
+    timeout : float
+        Timeout in seconds for connecting and for each read from the connection.
+    headers : dict of str, optional
+        Additional request headers.
+
+    Returns
+    -------
+    Response
+
+    Raises
+    ------
+    urllib.error.HTTPError
+        If the server returns an error status.
+    OSError
+        If the connection fails.
+    """
+    send = _transport or _request
+    request_url = url
+    _emit("request", request_url)
+    start = time.perf_counter()
+    for _ in range(_MAX_REDIRECTS + 1):
+        response = send(url, timeout, headers or {})
+        location = response.headers.get("Location")
+        if response.status in _REDIRECTS and location:
+            # the body of the redirect must be read before the connection is reused
+            response.read()
+            url = urljoin(url, location)
+            continue
+        if response.status >= 400:
+            response.close()
+            raise urllib.error.HTTPError(
+                url, response.status, response._response.reason, response.headers, None
+            )
+        response.started = start
+        _emit(
+            "response",
+            request_url,
+            status=response.status,
+            seconds=time.perf_counter() - start,
+        )
+        return response
+    raise urllib.error.URLError(f"too many redirects for url={url}")
+
+
+def set_transport(transport: Optional["Transport"]) -> Optional["Transport"]:
+    """
+    Set the transport which sends all requests.
+
+    Parameters
+    ----------
+    transport : callable or None
+        Called with the URL, the timeout, and the request headers, returns a
+        Response. This is usually a Recorder or a Replayer. None restores the
+        default transport, which sends the requests over the network.
+
+    Returns
+    -------
+    callable or None
+        The previous transport.
+    """
+    global _transport
+    with _lock:
+        previous, _transport = _transport, transport
+    return previous
+
+
+def close_all() -> None:
+    """Close all idle connections."""
+    with _lock:
+        connections = [c for idle in _pool.values() for c in idle]
+        _pool.clear()
+    for c in connections:
+        c.close()
+
+
+def _request(url: str, timeout: float, headers: Dict[str, str]) -> Response:
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+        raise urllib.error.URLError(f"unsupported scheme in url={url}")
+    proxy = _proxy(parts.scheme, parts.hostname or "")
+    key = (parts.scheme, parts.hostname or "", parts.port, proxy)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    headers = {"Accept-Encoding": "gzip, deflate", **headers}
+    if proxy and parts.scheme == "http":
+        # the proxy gets the absolute URL, HTTPS requests are tunneled instead
+        path = f"http://{parts.netloc}{path}"
+        headers.update(_proxy_headers(proxy))
+
+    while True:
+        connection, reused = _connection(key, timeout)
+        try:
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+        except (http.client.HTTPException, ConnectionError) as e:
+            connection.close()
+            # the server may have closed an idle connection in the meantime, we try
+            # again once with a fresh one
+            if reused:
+                continue
+            if isinstance(e, http.client.HTTPException):
+                raise urllib.error.URLError(e) from e
+            raise
+        except BaseException:
+            connection.close()
+            raise
+        return Response(url, key, connection, response)
+
+
+class Recorder:
+    """
+    Transport which records the responses of the server.
+
+    Each response is stored in its own file in the directory, the name of the file
+    is derived from the URL. The body is stored as sent by the server, so that a
+    Replayer also exercises the decompression. Conditional request headers are not
+    sent, so that the full response is recorded.
+
+    Parameters
+    ----------
+    directory : str or Path
+        Directory for the recorded responses. It is created if necessary.
+    transport : callable, optional
+        Transport which sends the requests. Default is to send them over the
+        network.
+    """
+
+    def __init__(
+        self, directory: Union[str, Path], transport: Optional["Transport"] = None
+    ):
+        self.directory = Path(directory)
+        self._transport = transport or _request
+
+    def __call__(self, url: str, timeout: float, headers: Dict[str, str]) -> Response:
+        """Send request and record the response."""
+        headers = {k: v for (k, v) in headers.items() if k.lower() not in _CONDITIONAL}
+        response = self._transport(url, timeout, headers)
+        body = response._read_raw()
+        lines = [f"HTTP/1.1 {response.status} {response._response.reason}"]
+        for k, v in response.headers.items():
+            if k.lower() not in _HOP_BY_HOP:
+                lines.append(f"{k}: {v}")
+        lines.append(f"Content-Length: {len(body)}")
+        lines.append(f"X-Recorded-Url: {url}")
+        message = "\r\n".join(lines + ["", ""]).encode("latin-1") + body
+
+        path = _recording(self.directory, url)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}-{os.getpid()}-{threading.get_ident()}")
+        tmp.write_bytes(message)
+        os.replace(tmp, path)
+        return _stored_response(url, message)
+
+
+class Replayer:
+    """
+    Transport which replays responses recorded by a Recorder.
+
+    No requests are sent. Recorded responses are looked up by URL, the request
+    headers are ignored.
+
+    Parameters
+    ----------
+    directory : str or Path
+        Directory with the recorded responses.
+    """
+
+    def __init__(self, directory: Union[str, Path]):
+        self.directory = Path(directory)
+
+    def __call__(self, url: str, timeout: float, headers: Dict[str, str]) -> Response:
+        """
+        Return recorded response.
+
+        Raises
+        ------
+        urllib.error.URLError
+            If no response was recorded for the URL.
+        """
+        try:
+            message = _recording(self.directory, url).read_bytes()
+        except FileNotFoundError:
+            raise urllib.error.URLError(f"no recorded response for url={url}") from None
+        return _stored_response(url, message)
+
+
+#: Signature of a transport, see set_transport().
+Transport = Callable[[str, float, Dict[str, str]], Response]
+
+_transport: Optional[Transport] = None
+
+
+def _recording(directory: Path, url: str) -> Path:
+    return directory / f"{hashlib.sha256(url.encode()).hexdigest()[:32]}.http"
+
+
+def _stored_response(url: str, message: bytes) -> Response:
+    # parse a stored HTTP message like a response from a connection
+    response = http.client.HTTPResponse(_Message(message))  # type:ignore
+    response.begin()
+    return Response(url, ("stored", "", None, ""), None, response)
+
+
+class _Message:
+    # stands in for the socket from which http.client.HTTPResponse reads
+
+    def __init__(self, data: bytes):
+        self._data = data
+
+    def makefile(self, mode: str) -> io.BytesIO:
+        return io.BytesIO(self._data)
+
+
+def _connection(key: _Key, timeout: float) -> Tuple[http.client.HTTPConnection, bool]:
+    with _lock:
+        idle = _pool.get(key)
+        connection = idle.pop() if idle else None
+    if connection is not None:
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+        return connection, True
+    scheme, host, port, proxy = key
+    address = (host, port)
+    if proxy:
+        parts = urlsplit(proxy)
+        address = (parts.hostname or "", parts.port or 80)
+    if scheme == "https":
+        # the CRDB server certificate is not always recognized, so we skip verification
+        context = ssl._create_unverified_context()
+        connection = http.client.HTTPSConnection(
+            *address, timeout=timeout, context=context
+        )
+        if proxy:
+            connection.set_tunnel(host, port, _proxy_headers(proxy))
+        return connection, False
+    return http.client.HTTPConnection(*address, timeout=timeout), False
+
+
+def _proxy(scheme: str, host: str) -> str:
+    # URL of the proxy for the host from the environment, like urllib.request.urlopen
+    proxy = urllib.request.getproxies().get(scheme, "")
+    if not proxy or urllib.request.proxy_bypass(host):
+        return ""
+    return proxy if "://" in proxy else f"http://{proxy}"
+
+
+def _proxy_headers(proxy: str) -> Dict[str, str]:
+    parts = urlsplit(proxy)
+    if parts.username is None:
+        return {}
+    credentials = f"{unquote(parts.username)}:{unquote(parts.password or '')}".encode()
+    return {"Proxy-Authorization": f"Basic {base64.b64encode(credentials).decode()}"}
+
+
+class _Decoder:
+    # streaming decompression for the Content-Encoding of the response
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding.strip().lower()
+        self._obj: Optional["zlib._Decompress"] = None
+        if self.encoding in ("gzip", "x-gzip"):
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data: bytes) -> bytes:
+        if self.encoding == "deflate" and self._obj is None:
+            # deflate is supposed to be zlib-wrapped, but some servers send raw
+            # deflate streams
+            self._obj = zlib.decompressobj(zlib.MAX_WBITS)
+            try:
+                return self._obj.decompress(data)
+            except zlib.error:
+                self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+        if self._obj is None:
+            return data
+        return self._obj.decompress(data)
+
+    def flush(self) -> bytes:
+        if self._obj is None:
+            return b""
+        return self._obj.flush()
@@ -0,0 +1,229 @@
+"""
+Instrumentation of downloads, parsing, and the cache.
+
+crdb reports what it does as a stream of events: requests to the server, the
+progress and duration of downloads, the time spent to convert server responses into
+tables, and the lookups in the memory and disk caches. Each event is passed to the
+observer, which is set with set_observer(), e.g.::
+
+    import crdb
+
+    events = []
+    crdb.set_observer(events.append)
+    tab = crdb.query("B/C")
+
+The default observer is a :class:`Progress`, which prints the amount of data
+downloaded so far. Use ``crdb.set_observer(None)`` to silence it.
+
+Independent of the observer, all events are also aggregated in :data:`summary`, which
+produces a timing summary of the process::
+
+    print(crdb.observe.summary.report())
+
+This module does not depend on numpy. Observers are called from the thread which
+handles the request, they must be thread-safe if requests are sent concurrently.
+"""
+
+import threading
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+__all__ = (
+    "Event",
+    "Observer",
+    "Progress",
+    "Summary",
+    "Total",
+    "set_observer",
+    "summary",
+)
+
+_Mb = 1024**2
+# order of the lines in the summary report
+_ORDER = ("response", "retry", "download", "parse", "cache")
+
+
+class Event(NamedTuple):
+    """
+    Event reported to the observer.
+
+    The kind of the event determines which fields are set:
+
+    - "request": a request is sent to the server.
+    - "response": the server has responded; status and seconds since the request.
+    - "retry": a failed request or transfer is retried; seconds of the backoff.
+    - "progress": a chunk of the body was received; bytes received so far.
+    - "download": the body was received; bytes and seconds for the transfer. If the
+      body is processed while it is streamed, e.g. by crdb.iter_all(), the time for
+      processing is included.
+    - "parse": a response was converted into a table; rows and seconds.
+    - "cache": a cache was used; layer, result, and seconds for the disk layers.
+
+    The layer of a cache event is "memory" for the memory cache of tables, "disk"
+    for tables on disk, and "payload" for raw responses on disk. The result is "hit",
+    "miss", "stale" for an entry which must be revalidated with the server, or
+    "store" when an entry is written.
+    """
+
+    #: kind of the event
+    kind: str
+    #: URL of the request which the event belongs to
+    url: str
+    #: HTTP status code
+    status: int = 0
+    #: number of bytes received, before decompression
+    bytes: int = 0
+    #: number of table rows
+    rows: int = 0
+    #: duration in seconds
+    seconds: float = 0.0
+    #: cache layer
+    layer: str = ""
+    #: result of the cache lookup
+    result: str = ""
+
+
+#: callable which receives each event
+Observer = Callable[[Event], None]
+
+
+class Total(NamedTuple):
+    """Aggregated events of one kind."""
+
+    #: number of events
+    events: int = 0
+    #: sum of bytes
+    bytes: int = 0
+    #: sum of rows
+    rows: int = 0
+    #: sum of durations in seconds
+    seconds: float = 0.0
+
+
+class Summary:
+    """
+    Aggregates events into totals.
+
+    Progress and request events are not aggregated, because they are summarized by
+    the download and response events. This class is thread-safe.
+    """
+
+    def __init__(self) -> None:
+        self._totals: Dict[str, Total] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event: Event) -> None:
+        """Add event to the totals."""
+        if event.kind in ("request", "progress"):
+            return
+        name = event.kind
+        if event.kind == "cache":
+            name = f"cache {event.layer} {event.result}"
+        with self._lock:
+            t = self._totals.get(name, Total())
+            self._totals[name] = Total(
+                t.events + 1,
+                t.bytes + event.bytes,
+                t.rows + event.rows,
+                t.seconds + event.seconds,
+            )
+
+    def totals(self) -> Dict[str, Total]:
+        """
+        Return the totals.
+
+        Returns
+        -------
+        dict
+            Maps "response", "retry", "download", "parse", and
+            "cache <layer> <result>" to the totals of these events, e.g.
+            "cache disk hit".
+        """
+        with self._lock:
+            return dict(self._totals)
+
+    def clear(self) -> None:
+        """Reset the totals."""
+        with self._lock:
+            self._totals.clear()
+
+    def report(self) -> str:
+        """Return the totals as a human-readable table."""
+        lines = [f"{'':18} {'events':>7} {'seconds':>9}"]
+        for name, t in sorted(self.totals().items(), key=_report_order):
+            line = f"{name:18} {t.events:7d} {t.seconds:9.3f}"
+            if name == "download":
+                rate = t.bytes / _Mb / t.seconds if t.seconds > 0 else 0.0
+                line += f"  {t.bytes / _Mb:.2f} Mb, {rate:.2f} Mb/s"
+            elif name == "parse":
+                rate = t.rows / t.seconds if t.seconds > 0 else 0.0
+                line += f"  {t.rows} rows, {rate:.0f} rows/s"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+class Progress:
+    """
+    Prints the amount of data downloaded so far.
+
+    The progress of a download is shown on a single line, which is overwritten after
+    each chunk. This is the default observer.
+    """
+
+    def __init__(self) -> None:
+        self._lines: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event: Event) -> None:
+        """Print progress of a download."""
+        with self._lock:
+            if event.kind == "progress":
+                self._lines[event.url] = self._lines.get(event.url, 0) + 1
+                # the transfer is usually compressed
+                print(f"\r{event.bytes / _Mb:.2f} Mb downloaded", end="", flush=True)
+            elif event.kind == "download" and self._lines.pop(event.url, 0) > 1:
+                print()
+
+
+#: aggregated events of this process
+summary = Summary()
+
+_observer: Optional[Observer] = Progress()
+_lock = threading.Lock()
+
+
+def set_observer(observer: Optional[Observer]) -> Optional[Observer]:
+    """
+    Set the observer which receives all events.
+
+    Parameters
+    ----------
+    observer : callable or None
+        Called with each Event. None disables the observer, which also silences the
+        progress output.
+
+    Returns
+    -------
+    callable or None
+        The previous observer.
+    """
+    global _observer
+    with _lock:
+        previous, _observer = _observer, observer
+    return previous
+
+
+def _emit(kind: str, url: str, **fields: Any) -> None:
+    event = Event(kind, url, **fields)
+    summary(event)
+    observer = _observer
+    if observer is not None:
+        observer(event)
+
+
+def _report_order(item: Tuple[str, Total]) -> Tuple[int, str]:
+    return _ORDER.index(item[0].partition(" ")[0]), item[0]
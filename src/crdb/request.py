@@ -0,0 +1,469 @@
+"""
+Requests to the CRDB server.
+
+This module does not depend on numpy, so that the command line interface, which
+passes the server response through unchanged, starts quickly.
+"""
+
+import http.client
+import socket
+import threading
+import time
+import urllib.error
+from datetime import timedelta
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Union
+
+from crdb import cache as _cache
+from crdb.net import Response as _Response
+from crdb.net import _Decoder
+from crdb.net import open_url as _open_url
+from crdb.observe import _emit
+
+# cached results are revalidated with the server after this time
+_REVALIDATE_AFTER = timedelta(days=1)
+# revalidating a result without ETag or Last-Modified downloads it again, even if it
+# did not change, so this is done less often
+_REVALIDATE_UNCONDITIONAL_AFTER = timedelta(days=30)
+
+# requests and transfers which fail with a temporary error are retried, after a
+# backoff in seconds which doubles with each attempt, until the deadline; the
+# deadline is this multiple of the timeout after the request was sent
+_BACKOFF = 1.0
+_MAX_BACKOFF = 30.0
+_DEADLINE_FACTOR = 5
+# errors and HTTP status codes which are temporary
+_TRANSIENT = (
+    TimeoutError,
+    socket.timeout,
+    ConnectionResetError,
+    ConnectionAbortedError,
+    http.client.HTTPException,
+)
+_RETRY_STATUS = (429, 500, 502, 503, 504)
+# bodies of at least this size are fetched as parallel ranges, if the server
+# supports it and the caller needs the full body at once
+_PARALLEL_MIN_SIZE = 8 * 1024**2
+_PARALLEL_RANGES = 4
+_BLOCKSIZE = 256**2
+
+
+def _url(
+    quantity: str,
+    energy_type: str = "R",
+    combo_level: int = 1,
+    energy_convert_level: int = 1,
+    flux_rescaling: float = 0.0,
+    exp_dates: str = "",
+    energy_start: float = 0.0,
+    energy_stop: float = 0.0,
+    time_start: str = "",
+    time_stop: str = "",
+    time_series: str = "",
+    format: str = "",
+    modulation: str = "",
+    server_url: str = "http://lpsc.in2p3.fr/crdb",
+) -> str:
+    """Build a query URL for the CRDB server."""
+    num, *rest = quantity.split("/")
+    if len(rest) > 1:
+        raise ValueError("ratio contains more than one / operator")
+
+    num = num.strip()
+    den = rest[0].strip() if rest else ""
+
+    # "+" must be escaped in URL, see
+    # https://en.wikipedia.org/wiki/Percent-encoding
+    num = num.replace("+", "%2B")
+    den = den.replace("+", "%2B")
+
+    # workaround for empty error message from CRDB
+    valid_energy_types = ("EKN", "EK", "R", "ETOT", "ETOTN")
+    if energy_type.upper() not in valid_energy_types:
+        raise ValueError("energy_type must be one of " + ",".join(valid_energy_types))
+
+    if combo_level not in (0, 1, 2):
+        raise ValueError(f"invalid combo_level {combo_level}")
+
+    if energy_convert_level not in (0, 1, 2):
+        raise ValueError(f"invalid energy_convert_level {energy_convert_level}")
+
+    if flux_rescaling < 0 or flux_rescaling > 2.5:
+        raise ValueError(f"invalid flux_rescaling {flux_rescaling}")
+
+    if time_series and time_series not in ("no", "only", "all"):
+        raise ValueError(f"invalid time_series {time_series}")
+
+    if format and format not in ("usine", "galprop", "csv", "csv-asimport"):
+        raise ValueError(f"invalid format {format}")
+
+    if modulation and modulation not in ("USO05", "USO17", "GHE17"):
+        raise ValueError(f"invalid modulation {modulation}")
+
+    # do the query
+    kwargs: Dict[str, Union[str, float, int]] = {
+        "num": num,
+        "energy_type": energy_type.upper(),
+    }
+    if den:
+        kwargs["den"] = den
+    if combo_level != 1:
+        kwargs["combo_level"] = combo_level
+    if energy_convert_level != 1:
+        kwargs["energy_convert_level"] = energy_convert_level
+    if flux_rescaling:
+        kwargs["flux_rescaling"] = flux_rescaling
+    if exp_dates:
+        kwargs["exp_dates"] = exp_dates
+    if energy_start:
+        kwargs["energy_start"] = energy_start
+    if energy_stop:
+        kwargs["energy_stop"] = energy_stop
+    if time_start:
+        kwargs["time_start"] = time_start
+    if time_stop:
+        kwargs["time_stop"] = time_stop
+    if time_series:
+        kwargs["time_series"] = time_series
+    if format:
+        kwargs["format"] = format
+    if modulation:
+        kwargs["modulation"] = modulation
+
+    url = f"{server_url}/rest.php?" + "&".join(
+        ["{0}={1}".format(k, v) for (k, v) in kwargs.items()]
+    )
+    return url
+
+
+def _server_request(url: str, timeout: int) -> List[str]:
+    # return raw server response as list of lines, this is used by the command line
+    # interface for formats which are not converted into tables
+    payload = b"".join(_iter_payload(url, timeout))
+    return payload.decode("utf-8").split("\n")
+
+
+def _iter_payload(url: str, timeout: int, progress: bool = True) -> Iterator[bytes]:
+    # yield raw server response from the cache, or stream it from the server and
+    # store it in the cache once it is complete
+    key = _cache.make_key("payload", url)
+    start = time.perf_counter()
+    payload = _cache.load_bytes(key, stale_after=_REVALIDATE_AFTER)
+    if payload is not None:
+        _emit(
+            "cache",
+            url,
+            layer="payload",
+            result="hit",
+            seconds=time.perf_counter() - start,
+        )
+        yield payload
+        return
+    result = "miss" if _cache.age(key) is None else "stale"
+    _emit("cache", url, layer="payload", result=result)
+    chunks = []
+    # the payload is held in memory for the cache anyway, so a broken transfer can be
+    # started over
+    for chunk in _iter_chunks(url, timeout, progress, restart=True):
+        chunks.append(chunk)
+        yield chunk
+    start = time.perf_counter()
+    _cache.save_bytes(key, b"".join(chunks), {"url": url})
+    _emit(
+        "cache",
+        url,
+        layer="payload",
+        result="store",
+        seconds=time.perf_counter() - start,
+    )
+
+
+def _iter_chunks(
+    url: str, timeout: int, progress: bool = True, restart: bool = False
+) -> Iterator[bytes]:
+    yield from _read_chunks(
+        _open(url, timeout), url, timeout, progress, restart=restart
+    )
+
+
+def _open(
+    url: str, timeout: int, headers: Optional[Dict[str, str]] = None
+) -> _Response:
+    # if there is an error, we hide original long traceback from the internal libs
+    # and instead show a simple traceback
+    try:
+        response = _send(url, timeout, headers)
+        connection_error = False
+    except Exception:
+        import traceback
+
+        traceback.print_exc()
+        connection_error = True
+
+    if connection_error:
+        raise _connection_error(url)
+    return response
+
+
+def _send(
+    url: str, timeout: int, headers: Optional[Dict[str, str]] = None
+) -> _Response:
+    # send request, temporary failures are retried until the deadline
+    start = time.perf_counter()
+    attempt = 0
+    while True:
+        try:
+            response = _open_url(url, timeout, headers)
+        except Exception as e:
+            if _retry(url, e, attempt, start + _DEADLINE_FACTOR * timeout):
+                attempt += 1
+                continue
+            raise
+        # the deadline of the transfer counts from the first attempt
+        response.started = start
+        return response
+
+
+def _connection_error(url: str) -> ConnectionError:
+    return ConnectionError(
+        "Please check if you can connect to https://lpsc.in2p3.fr/crdb with your "
+        f"browser. If that works, something is wrong with url = '{url}', "
+        "please report this as an issue at "
+        "https://github.com/crdb-project/crdb/issues"
+    )
+
+
+def _read_chunks(
+    response: _Response,
+    url: str,
+    timeout: int,
+    progress: bool = True,
+    parallel: int = 1,
+    restart: bool = False,
+) -> Iterator[bytes]:
+    # yield decompressed chunks of the body; if the transfer stalls or breaks off, it
+    # is resumed with a range request, or started over if restart is true, see
+    # _Transfer; errors of the transfer are raised as TimeoutError or ConnectionError
+    start = time.perf_counter()
+    transfer = _Transfer(response, url, timeout, progress, restart)
+    if parallel > 1 and transfer.length >= _PARALLEL_MIN_SIZE and transfer.ranges:
+        chunks = transfer.parallel_chunks(parallel)
+    else:
+        chunks = transfer.chunks()
+    empty = True
+    while True:
+        error: Optional[Exception] = None
+        try:
+            chunk = next(chunks, b"")
+        except (TimeoutError, socket.timeout):
+            error = TimeoutError(
+                f"server did not respond within timeout={timeout} to url={url}"
+            )
+        except (OSError, http.client.HTTPException):
+            error = _connection_error(url)
+        if error is not None:
+            raise error
+        if not chunk:
+            break
+        empty = empty and chunk.isspace()
+        yield chunk
+    _emit(
+        "download",
+        url,
+        bytes=transfer.received,
+        seconds=time.perf_counter() - start,
+    )
+
+    if empty:
+        raise ValueError("empty server response")
+
+
+class _Transfer:
+    # Download of the body of a response. When reading fails with a temporary
+    # error, the rest of the body is requested again after a backoff, until the
+    # deadline of the request has passed. This requires a server which supports
+    # range requests, unless nothing was received yet. Otherwise, if restart is true,
+    # the chunks are held back until the body is complete, so that the transfer can
+    # be started over with a new request. The If-Range header ensures
+    # that the server sends the rest of the same representation, so that the
+    # compressed stream can be continued. Large bodies can be fetched as several
+    # ranges in parallel.
+
+    def __init__(
+        self,
+        response: _Response,
+        url: str,
+        timeout: int,
+        progress: bool,
+        restart: bool = False,
+    ):
+        self.response = response
+        self.url = url
+        self.timeout = timeout
+        self.progress = progress
+        self.restart = restart
+        self.deadline = response.started + _DEADLINE_FACTOR * timeout
+        # number of bytes received by all requests, before decompression
+        self.received = 0
+        headers = response.headers
+        etag = headers.get("ETag", "")
+        # weak entity tags cannot be used with If-Range
+        self.validator = (
+            etag
+            if etag and not etag.startswith("W/")
+            else headers.get("Last-Modified", "")
+        )
+        self.ranges = bool(
+            response.status == 200
+            and headers.get("Accept-Ranges", "").strip().lower() == "bytes"
+            and self.validator
+        )
+        length = headers.get("Content-Length", "")
+        self.length = int(length) if length.isdigit() else -1
+        self._attempts = 0
+        self._lock = threading.Lock()
+
+    def chunks(self) -> Iterator[bytes]:
+        hold = self.restart and not self.ranges
+        held: List[bytes] = []
+        response = self.response
+        decoder = _Decoder(response.headers.get("Content-Encoding", ""))
+        offset = 0
+        while True:
+            try:
+                for data in response.iter_raw(_BLOCKSIZE):
+                    offset += len(data)
+                    self._add(len(data))
+                    chunk = decoder.decompress(data)
+                    if chunk and hold:
+                        held.append(chunk)
+                    elif chunk:
+                        yield chunk
+                break
+            except _TRANSIENT as e:
+                if offset and not self.ranges:
+                    if not hold:
+                        raise
+                    offset = 0
+                    del held[:]
+                response = self._reopen(e, offset, -1)
+                if not offset:
+                    decoder = _Decoder(response.headers.get("Content-Encoding", ""))
+        yield from held
+        chunk = decoder.flush()
+        if chunk:
+            yield chunk
+
+    def parallel_chunks(self, n: int) -> Iterator[bytes]:
+        # the ranges are written into a preallocated buffer, which is decompressed
+        # when it is complete; the first range is read from the original response
+        from concurrent.futures import ThreadPoolExecutor
+
+        view = memoryview(bytearray(self.length))
+        bounds = [self.length * i // n for i in range(n + 1)]
+        failed = threading.Event()
+
+        def fetch(i: int) -> None:
+            pos, stop = bounds[i], bounds[i + 1]
+            response: Optional[_Response] = self.response if i == 0 else None
+            try:
+                # other ranges give up when one of them has failed
+                while pos < stop and not failed.is_set():
+                    try:
+                        if response is None:
+                            response = self._open_range(pos, stop)
+                        for data in response.iter_raw(_BLOCKSIZE):
+                            k = min(len(data), stop - pos)
+                            view[pos : pos + k] = data[:k]
+                            pos += k
+                            self._add(len(data))
+                            # the original response continues after the range
+                            if pos == stop and response is self.response:
+                                break
+                        response.close()
+                        response = None
+                    except Exception as e:
+                        response = self._reopen(e, pos, stop)
+            except BaseException:
+                failed.set()
+                raise
+
+        with ThreadPoolExecutor(max_workers=n) as pool:
+            for future in [pool.submit(fetch, i) for i in range(n)]:
+                future.result()
+
+        decoder = _Decoder(self.response.headers.get("Content-Encoding", ""))
+        for i in range(0, self.length, _BLOCKSIZE):
+            chunk = decoder.decompress(bytes(view[i : i + _BLOCKSIZE]))
+            if chunk:
+                yield chunk
+        chunk = decoder.flush()
+        if chunk:
+            yield chunk
+
+    def _add(self, n: int) -> None:
+        with self._lock:
+            self.received += n
+            received = self.received
+        if self.progress:
+            _emit("progress", self.url, bytes=received)
+
+    def _open_range(self, start: int, stop: int) -> _Response:
+        # request bytes from start to stop of the body, stop may be -1 for the end
+        headers = {}
+        if start or stop >= 0:
+            last = "" if stop < 0 else str(stop - 1)
+            headers = {"Range": f"bytes={start}-{last}", "If-Range": self.validator}
+        response = _open_url(self.url, self.timeout, headers)
+        expected = 206 if headers else 200
+        if response.status != expected or (
+            headers
+            and not response.headers.get("Content-Range", "").startswith(
+                f"bytes {start}-"
+            )
+        ):
+            response.close()
+            raise _Mismatch(f"server did not send requested range of url={self.url}")
+        return response
+
+    def _reopen(self, error: Exception, start: int, stop: int) -> _Response:
+        # request rest of the body after a backoff, raise error after the deadline
+        while True:
+            with self._lock:
+                attempt = self._attempts
+                self._attempts += 1
+            if not _retry(self.url, error, attempt, self.deadline):
+                raise error
+            try:
+                return self._open_range(start, stop)
+            except _Mismatch:
+                raise error
+            except Exception as e:
+                error = e
+
+
+class _Mismatch(ConnectionError):
+    # the server did not send the requested range, e.g. because the data changed
+    pass
+
+
+def _retry(url: str, error: Exception, attempt: int, deadline: float) -> bool:
+    # wait before the next attempt and return true, or return false if the error is
+    # permanent or the deadline would pass
+    if isinstance(error, urllib.error.HTTPError):
+        if error.code not in _RETRY_STATUS:
+            return False
+    elif isinstance(error, urllib.error.URLError):
+        if not isinstance(error.reason, _TRANSIENT):
+            return False
+    elif not isinstance(error, _TRANSIENT):
+        return False
+    delay = min(_BACKOFF * 2**attempt, _MAX_BACKOFF)
+    if time.perf_counter() + delay > deadline:
+        return False
+    _emit("retry", url, seconds=delay)
+    time.sleep(delay)
+    return True
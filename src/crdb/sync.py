@@ -0,0 +1,159 @@
+"""
+Incremental update of the cached full database.
+
+crdb.all() keeps a snapshot of the full database in the cache. If the server
+publishes a manifest of the export, the snapshot is updated by downloading only the
+data which changed since the last update, instead of the whole export.
+
+The export is partitioned by ADS reference. The manifest is served at
+``<server_url>/_export_manifest.php`` with content type text/plain, with one line per
+partition of the form ``<ads>,<hash>``; other responses are ignored. The hash changes
+whenever the data of the partition change; it is opaque to the client. The data of
+some partitions are served at
+``<server_url>/_export_all_data.php?format=csv-asimport&ads=<ads1>,<ads2>,...``
+in the same format as the full export.
+
+The official CRDB server does not publish a manifest, so only other servers, which
+are passed with server_url, e.g. a mirror started with ``crdb serve``, are asked for
+one. Servers which do not publish a manifest are supported as well; the snapshot is
+then revalidated and, if necessary, downloaded as a whole. That a server does not
+publish a manifest is remembered, it is only asked again for a manifest when the
+snapshot is downloaded for the first time or revalidated explicitly. If the manifest
+cannot be fetched, the whole export is downloaded.
+"""
+
+import re
+import time
+import urllib.error
+import urllib.parse
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import numpy as np
+
+from crdb.compact import concatenate as _concatenate
+from crdb.core import _CSV_ASIMPORT_FIELDS
+from crdb.core import _convert_csv
+from crdb.core import _iter_lines
+from crdb.observe import _emit
+from crdb.request import _connection_error
+from crdb.request import _open
+from crdb.request import _read_chunks
+from crdb.request import _send
+
+__all__ = ("fetch_manifest", "update")
+
+# maximum number of partitions which are requested at once
+_BATCH_SIZE = 50
+# line of a valid manifest
+_MANIFEST_LINE = re.compile(r"([^,]+),([0-9A-Za-z]+)")
+
+
+def fetch_manifest(server_url: str, timeout: int) -> Optional[Dict[str, str]]:
+    """
+    Return manifest of the full export.
+
+    Parameters
+    ----------
+    server_url : str
+        Base URL of the server.
+    timeout : int
+        Timeout for server response in seconds.
+
+    Returns
+    -------
+    dict or None
+        Maps ADS references to hashes. None, if the server does not publish a
+        manifest, or if the response is not a valid manifest, e.g. an error page.
+
+    Raises
+    ------
+    ConnectionError
+        If no connection to the server can be established.
+    """
+    url = f"{server_url}/_export_manifest.php"
+    try:
+        response = _send(url, timeout)
+    except urllib.error.HTTPError:
+        return None
+    except Exception as e:
+        raise _connection_error(url) from e
+    content_type = response.headers.get("Content-Type", "")
+    if content_type.partition(";")[0].strip().lower() != "text/plain":
+        response.close()
+        return None
+    manifest = {}
+    for line in _iter_lines(_read_chunks(response, url, timeout, restart=True)):
+        if not line:
+            continue
+        m = _MANIFEST_LINE.match(line)
+        if m is None:
+            return None
+        manifest[m[1]] = m[2]
+    return manifest
+
+
+def update(
+    table: np.recarray,
+    old: Dict[str, str],
+    new: Dict[str, str],
+    server_url: str,
+    timeout: int,
+    compact: bool = False,
+) -> np.recarray:
+    """
+    Return table updated from manifest old to manifest new.
+
+    Rows of partitions which were removed or changed are dropped, rows of changed and
+    new partitions are downloaded and appended.
+
+    Parameters
+    ----------
+    table : array
+        Snapshot of the full database which corresponds to the old manifest.
+    old : dict
+        Manifest of the snapshot.
+    new : dict
+        Current manifest of the server.
+    server_url : str
+        Base URL of the server.
+    timeout : int
+        Timeout for server response in seconds.
+    compact : bool, optional
+        Whether table is a compact table. Default is false.
+
+    Returns
+    -------
+    Updated table.
+    """
+    changed = sorted(k for (k, v) in new.items() if old.get(k) != v)
+    removed = sorted(set(old) - set(new))
+    if not changed and not removed:
+        return table
+    parts = [table[~np.isin(table.ads, changed + removed)]]
+    for i in range(0, len(changed), _BATCH_SIZE):
+        parts.append(
+            _fetch_partitions(
+                changed[i : i + _BATCH_SIZE], server_url, timeout, compact
+            )
+        )
+    return _concatenate(parts)
+
+
+def _fetch_partitions(
+    keys: List[str], server_url: str, timeout: int, compact: bool
+) -> np.recarray:
+    query = urllib.parse.urlencode(
+        {"format": "csv-asimport", "ads": ",".join(keys)}, safe=","
+    )
+    url = f"{server_url}/_export_all_data.php?{query}"
+    chunks = _read_chunks(_open(url, timeout), url, timeout, restart=True)
+    data = list(_iter_lines(chunks))
+    # check for errors and display them
+    if len(data) == 1:
+        raise ValueError(data[0])
+    start = time.perf_counter()
+    table = _convert_csv(data, _CSV_ASIMPORT_FIELDS, compact)
+    _emit("parse", url, rows=len(table), seconds=time.perf_counter() - start)
+    return table
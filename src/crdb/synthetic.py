@@ -0,0 +1,278 @@
+"""
+Synthetic CRDB data for benchmarks and tests.
+
+generate() returns a synthetic export of the database in the csv-asimport format,
+of any size. A StandIn serves such an export like the CRDB server, so that
+crdb.all() and crdb.query() can be measured at any database size without network
+access, e.g.::
+
+    from crdb import synthetic
+
+    server = synthetic.make_server(synthetic.generate(1_000_000))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    tab = crdb.all(server_url=f"http://127.0.0.1:{server.server_port}")
+
+The values are random, but the structure follows the real database: experiments
+have a few sub-experiments, each sub-experiment measures a few quantities on a grid
+of energies, and some experiments have time series of short sub-experiments. The
+output only depends on the arguments of generate().
+"""
+
+import threading
+from http.server import ThreadingHTTPServer
+from typing import Any
+from typing import List
+from typing import Optional
+from typing import Union
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from crdb.core import _CSV_ASIMPORT_FIELDS
+from crdb.core import _convert_csv
+from crdb.database import Database
+from crdb.mirror import _CSV_ASIMPORT_HEADER
+from crdb.mirror import Mirror
+from crdb.mirror import Reply
+from crdb.mirror import _Handler
+from crdb.mirror import _reply
+
+__all__ = ("StandIn", "generate", "make_server")
+
+# quantities with their energy type, leptons are measured in kinetic energy
+_QUANTITIES = (
+    ("H", "R"),
+    ("He", "R"),
+    ("Li", "R"),
+    ("Be", "R"),
+    ("B", "R"),
+    ("C", "R"),
+    ("N", "R"),
+    ("O", "R"),
+    ("Fe", "EKN"),
+    ("1H-bar", "R"),
+    ("e-", "EK"),
+    ("e+", "EK"),
+    ("e-+e+", "EK"),
+    ("B/C", "R"),
+    ("Li/C", "R"),
+    ("Be/C", "R"),
+    ("He/O", "EKN"),
+    ("e+/e-+e+", "EK"),
+    ("1H-bar/H", "R"),
+)
+# number of quantities which a sub-experiment measures
+_QUANTITIES_PER_SUB_EXP = 3
+# number of sub-experiments per experiment, and per time series
+_SUB_EXPS_PER_EXP = 4
+_SUB_EXPS_PER_TIME_SERIES = 50
+# a time series consists of consecutive Bartels rotations
+_TIME_SERIES_START = np.datetime64("2011-05-20", "D")
+_TIME_SERIES_PERIOD = np.timedelta64(27, "D")
+
+
+def generate(
+    rows: int,
+    sub_exps: Optional[int] = None,
+    time_series: float = 0.1,
+    seed: int = 1,
+) -> str:
+    """
+    Return synthetic export of the database in the csv-asimport format.
+
+    Parameters
+    ----------
+    rows : int
+        Number of data points.
+    sub_exps : int, optional
+        Number of sub-experiments. Default is one per 50 rows.
+    time_series : float, optional
+        Fraction of sub-experiments which are part of a time series. Default is 0.1.
+    seed : int, optional
+        Seed of the random number generator. Default is 1.
+
+    Returns
+    -------
+    str
+        Header line and one line per row, terminated by a newline.
+    """
+    if rows < 0:
+        raise ValueError(f"invalid rows {rows}")
+    if sub_exps is None:
+        sub_exps = max(1, rows // 50)
+    if sub_exps < 1:
+        raise ValueError(f"invalid sub_exps {sub_exps}")
+    if not 0 <= time_series <= 1:
+        raise ValueError(f"invalid time_series {time_series}")
+
+    rng = np.random.default_rng(seed)
+    n_series = int(round(time_series * sub_exps))
+    prefixes = []
+    first_quantity = []
+    for k in range(sub_exps - n_series):
+        exp, i = divmod(k, _SUB_EXPS_PER_EXP)
+        year = 1980 + (exp * 7 + i * 3) % 40
+        month = 1 + k % 12
+        stop = year + 1 + k % 4
+        prefixes.append(
+            _prefix(
+                f"EXP{exp}",
+                "Space" if exp % 3 else "Balloon",
+                year,
+                f"EXP{exp} ({year}/{month:02d}-{stop}/{month:02d})",
+                f"{year}/{month:02d}/01-000000:{stop}/{month:02d}/01-000000",
+                f"{year}ApJ...{k:05d}",
+            )
+        )
+        first_quantity.append(k)
+    for k in range(n_series):
+        exp, i = divmod(k, _SUB_EXPS_PER_TIME_SERIES)
+        start = _TIME_SERIES_START + i * _TIME_SERIES_PERIOD
+        stop = start + _TIME_SERIES_PERIOD
+        a, b = (str(x).replace("-", "/") for x in (start, stop))
+        prefixes.append(
+            _prefix(
+                f"SERIES{exp}",
+                "Space",
+                2011,
+                f"SERIES{exp} ({a}-{b})",
+                f"{a}-000000:{b}-000000",
+                f"2018PhRvL.{exp:05d}",
+            )
+        )
+        # all sub-experiments of a time series measure the same quantities
+        first_quantity.append(exp)
+
+    sub = rng.integers(0, sub_exps, rows)
+    nq = len(_QUANTITIES)
+    q = (
+        np.array(first_quantity, dtype=int)[sub]
+        + rng.integers(0, _QUANTITIES_PER_SUB_EXP, rows)
+    ) % nq
+    e = np.exp(rng.uniform(np.log(0.1), np.log(1e4), rows))
+    order = np.lexsort((e, q, sub))
+    sub = sub[order]
+    q = q[order]
+    e = e[order]
+    half_width = rng.uniform(0.02, 0.2, rows)
+    is_ratio = np.array(["/" in name for (name, _) in _QUANTITIES])[q]
+    value = np.where(is_ratio, 0.3 * e**-0.3, 1e4 * e**-2.7)
+    value *= rng.lognormal(0, 0.05, rows)
+    err_sta = value[:, np.newaxis] * rng.uniform(0.005, 0.1, (rows, 2))
+    err_sys = value[:, np.newaxis] * rng.uniform(0.01, 0.1, (rows, 2))
+    upper_limit = rng.random(rows) < 0.01
+    phi = rng.uniform(300, 1200, len(prefixes))[sub]
+
+    quantities = [f"{name},{e_type}" for (name, e_type) in _QUANTITIES]
+    lines = [_CSV_ASIMPORT_HEADER]
+    lines += [
+        f"{prefixes[s]},{quantities[k]},{x:.6g},{x * (1 - w):.6g},{x * (1 + w):.6g},"
+        f"{v:.6g},{-sl:.3g},{su:.3g},{-yl:.3g},{yu:.3g},{u:d},{p:.0f}"
+        for (s, k, x, w, v, (sl, su), (yl, yu), u, p) in zip(
+            sub.tolist(),
+            q.tolist(),
+            e.tolist(),
+            half_width.tolist(),
+            value.tolist(),
+            err_sta.tolist(),
+            err_sys.tolist(),
+            upper_limit.tolist(),
+            phi.tolist(),
+        )
+    ]
+    lines.append("")
+    return "\n".join(lines)
+
+
+class StandIn:
+    """
+    Serves an export of the database like the CRDB server.
+
+    The export is served verbatim by ``_export_all_data.php``. Queries to
+    ``rest.php`` are answered by a Mirror of the export, which is created on the
+    first query. No manifest is published, so clients always download the full
+    export. Use make_server() to get a server which uses the stand-in.
+
+    Parameters
+    ----------
+    data : str
+        Export in the csv-asimport format, e.g. the output of generate().
+    """
+
+    def __init__(self, data: str):
+        self._export = _reply(data)
+        self._mirror: Optional[Mirror] = None
+        self._lock = threading.Lock()
+
+    def respond(self, target: str) -> Reply:
+        """
+        Return reply to a request.
+
+        Parameters
+        ----------
+        target : str
+            Path and query of the request URL.
+        """
+        path = urlsplit(target).path
+        name = path.rpartition("/")[2]
+        if name == "_export_all_data.php":
+            return self._export
+        if name == "rest.php":
+            with self._lock:
+                if self._mirror is None:
+                    lines: List[str] = self._export.body.decode().split("\n")
+                    table = _convert_csv(lines, _CSV_ASIMPORT_FIELDS)
+                    self._mirror = Mirror(Database(table))
+            return self._mirror.respond(target)
+        return _reply(f"{path} not found", 404)
+
+
+def make_server(
+    data: Union[str, StandIn],
+    host: str = "127.0.0.1",
+    port: int = 0,
+) -> ThreadingHTTPServer:
+    """
+    Return HTTP server which serves an export of the database.
+
+    Call serve_forever() on the returned server to start it.
+
+    Parameters
+    ----------
+    data : str or StandIn
+        Export in the csv-asimport format, or a stand-in which serves it.
+    host : str, optional
+        Host name or address to listen on. Default is 127.0.0.1.
+    port : int, optional
+        Port to listen on. Default is 0, which picks a free port, see the attribute
+        server_port of the server.
+    """
+    if isinstance(data, str):
+        data = StandIn(data)
+    server = ThreadingHTTPServer((host, port), _QuietHandler)
+    server.mirror = data  # type:ignore
+    return server
+
+
+class _QuietHandler(_Handler):
+    # requests and clients which close their connection are not logged, which would
+    # disturb benchmarks
+
+    def handle(self) -> None:
+        try:
+            super().handle()
+        except ConnectionError:
+            pass
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def _prefix(
+    exp: str, exp_type: str, year: int, sub_exp: str, dates: str, ads: str
+) -> str:
+    # columns of the csv-asimport format which describe the sub-experiment
+    return (
+        f"{exp},{exp_type},<a href='{exp}.html'>{exp}</a>,{year},{sub_exp},"
+        f"synthetic data,0.02,,1,{dates},{ads},synthetic"
+    )
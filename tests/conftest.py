@@ -0,0 +1,86 @@
+"""Shared fixtures and options to record and replay responses of the CRDB server."""
+
+import threading
+from http.server import ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import pytest
+
+from crdb import cache
+from crdb import net
+
+
+def pytest_addoption(parser):
+    """Add options --record and --replay."""
+    group = parser.getgroup("crdb")
+    group.addoption(
+        "--record",
+        metavar="DIR",
+        help="Record responses of the CRDB server to DIR.",
+    )
+    group.addoption(
+        "--replay",
+        metavar="DIR",
+        help="Replay responses of the CRDB server from DIR, which were recorded "
+        "with --record, instead of sending requests.",
+    )
+
+
+@pytest.fixture(autouse=True, scope="session")
+def transport(pytestconfig):
+    """Record or replay requests to the CRDB server, if requested."""
+    record = pytestconfig.getoption("record")
+    replay = pytestconfig.getoption("replay")
+    if record and replay:
+        raise pytest.UsageError("--record and --replay are mutually exclusive")
+    if not record and not replay:
+        yield
+        return
+
+    recorded = net.Recorder(record) if record else net.Replayer(replay)
+
+    def send(url, timeout, headers):
+        # requests to the local test servers are always sent
+        if urlsplit(url).hostname == "lpsc.in2p3.fr":
+            return recorded(url, timeout, headers)
+        return net._request(url, timeout, headers)
+
+    previous = net.set_transport(send)
+    yield
+    net.set_transport(previous)
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Use an empty cache in a temporary directory."""
+    monkeypatch.setenv("CRDB_CACHE_DIR", str(tmp_path))
+    cache.memory.clear()
+    yield tmp_path
+    cache.memory.clear()
+
+
+@pytest.fixture
+def serve():
+    """
+    Start local HTTP servers, which are stopped after the test.
+
+    Returns a function, which takes a request handler class or an HTTP server, starts
+    serving in a background thread, and returns the server.
+    """
+    servers = []
+    net.close_all()
+
+    def start(handler):
+        if isinstance(handler, ThreadingHTTPServer):
+            server = handler
+        else:
+            server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+    net.close_all()
@@ -0,0 +1,285 @@
+import os
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler
+
+import numpy as np
+import pytest
+from numpy.testing import assert_equal
+
+from crdb import cache
+from crdb import core
+from crdb import net
+from crdb import request
+from crdb.compact import CompactTable
+from crdb.core import _CSV_ASIMPORT_FIELDS
+from crdb.core import _cached_table
+from crdb.core import _convert_csv
+from crdb.core import _table_key
+
+ROW = (
+    "{0},Space,html,2011,{0} (2011),desc,0.02,info,1,"
+    "2011/05/19-000000:2016/05/26-000000,ads{1},origin,H,R,"
+    "2.5,2,3,{1},-0.01,0.01,-0.02,0.02,0,500"
+)
+
+
+@pytest.fixture(params=(False, True))
+def table(request):
+    data = ["# header"]
+    for i in range(10):
+        data.append(ROW.format(f"Exp{i % 3}", i))
+    data.append("")
+    return _convert_csv(data, _CSV_ASIMPORT_FIELDS, compact=request.param)
+
+
+def test_save_load(table, cache_dir):
+    assert cache.cache_dir() == cache_dir
+    assert cache.load("foo") is None
+
+    assert cache.load_meta("foo") == {}
+    assert cache.age("foo") is None
+
+    cache.save("foo", table, {"etag": "bar"})
+    tab = cache.load("foo")
+    assert type(tab) is type(table)
+    assert isinstance(tab.base, np.memmap)
+    for name in table.dtype.names:
+        assert_equal(np.asarray(tab[name]), np.asarray(table[name]))
+
+    # modifications do not change the cache
+    tab.value[:] = 0
+    assert_equal(cache.load("foo").value, table.value)
+
+    assert cache.load_meta("foo") == {"etag": "bar"}
+    assert cache.age("foo") < timedelta(days=1)
+    assert cache.load("foo", stale_after=timedelta(days=1)) is not None
+    assert cache.load("foo", stale_after=timedelta(seconds=-1)) is None
+
+    os.utime(cache_dir / "refs" / "foo.json", (0, 0))
+    assert cache.age("foo") > timedelta(days=1)
+    cache.touch("foo", {"etag": "baz"})
+    assert cache.age("foo") < timedelta(days=1)
+    assert cache.load_meta("foo") == {"etag": "baz"}
+
+    cache.save("bar", table[:0])
+    assert len(cache.load("bar")) == 0
+
+    # identical content is stored once
+    cache.save("baz", table)
+    assert len(os.listdir(cache_dir / "blobs")) == 2
+    assert_equal(cache.load("baz").value, table.value)
+
+    cache.save_bytes("payload", b"foo\nbar")
+    assert cache.load_bytes("payload") == b"foo\nbar"
+    assert cache.load_bytes("payload", stale_after=timedelta(seconds=-1)) is None
+
+    cache.clear()
+    assert cache.load("foo") is None
+    assert cache.load_bytes("payload") is None
+    assert not os.listdir(cache_dir)
+
+
+def test_evict(cache_dir, monkeypatch):
+    assert cache.max_size() == 1024**3
+    monkeypatch.setenv("CRDB_CACHE_SIZE", "2.5k")
+    assert cache.max_size() == 2560
+    monkeypatch.setenv("CRDB_CACHE_SIZE", "foo")
+    with pytest.raises(ValueError):
+        cache.max_size()
+
+    monkeypatch.setenv("CRDB_CACHE_SIZE", "2500")
+    for i in range(2):
+        cache.save_bytes(f"k{i}", bytes([i]) * 1000)
+        os.utime(cache_dir / "blobs" / _blob(f"k{i}"), (i, i))
+    # k0 is used, so k1 is now the least recently used entry
+    assert cache.load_bytes("k0") == bytes([0]) * 1000
+    cache.save_bytes("k2", bytes([2]) * 1000)
+    assert cache.usage() == 2000
+    assert cache.load_bytes("k1") is None
+    assert not (cache_dir / "refs" / "k1.json").exists()
+    assert cache.load_bytes("k0") is not None
+    assert cache.load_bytes("k2") is not None
+
+    cache.evict(0)
+    assert cache.usage() == 0
+
+
+def _blob(key):
+    return cache._read_ref(key)["blob"]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        etag = self.server.etag
+        if etag and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        if etag:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(self.server.body)))
+        self.end_headers()
+        if self.server.cut:
+            # the transfer breaks off halfway
+            self.server.cut -= 1
+            self.wfile.write(self.server.body[: len(self.server.body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(self.server.body)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_body(n):
+    lines = ["# header"] + [ROW.format("Exp", i) for i in range(n)] + [""]
+    return "\n".join(lines).encode()
+
+
+@pytest.fixture
+def server(serve):
+    server = serve(Handler)
+    server.requests = []
+    server.body = make_body(5)
+    server.etag = '"v1"'
+    server.cut = 0
+    return server
+
+
+@pytest.mark.parametrize("etag", (True, False))
+def test_cached_table(server, etag, monkeypatch, capsys):
+    if not etag:
+        server.etag = None
+    url = f"http://127.0.0.1:{server.server_port}/data"
+    parsed = []
+    convert_csv = core._convert_csv
+    monkeypatch.setattr(
+        core, "_convert_csv", lambda *args: parsed.append(1) or convert_csv(*args)
+    )
+
+    tab = _cached_table(url, 10, False, False)
+    assert len(tab) == 5
+    assert len(server.requests) == 1
+    assert len(parsed) == 1
+
+    # recently validated, no request
+    tab = _cached_table(url, 10, False, False)
+    assert len(tab) == 5
+    assert len(server.requests) == 1
+
+    # not in memory, but on disk
+    cache.memory.clear()
+    tab = _cached_table(url, 10, False, False)
+    assert len(tab) == 5
+    assert len(server.requests) == 1
+    assert len(parsed) == 1
+
+    # unchanged data is not parsed again
+    tab = _cached_table(url, 10, False, True)
+    assert len(server.requests) == 2
+    assert len(parsed) == 1
+    if etag:
+        assert server.requests[-1]["If-None-Match"] == '"v1"'
+
+    server.body = make_body(7)
+    server.etag = '"v2"' if etag else None
+    tab = _cached_table(url, 10, False, True)
+    assert len(tab) == 7
+    assert len(parsed) == 2
+    assert cache.load_meta(_table_key(url, False))["sha256"]
+
+
+@pytest.mark.parametrize("etag", (True, False))
+def test_revalidate_interval(server, etag, cache_dir):
+    if not etag:
+        server.etag = None
+    url = f"http://127.0.0.1:{server.server_port}/data"
+    _cached_table(url, 10, False, False)
+    assert len(server.requests) == 1
+
+    # results without validators are revalidated less often, because that means
+    # downloading them again
+    t = os.path.getmtime(cache_dir / "refs" / f"{_table_key(url, False)}.json")
+    t -= timedelta(days=2).total_seconds()
+    os.utime(cache_dir / "refs" / f"{_table_key(url, False)}.json", (t, t))
+    cache.memory.clear()
+    _cached_table(url, 10, False, False)
+    assert len(server.requests) == (2 if etag else 1)
+
+
+def test_cached_table_offline(server, monkeypatch, capsys):
+    url = f"http://127.0.0.1:{server.server_port}/data"
+    tab = _cached_table(url, 10, False, False)
+    server.shutdown()
+    server.server_close()
+    net.close_all()
+
+    monkeypatch.setattr(core, "_REVALIDATE_AFTER", timedelta(0))
+    with pytest.warns(UserWarning):
+        tab = _cached_table(url, 10, False, False)
+    assert len(tab) == 5
+
+    with pytest.raises(ConnectionError):
+        _cached_table(url, 10, False, True)
+
+
+def test_cached_table_interrupted(server, monkeypatch, capsys):
+    monkeypatch.setattr(request, "_BACKOFF", 0.01)
+    url = f"http://127.0.0.1:{server.server_port}/data"
+    # the server does not support range requests, so the download is started over
+    server.cut = 1
+    tab = _cached_table(url, 10, False, False)
+    assert len(tab) == 5
+    assert len(server.requests) == 2
+
+    # the cached table is used if the download fails during automatic revalidation
+    monkeypatch.setattr(core, "_REVALIDATE_AFTER", timedelta(0))
+    monkeypatch.setattr(request, "_DEADLINE_FACTOR", 0)
+    server.body = make_body(7)
+    server.etag = '"v2"'
+    server.cut = 1
+    cache.memory.clear()
+    with pytest.warns(UserWarning):
+        tab = _cached_table(url, 10, False, False)
+    assert len(tab) == 5
+
+    server.cut = 1
+    with pytest.raises(ConnectionError):
+        _cached_table(url, 10, False, True)
+
+
+def test_memory_cache(table):
+    m = cache.MemoryCache(max_entries=2)
+    assert m.get("a") is None
+    tab = m.put("a", table)
+    assert not tab.flags.writeable
+    with pytest.raises(ValueError):
+        tab.value[0] = 1
+    # the original table is not affected
+    table.value[0] = 1
+
+    tab = m.get("a")
+    assert tab is not None
+    assert not tab.flags.writeable
+    assert (m.hits, m.misses) == (1, 1)
+    if isinstance(tab, CompactTable):
+        assert not tab.categories["sub_exp"].flags.writeable
+        tab.categories = {}
+        assert m.get("a").categories
+
+    m.put("b", table, age=timedelta(days=2))
+    assert m.get("b", max_age=timedelta(days=1)) is None
+    assert m.get("b") is not None
+    m.get("a")
+    m.put("c", table)
+    assert m.keys() == ["a", "c"]
+    assert len(m) == 2
+
+    m.clear()
+    assert len(m) == 0
+    assert (m.hits, m.misses) == (0, 0)
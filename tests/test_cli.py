@@ -1,4 +1,13 @@
+import os
+import subprocess
+import sys
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
 import crdb
+from crdb import cli
 from crdb.cli import main
 
 
@@ -13,3 +22,109 @@ def test_version(capsys):
         pass
     c = capsys.readouterr()
     assert c.out == f"crdb-{crdb.__version__}\n"
+
+
+def test_arguments_match_url():
+    import inspect
+
+    from crdb.cli import _QUERY_ARGUMENTS
+    from crdb.request import _url
+
+    params = inspect.signature(_url).parameters
+    assert [x[0] for x in _QUERY_ARGUMENTS] == list(params)
+    for name, tp, default, _ in _QUERY_ARGUMENTS:
+        par = params[name]
+        assert tp is par.annotation
+        if default is None:
+            assert par.default is inspect.Parameter.empty
+        else:
+            assert default == par.default
+
+
+@pytest.mark.parametrize(
+    "code",
+    (
+        "import crdb",
+        "import crdb.cli",
+        "from crdb.cli import main; main(['--version'])",
+    ),
+)
+def test_no_numpy_on_startup(code):
+    code = f"import sys\n{code}\nassert 'numpy' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True, stdout=subprocess.DEVNULL)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        query = dict(urllib.parse.parse_qsl(self.path.partition("?")[2]))
+        self.server.requests.append(query)
+        if query["num"] == "Fail":
+            body = b""
+        else:
+            body = f"{query['num']},{query['energy_type']}\n".encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(serve):
+    server = serve(Handler)
+    server.requests = []
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def test_batch(server, tmp_path, capsys, monkeypatch):
+    url, server = server
+    queries = tmp_path / "queries.txt"
+    queries.write_text("# comment\n\nB/C --energy-type EKN\nH --combo-level 0\n")
+
+    out = tmp_path / "out"
+    args = ["batch", "H", "He", "-f", str(queries), "-j", "2", "-o", str(out)]
+    main(args + ["--server-url", url, "--energy-type", "EK"])
+    assert sorted(os.listdir(out)) == [
+        "B_C-EKN.csv",
+        "H-EK-2.csv",
+        "H-EK.csv",
+        "He-EK.csv",
+    ]
+    assert (out / "B_C-EKN.csv").read_text() == "B,EKN\n"
+    assert (out / "He-EK.csv").read_text() == "He,EK\n"
+    assert len(server.requests) == 4
+
+    # second round is served from the cache
+    main(
+        ["batch", "H", "B/C", "--server-url", url, "--energy-type", "EKN", "--timings"]
+    )
+    c = capsys.readouterr()
+    assert sorted(c.out.split("==> ")) == ["", "B/C <==\nB,EKN\n", "H <==\nH,EKN\n"]
+    assert len(server.requests) == 5
+    assert "cache payload hit" in c.err
+
+    with pytest.raises(SystemExit):
+        main(["batch", "Fail", "He", "--server-url", url, "-o", str(out)])
+    c = capsys.readouterr()
+    assert c.err == "Fail: empty server response\n"
+    assert not (out / "Fail-R.csv").exists()
+    assert (out / "He-R.csv").exists()
+
+    def fail(*args):
+        raise PermissionError("cannot write")
+
+    # the error is reported, also if the file could not be created
+    monkeypatch.setattr(cli, "open", fail, raising=False)
+    with pytest.raises(SystemExit):
+        main(["batch", "Li", "--server-url", url, "-o", str(out)])
+    assert capsys.readouterr().err == "Li: cannot write\n"
+    monkeypatch.delattr(cli, "open")
+
+    with pytest.raises(SystemExit):
+        main(["batch", "B/C", "--energy-type", "foo"])
+    c = capsys.readouterr()
+    assert c.err.startswith("B/C: energy_type must be")
@@ -0,0 +1,90 @@
+import pickle
+
+import numpy as np
+import pytest
+from numpy.testing import assert_equal
+
+from crdb import query
+from crdb.compact import CompactTable
+from crdb.compact import StringColumn
+from crdb.compact import compact
+from crdb.compact import concatenate
+from crdb.core import _CSV_ASIMPORT_FIELDS
+from crdb.core import _convert_csv
+
+
+@pytest.fixture
+def data():
+    row = (
+        "{0},Space,html,2011,{0} ({1}),desc,0.02,info,1,"
+        "2011/05/19-000000:2016/05/26-000000,{2},origin,{3},R,"
+        "2.5,2,3,0.3,-0.01,0.01,-0.02,0.02,0,500"
+    )
+    data = ["# header"]
+    for i in range(20):
+        data.append(
+            row.format(f"Exp{i % 3}", i % 2, f"ads{i % 4}", ("B/C", "H")[i % 2])
+        )
+    data.append("")
+    return data
+
+
+def test_compact_table(data):
+    tab = _convert_csv(data, _CSV_ASIMPORT_FIELDS)
+    ctab = _convert_csv(data, _CSV_ASIMPORT_FIELDS, compact=True)
+    assert isinstance(ctab, CompactTable)
+    assert ctab.nbytes < tab.nbytes / 10
+
+    assert isinstance(ctab.sub_exp, StringColumn)
+    assert isinstance(ctab["ads"], StringColumn)
+    assert_equal(ctab.sub_exp == "Exp1 (1)", tab.sub_exp == "Exp1 (1)")
+    assert_equal(ctab.sub_exp != "Exp1 (1)", tab.sub_exp != "Exp1 (1)")
+    assert not np.any(ctab.sub_exp == "Foo")
+    assert_equal(np.unique(ctab.ads), np.unique(tab.ads))
+    assert_equal(ctab.e, tab.e)
+    assert ctab.quantity[1] == "H"
+    assert list(ctab.quantity[:2]) == ["B/C", "H"]
+
+    sub = ctab[ctab.quantity == "H"]
+    assert isinstance(sub, CompactTable)
+    assert_equal(np.asarray(sub.ads), tab[tab.quantity == "H"].ads)
+
+    assert_equal(ctab.expand(), tab)
+    assert_equal(compact(tab).expand(), tab)
+
+
+def test_compact_rows(data):
+    tab = _convert_csv(data, _CSV_ASIMPORT_FIELDS)
+    ctab = _convert_csv(data, _CSV_ASIMPORT_FIELDS, compact=True)
+    assert ctab[0].sub_exp == tab[0].sub_exp == "Exp0 (0)"
+    assert ctab[-1].ads == tab[-1].ads
+    assert ctab[np.int64(1)].quantity == "H"
+    assert_equal(ctab[3], tab[3])
+    for row, expected in zip(ctab, tab):
+        assert row.sub_exp == expected.sub_exp
+    assert len(list(ctab)) == len(tab)
+    with pytest.raises(IndexError):
+        ctab[len(tab)]
+
+
+def test_compact_pickle(data):
+    ctab = _convert_csv(data, _CSV_ASIMPORT_FIELDS, compact=True)
+    ctab2 = pickle.loads(pickle.dumps(ctab))
+    assert isinstance(ctab2, CompactTable)
+    assert_equal(ctab2.expand(), ctab.expand())
+
+
+def test_compact_concatenate(data):
+    tab = _convert_csv(data, _CSV_ASIMPORT_FIELDS)
+    ctab = concatenate([compact(tab[:5]), compact(tab[5:])])
+    assert isinstance(ctab, CompactTable)
+    assert_equal(ctab.expand(), tab)
+
+    with pytest.raises(ValueError):
+        concatenate([compact(tab[:5]), tab[5:]])
+
+
+def test_query_compact():
+    tab = query(("Li", "e+"))
+    ctab = query(("Li", "e+"), compact=True)
+    assert_equal(ctab.expand(), tab)
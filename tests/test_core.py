@@ -2,6 +2,7 @@ import pytest
 from crdb import ELEMENTS
 from crdb import valid_quantities
 from crdb import all
+from crdb import iter_query
 from crdb import query
 from crdb import solar_system_composition
 
@@ -67,3 +68,175 @@ def test_valid_quantities():
     assert "H" in q
     assert "Li" in q
     assert "1H-bar" in q
+
+
+def test_convert_csv():
+    from crdb.core import _convert_csv
+    from crdb.core import _CSV_ASIMPORT_FIELDS
+
+    data = [
+        "# comment",
+        "AMS02,Space,html,2011,AMS02 (2011/05-2016/05),desc,0.02,info,1,"
+        "2011/05/19-000000:2016/05/26-000000,2016PhRvL.117w1103A,origin,B/C,R,"
+        "2.5,2,3,0.3,-0.01,0.01,-0.02,0.02,0,500",
+        'A&amp;B,Balloon,html,1999,A&amp;B (1999/01-1999/02),"desc, with comma",0,'
+        "info,1,1999/01/01-000000:1999/02/01-000000,1999ApJ...1A,origin,H,EK,"
+        "10,9,11,1e3,1,2,3,4,1,400",
+        "",
+    ]
+    tab = _convert_csv(data, _CSV_ASIMPORT_FIELDS)
+    assert len(tab) == 2
+    assert list(tab.exp) == ["AMS02", "A&amp;B"]
+    assert list(tab.sub_exp) == ["AMS02 (2011/05-2016/05)", "A&B (1999/01-1999/02)"]
+    assert list(tab.quantity) == ["B/C", "H"]
+    assert list(tab.e_type) == ["R", "EK"]
+    assert list(tab.e) == [2.5, 10]
+    assert tab.e_bin.tolist() == [[2, 3], [9, 11]]
+    assert tab.err_sta.tolist() == [[0.01, 0.01], [1, 2]]
+    assert tab.err_sys.tolist() == [[0.02, 0.02], [3, 4]]
+    assert list(tab.is_upper_limit) == [False, True]
+    assert list(tab.phi) == [500, 400]
+
+
+def test_iter_lines():
+    from crdb.core import _iter_lines
+
+    payload = "# ä\nfoo,bär\n\nbaz\n"
+    encoded = payload.encode("utf-8")
+    for n in (1, 2, 3, 100):
+        chunks = [encoded[i : i + n] for i in range(0, len(encoded), n)]
+        assert list(_iter_lines(chunks)) == payload.split("\n")
+    assert list(_iter_lines([b"foo"])) == ["foo"]
+
+
+def test_iter_csv():
+    import numpy as np
+    from crdb.core import _convert_csv
+    from crdb.core import _iter_csv
+    from crdb.core import _CSV_FIELDS
+
+    row = (
+        "B/C,AMS02 (2011/05-2016/05),R,{0},1,2,0.3,0.1,0.1,0.1,0.1,ads,500,1,"
+        "2011/05/19-000000:2016/05/26-000000,0"
+    )
+    data = ["# header", "# more header"] + [row.format(i) for i in range(7)] + [""]
+    batches = list(_iter_csv(data, _CSV_FIELDS, 3))
+    assert [len(b) for b in batches] == [3, 3, 1]
+    assert isinstance(batches[0], np.recarray)
+    assert np.all(np.concatenate(batches) == _convert_csv(data, _CSV_FIELDS))
+
+
+@pytest.mark.parametrize("batch_size", (10, 10000))
+def test_iter_query(batch_size):
+    import numpy as np
+
+    batches = list(iter_query("B/C", batch_size=batch_size))
+    assert max(map(len, batches)) <= batch_size
+    tab = np.concatenate(batches)
+    assert np.all(tab == query("B/C"))
+
+    with pytest.raises(ValueError):
+        next(iter_query("Foobar"))
+
+
+@pytest.mark.parametrize("max_workers", (1, 4))
+def test_query_concurrent(max_workers, monkeypatch):
+    import threading
+    import time
+
+    import numpy as np
+
+    from crdb import core
+
+    threads = set()
+
+    def fake_query(quantity, **kwargs):
+        threads.add(threading.get_ident())
+        # later quantities finish first
+        time.sleep(0.05 / (1 + len(threads)))
+        return np.rec.fromrecords([(quantity,)], names="quantity")
+
+    monkeypatch.setattr(core, "_query", fake_query)
+    quantities = ("H", "He", "Li", "Be", "B")
+    tab = query(quantities, max_workers=max_workers)
+    assert tab.quantity.tolist() == list(quantities)
+    assert (len(threads) > 1) == (max_workers > 1)
+
+    with pytest.raises(ValueError):
+        query(quantities, max_workers=0)
+
+
+@pytest.mark.parametrize("compact", (False, True))
+def test_experiment_groups(compact):
+    from crdb import experiment_groups
+    from crdb import experiment_masks
+    from crdb.core import _convert_csv
+    from crdb.core import _CSV_FIELDS
+
+    row = "B/C,{0},R,1,1,2,0.3,0.1,0.1,0.1,0.1,ads,500,1,dt,0"
+    sub_exps = [
+        "PAMELA (2006/07-2008/12)",
+        "BESS-PolarII (2007/12)",
+        "PAMELA (2006/07-2008/12)",
+        "PAMELA (2009/01)",
+        "BESS98 (1998/07)",
+        "AMS02 (2011/05-2016/05)",
+    ]
+    data = ["# header"] + [row.format(x) for x in sub_exps] + [""]
+    tab = _convert_csv(data, _CSV_FIELDS, compact)
+
+    g = experiment_groups(tab)
+    assert g.names == ["PAMELA", "BESS", "AMS02"]
+    assert g.labels.tolist() == [0, 1, 0, 0, 1, 2]
+    assert g.order.tolist() == [0, 2, 3, 1, 4, 5]
+    assert g.offsets.tolist() == [0, 3, 5, 6]
+
+    g = experiment_groups(tab, combine=())
+    assert g.names == ["PAMELA", "BESS-PolarII", "BESS98", "AMS02"]
+
+    masks = experiment_masks(tab)
+    assert list(masks) == ["PAMELA", "BESS", "AMS02"]
+    assert masks["BESS"].tolist() == [False, True, False, False, True, False]
+
+    g = experiment_groups(tab[:0])
+    assert g.names == []
+    assert len(g.labels) == 0
+    assert g.offsets.tolist() == [0]
+    assert experiment_masks(tab[:0]) == {}
+
+
+@pytest.mark.parametrize("compact", (False, True))
+def test_datetime_columns(compact):
+    import numpy as np
+
+    from crdb.core import _convert_csv
+    from crdb.core import _CSV_FIELDS
+    from crdb.core import get_mean_datetime
+    from crdb.core import get_mean_datetimes
+
+    row = "H,PAMELA,R,1,1,2,0.3,0.1,0.1,0.1,0.1,ads,500,1,{0},0"
+    datetimes = [
+        "2006/07/01-000000:2006/07/27-120000",
+        "2006/07/01-000000:2006/07/27-120000",
+        "2007/01/01-000000:2007/02/01-000000;2006/12/01-000000:2006/12/02-000000",
+        "2008/02/29-235959:2008/03/01-000001",
+        "2008/02/30-000000:2008/03/01-000000",
+    ]
+    data = ["# header"] + [row.format(x) for x in datetimes] + [""]
+    tab = _convert_csv(data, _CSV_FIELDS, compact)
+    assert tab.time_ranges.tolist() == [1, 1, 2, 1, 1]
+    assert tab.time_start[2] == np.datetime64("2006-12-01T00:00:00")
+    assert tab.time_stop[2] == np.datetime64("2007-02-01T00:00:00")
+    assert np.isnat(tab.time_start[4])
+    assert tab.time_stop[4] == np.datetime64("2008-03-01T00:00:00")
+
+    center, half_width = get_mean_datetimes(tab)
+    for i in (0, 3):
+        c, h = get_mean_datetime(datetimes[i])
+        assert center[i].astype(object) == c
+        assert half_width[i].astype(object) == h
+    assert center[2] == np.datetime64("2007-01-01T00:00:00")
+
+    # also works on arrays of strings
+    center2, _ = get_mean_datetimes(datetimes)
+    np.testing.assert_equal(center2, center)
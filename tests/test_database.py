@@ -0,0 +1,163 @@
+import os
+
+import numpy as np
+import pytest
+from numpy.testing import assert_equal
+
+from crdb import Database
+from crdb import cache
+from crdb import database
+from crdb.compact import CompactTable
+from crdb.core import _CSV_ASIMPORT_FIELDS
+from crdb.core import _all_url
+from crdb.core import _convert_csv
+from crdb.core import _table_key
+
+ROW = (
+    "{0},Space,html,2011,{1},desc,0.02,info,1,"
+    "2011/05/19-000000:2016/05/26-000000,{2},origin,{3},R,"
+    "{4},2,3,0.3,-0.01,0.01,-0.02,0.02,0,500"
+)
+
+ROWS = (
+    ("AMS02", "AMS02 (2011/05-2016/05)", "ads1", "B/C", 3.0),
+    ("PAMELA", "PAMELA (2006/07-2008/12)", "ads2", "H", 1.0),
+    ("AMS02", "AMS02 (2011/05-2016/05)", "ads1", "H", 2.0),
+    ("AMS02", "AMS02 (2011/05-2018/05)", "ads3", "B/C", 2.0),
+    ("AMS02", "AMS02 (2011/05-2016/05)", "ads1", "B/C", 1.0),
+    ("PAMELA", "PAMELA (2006/07-2008/12)", "ads2", "B/C", 5.0),
+    ("AMS02", "AMS02 (2011/05-2016/05)", "ads1", "H", 1.0),
+)
+
+
+@pytest.fixture(params=(False, True))
+def table(request):
+    data = ["# header"] + [ROW.format(*r) for r in ROWS] + [""]
+    return _convert_csv(data, _CSV_ASIMPORT_FIELDS, compact=request.param)
+
+
+def check(db, table):
+    assert len(db) == len(table)
+    assert db.quantities == ["B/C", "H"]
+    assert db.experiments == ["AMS02", "PAMELA"]
+    assert db.references == ["ads1", "ads2", "ads3"]
+    assert "H" in db
+    assert "He" not in db
+    assert not db.table.flags.writeable
+
+    for q in db.quantities:
+        tab = db[q]
+        assert np.shares_memory(tab, db.table)
+        mask = table.quantity == q
+        assert_equal(np.sort(tab.e), np.sort(table.e[mask]))
+        assert tab.sub_exp.tolist() == sorted(tab.sub_exp.tolist())
+    assert db["B/C"].e.tolist() == [1, 3, 2, 5]
+
+    tab = db["B/C", "AMS02 (2011/05-2016/05)"]
+    assert np.shares_memory(tab, db.table)
+    assert tab.e.tolist() == [1, 3]
+    assert len(db["H", "AMS02 (2011/05-2018/05)"]) == 0
+
+    tab = db.by_experiment("AMS02")
+    assert tab.sub_exp.tolist() == ["AMS02 (2011/05-2016/05)"] * 4 + [
+        "AMS02 (2011/05-2018/05)"
+    ]
+    assert tab.quantity.tolist() == ["B/C", "B/C", "H", "H", "B/C"]
+    assert tab.e.tolist() == [1, 3, 1, 2, 2]
+    assert db.by_experiment("AMS02 (2011/05-2018/05)").e.tolist() == [2]
+    assert db.by_experiment("PAMELA").quantity.tolist() == ["B/C", "H"]
+
+    tab = db.by_reference("ads2")
+    assert tab.quantity.tolist() == ["B/C", "H"]
+    assert tab.e.tolist() == [5, 1]
+
+    with pytest.raises(KeyError):
+        db["He"]
+    with pytest.raises(KeyError):
+        db["H", "Foo"]
+    with pytest.raises(KeyError):
+        db.by_experiment("Foo")
+    with pytest.raises(KeyError):
+        db.by_reference("Foo")
+
+
+def test_database(table):
+    check(Database(table), table)
+
+    db = Database(table[:0])
+    assert len(db) == 0
+    assert db.quantities == []
+
+
+def test_database_cached(table, monkeypatch, cache_dir):
+    # put table into cache as if it was downloaded by crdb.all()
+    url = "http://127.0.0.1:1"
+    compact = isinstance(table, CompactTable)
+    cache.save(_table_key(_all_url(url), compact), table)
+
+    built = []
+    build_index = database._build_index
+    monkeypatch.setattr(
+        database, "_build_index", lambda t: built.append(1) or build_index(t)
+    )
+    check(Database(compact=compact, server_url=url), table)
+    assert len(built) == 1
+    # the sorted table is not stored, only the table and the indices
+    assert len(os.listdir(cache_dir / "blobs")) == 2
+
+    # indices are loaded from the cache
+    cache.memory.clear()
+    check(Database(compact=compact, server_url=url), table)
+    assert len(built) == 1
+
+
+@pytest.mark.parametrize("compact", (False, True))
+def test_energy_index(compact):
+    rng = np.random.default_rng(1)
+    row = (
+        "Exp,Space,html,2011,Exp (2011),desc,0.02,info,1,"
+        "2011/05/19-000000:2016/05/26-000000,ads,origin,{0},{1},"
+        "{2},{3},{4},0.3,-0.01,0.01,-0.02,0.02,0,500"
+    )
+    data = ["# header"]
+    for _ in range(500):
+        q = rng.choice(["H", "He"])
+        e_type = rng.choice(["R", "EK"])
+        lo = 10 ** rng.uniform(0, 3)
+        hi = lo * 10 ** rng.uniform(0, 1)
+        data.append(row.format(q, e_type, np.sqrt(lo * hi), lo, hi))
+    data.append("")
+    db = Database(_convert_csv(data, _CSV_ASIMPORT_FIELDS, compact))
+    tab = db.table
+
+    with pytest.raises(KeyError):
+        db.energy_index("B/C", "R")
+
+    lo = 10 ** rng.uniform(-1, 4, 200)
+    hi = lo * 10 ** rng.uniform(-0.5, 1, 200)
+    for q in ("H", "He"):
+        for e_type in ("R", "EK"):
+            group = (tab.quantity == q) & (tab.e_type == e_type)
+            idx = db.energy_index(q, e_type)
+            assert len(idx) == np.sum(group)
+
+            overlap = idx.overlap(lo, hi)
+            inside = idx.range(lo, hi)
+            for k in range(len(lo)):
+                rows = overlap.rows[overlap.offsets[k] : overlap.offsets[k + 1]]
+                mask = group & (tab.e_bin[:, 0] <= hi[k]) & (tab.e_bin[:, 1] >= lo[k])
+                assert_equal(np.sort(rows), np.flatnonzero(mask))
+                rows = inside.rows[inside.offsets[k] : inside.offsets[k + 1]]
+                mask = group & (tab.e >= lo[k]) & (tab.e <= hi[k])
+                assert_equal(np.sort(rows), np.flatnonzero(mask))
+                assert np.all(np.diff(tab.e[rows]) >= 0)
+
+            m = idx.overlap(10, 20)
+            assert len(m.offsets) == 2
+
+            rows = idx.nearest(lo)
+            assert rows.shape == lo.shape
+            e = tab.e[group]
+            expected = np.min(np.abs(e[:, np.newaxis] - lo), axis=0)
+            assert_equal(np.abs(tab.e[rows] - lo), expected)
+            assert np.all(group[rows])
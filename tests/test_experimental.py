@@ -1,7 +1,14 @@
+import numpy as np
+import pytest
 from numpy.testing import assert_allclose
 from numpy.testing import assert_equal
 
 from crdb import all
+from crdb.core import _CSV_ASIMPORT_FIELDS
+from crdb.core import _convert_csv
+from crdb.experimental import ELECTRON_MASS
+from crdb.experimental import NUCLEON_MASS
+from crdb.experimental import _conversion_numbers
 from crdb.experimental import convert_energy
 from crdb.experimental import energy_conversion_numbers
 
@@ -20,3 +27,67 @@ def test_convert_energy():
     tab2 = convert_energy(tab1, "EK")
     assert len(tab2) > 0
     assert len(tab2) < len(tab1)
+
+
+@pytest.fixture(params=(False, True))
+def table(request):
+    row = (
+        "AMS02,Space,html,2011,AMS02 (2011/05-2016/05),desc,0.02,info,1,"
+        "2011/05/19-000000:2016/05/26-000000,ads,origin,"
+        "{q},{et},{e},{e},{e},{v},0.1,0.1,0.2,0.2,0,500"
+    )
+    data = ["# header"]
+    for q, et in (
+        ("He", "R"),
+        ("3He", "EKN"),
+        ("e-", "ETOT"),
+        ("B/C", "R"),
+        ("He-bar", "R"),
+    ):
+        data.append(row.format(q=q, et=et, e=10, v=2))
+    data.append("")
+    return _convert_csv(data, _CSV_ASIMPORT_FIELDS, compact=request.param)
+
+
+def test_convert_energy_offline(table):
+    a_he = _conversion_numbers(["He"])["He"][1]
+    m_he = a_he * NUCLEON_MASS
+    m_3he = 3 * NUCLEON_MASS
+    # total energies of the rows
+    e_he = np.hypot(20, m_he)
+    e_3he = 30 + m_3he
+
+    tab = convert_energy(table, "R")
+    assert tab.quantity.tolist() == ["He", "3He", "e-", "B/C", "He-bar"]
+    r_3he = np.sqrt(e_3he**2 - m_3he**2) / 2
+    assert_allclose(tab.e, (10, r_3he, np.sqrt(10**2 - ELECTRON_MASS**2), 10, 10))
+    # dR/dEKN = A E / (Z p)
+    assert_allclose(tab.value[1], 2 / (3 * e_3he / (2 * 2 * r_3he)))
+
+    tab = convert_energy(table, "EK")
+    assert tab.quantity.tolist() == ["He", "3He", "e-", "He-bar"]
+    assert np.all(tab.e_type == "EK")
+    assert_allclose(tab.e, (e_he - m_he, 30, 10 - ELECTRON_MASS, e_he - m_he))
+    assert_allclose(tab.e_bin[:, 0], tab.e)
+    # dEK/dR = Z p / E
+    f_he = 2 * 20 / e_he
+    assert_allclose(tab.value, (2 / f_he, 2 / 3, 2, 2 / f_he))
+    assert_allclose(tab.err_sta[:, 0], (0.1 / f_he, 0.1 / 3, 0.1, 0.1 / f_he))
+
+    tab = convert_energy(table, "ETOTN")
+    assert tab.quantity.tolist() == ["He", "3He", "He-bar"]
+    assert_allclose(tab.e, (e_he / a_he, 10 + NUCLEON_MASS, e_he / a_he))
+    assert_allclose(tab.value[:2], (2 * e_he * a_he / (2 * 20), 2))
+
+    tab = convert_energy(table, "EKN", approximate=False)
+    assert tab.quantity.tolist() == ["3He"]
+
+    tab = convert_energy(table, "ETOTN", approximate=False)
+    assert tab.quantity.tolist() == ["3He"]
+
+    # the mass of elements depends on A
+    tab = convert_energy(table, "EK", approximate=False)
+    assert tab.quantity.tolist() == ["3He", "e-"]
+
+    with pytest.raises(ValueError):
+        convert_energy(table, "Foo")
@@ -0,0 +1,166 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+from numpy.testing import assert_equal
+
+from crdb import query
+from crdb import synthetic
+from crdb.core import _CSV_ASIMPORT_FIELDS
+from crdb.core import _convert_csv
+from crdb.local import select
+
+
+@pytest.fixture(params=(False, True))
+def table(request):
+    row = (
+        "{exp},Space,html,2011,{sub_exp},desc,0.02,info,1,{dt},{exp}ads,origin,"
+        "{q},{et},{e},{e},{e},{v},0.1,0.1,0.2,0.2,0,500"
+    )
+    long_dt = "2011/05/19-000000:2016/05/26-000000"
+    data = ["# header"]
+    for q in ("H", "B/C"):
+        for et in ("R", "EKN"):
+            for e in (1, 10, 100):
+                data.append(
+                    row.format(
+                        exp="AMS02",
+                        sub_exp="AMS02 (2011/05-2016/05)",
+                        dt=long_dt,
+                        q=q,
+                        et=et,
+                        e=e,
+                        v=e * 2,
+                    )
+                )
+    # time series with monthly sub-experiments
+    for month in range(1, 5):
+        dt = f"2010/{month:02}/01-000000:2010/{month:02}/28-000000"
+        data.append(
+            row.format(
+                exp="PAMELA",
+                sub_exp=f"PAMELA (2010/{month:02})",
+                dt=dt,
+                q="H",
+                et="R",
+                e=5,
+                v=month,
+            )
+        )
+    data.append("")
+    return _convert_csv(data, _CSV_ASIMPORT_FIELDS, compact=request.param)
+
+
+def test_select(table):
+    tab = select(table, "H", energy_convert_level=0)
+    assert len(tab) == 3
+    assert_equal(tab.e, (1, 10, 100))
+    assert np.all(tab.e_type == "R")
+
+    tab = select(table, "B / C", energy_type="ekn", energy_convert_level=0)
+    assert len(tab) == 3
+    assert np.all(tab.quantity == "B/C")
+    assert np.all(tab.e_type == "EKN")
+
+    with pytest.raises(ValueError):
+        select(table, "Foo")
+
+    with pytest.raises(ValueError):
+        select(table, "H", energy_type="Foo")
+
+
+def test_select_time_series(table):
+    tab = select(table, "H", time_series="only")
+    assert len(tab) == 4
+    assert np.all(tab.exp == "PAMELA")
+
+    tab = select(table, "H", time_series="all", energy_convert_level=0)
+    assert len(tab) == 7
+
+    tab = select(
+        table, "H", time_series="all", time_start="2010/02", time_stop="2010/03"
+    )
+    assert_equal(np.unique(tab.sub_exp), ["PAMELA (2010/02)", "PAMELA (2010/03)"])
+
+    tab = select(table, "H", time_series="all", time_stop="2010")
+    assert len(tab) == 4
+
+
+def test_select_filters(table):
+    tab = select(table, "H", energy_start=5, energy_stop=50, time_series="all")
+    assert_equal(np.sort(tab.e), (5, 5, 5, 5, 10))
+
+    tab = select(table, "H", exp_dates="PAMELA(2010/01), AMS02", time_series="all")
+    assert len(tab) == 4
+    assert_equal(np.unique(tab.exp), ["AMS02", "PAMELA"])
+
+    tab = select(table, "H", flux_rescaling=2)
+    assert_allclose(tab.value, 2 * tab.e**3)
+    assert_allclose(tab.err_sta, 0.1 * tab.e[:, np.newaxis] ** 2 * np.ones(2))
+
+
+def test_query_local():
+    tab = query("B/C", backend="local")
+    assert len(tab) > 1
+    assert np.all(tab.quantity == "B/C")
+
+    with pytest.raises(ValueError):
+        query("B/C", backend="foo")
+
+
+def test_query_local_server_url(serve):
+    server = serve(synthetic.make_server(synthetic.generate(1000)))
+    url = f"http://127.0.0.1:{server.server_port}"
+    tab = query("B/C", combo_level=0, server_url=url, backend="local")
+    assert len(tab) > 0
+    assert np.all(tab.quantity == "B/C")
+    assert_equal(tab, query("B/C", combo_level=0, server_url=url))
+
+
+@pytest.fixture(params=(False, True))
+def combo_table(request):
+    row = (
+        "{exp},Space,html,2011,{exp} (2011),desc,0.02,info,1,"
+        "2011/05/19-000000:2016/05/26-000000,ads,origin,"
+        "{q},R,{e},{e},{e},{v},{v},{v},0,0,{ul},500"
+    )
+    data = ["# header"]
+    for exp, q, e, v, ul in (
+        ("X", "B", 10, 2, 0),
+        ("X", "B", 20, 2, 0),
+        ("X", "C", 10.3, 4, 0),  # matches with combo_level=1
+        ("X", "C", 23, 4, 0),  # only matches with combo_level=2
+        ("Y", "C/B", 10, 4, 0),
+        ("Y", "C/B", 20, 4, 1),  # upper limit in denominator is dropped
+        ("Z", "B/O", 10, 2, 1),
+        ("Z", "O/C", 10, 0.5, 0),
+        ("W", "B/C", 10, 0.5, 0),
+        ("W", "B", 10, 1, 0),
+        ("W", "C", 10, 1, 0),
+    ):
+        data.append(row.format(exp=exp, q=q, e=e, v=v, ul=ul))
+    data.append("")
+    return _convert_csv(data, _CSV_ASIMPORT_FIELDS, compact=request.param)
+
+
+def test_select_combo_level(combo_table):
+    tab = select(combo_table, "B/C", combo_level=0)
+    assert_equal(np.asarray(tab.exp), ["W"])
+
+    tab = select(combo_table, "B/C", combo_level=1, energy_convert_level=0)
+    assert np.all(tab.quantity == "B/C")
+    assert_equal(np.asarray(tab.exp), ["W", "X", "Y", "Z"])
+    assert_allclose(tab.e, [10, 10, 10, 10])
+    assert_allclose(tab.value, [0.5, 0.5, 0.25, 1])
+    # relative errors of 100 % in each factor
+    assert_allclose(tab.err_sta[:, 0], tab.value * [1, np.sqrt(2), 1, np.sqrt(2)])
+    assert_equal(tab.is_upper_limit, [False, False, False, True])
+
+    tab = select(combo_table, "B/C", combo_level=2, energy_convert_level=0)
+    assert_equal(np.asarray(tab.exp), ["W", "X", "X", "Y", "Z"])
+    assert_allclose(tab.e, [10, 10, 20, 10, 10])
+
+    tab = select(combo_table, "C/O", energy_convert_level=0, exp_dates="X")
+    assert len(tab) == 0
+
+    with pytest.raises(ValueError):
+        select(combo_table, "B/N")
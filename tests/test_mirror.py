@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_equal
+
+import crdb
+from crdb import Database
+from crdb import net
+from crdb.core import _CSV_ASIMPORT_FIELDS
+from crdb.core import _CSV_FIELDS
+from crdb.core import _convert_csv
+from crdb.local import select
+from crdb.mirror import Mirror
+from crdb.mirror import make_server
+
+ROW = (
+    '{0},Space,html,2011,{1},"desc, with comma",0.02,info,1,'
+    "2011/05/19-000000:2016/05/26-000000,{2},origin,{3},R,"
+    "{4},{5},{6},{7},-0.01,0.01,-0.02,0.02,0,500"
+)
+
+ROWS = (
+    ("AMS02", "AMS02 (2011/05-2016/05)", "ads1", "B", 1.0, 0.1),
+    ("AMS02", "AMS02 (2011/05-2016/05)", "ads1", "C", 1.0, 0.4),
+    ("AMS02", "AMS02 (2011/05-2016/05)", "ads1", "B", 2.5, 0.05),
+    ("AMS02", "AMS02 (2011/05-2016/05)", "ads1", "C", 2.5, 0.2),
+    ("PAMELA", "PAMELA (2006/07-2008/12)", "ads2", "B/C", 3.0, 0.3),
+    ("PAMELA", "PAMELA (2006/07-2008/12)", "ads2", "H", 1.0, 1e3),
+    ("HEAO3-C2", "HEAO3-C2 (1979/10-1980/06)", "ads3", "H", 10.0, 1e-5),
+)
+
+
+@pytest.fixture
+def table():
+    data = ["# header"]
+    for *r, e, v in ROWS:
+        data.append(ROW.format(*r, e, e * 0.9, e * 1.1, v))
+    data.append("")
+    return _convert_csv(data, _CSV_ASIMPORT_FIELDS)
+
+
+def check_equal(a, b):
+    assert len(a) == len(b)
+    ia = np.lexsort((a.e, a.sub_exp, a.quantity))
+    ib = np.lexsort((b.e, b.sub_exp, b.quantity))
+    for name in b.dtype.names:
+        assert_equal(np.asarray(a[name])[ia], np.asarray(b[name])[ib])
+
+
+def parse(reply, fields=_CSV_ASIMPORT_FIELDS):
+    assert reply.status == 200
+    return _convert_csv(reply.body.decode().split("\n"), fields)
+
+
+def test_mirror(table):
+    m = Mirror(Database(table))
+
+    check_equal(parse(m.respond("/_export_all_data.php?format=csv-asimport")), table)
+    reply = m.respond("/crdb/_export_all_data.php?format=csv-asimport&ads=ads2,x")
+    check_equal(parse(reply), table[table.ads == "ads2"])
+    reply = m.respond("/_export_all_data.php?format=csv")
+    assert reply.body == b"format csv is not available in the export"
+
+    manifest = m.respond("/_export_manifest.php").body.decode().split("\n")
+    assert [x.partition(",")[0] for x in manifest] == ["ads1", "ads2", "ads3", ""]
+
+    for quantity, kwargs in (
+        ("B/C", {}),
+        ("B/C", {"combo_level": 0}),
+        ("H", {"energy_start": 2.0}),
+    ):
+        num, _, den = quantity.partition("/")
+        target = f"/rest.php?num={num}&den={den}&energy_type=R" + "".join(
+            f"&{k}={v}" for (k, v) in kwargs.items()
+        )
+        reply = m.respond(target)
+        check_equal(parse(reply), select(table, quantity, **kwargs))
+        assert m.respond(target) is reply
+
+    tab = parse(m.respond("/rest.php?num=H&format=csv"), _CSV_FIELDS)
+    check_equal(tab, select(table, "H")[list(tab.dtype.names)])
+
+    reply = m.respond("/rest.php?num=He&energy_type=R")
+    assert (reply.status, reply.body) == (200, b"quantity He not found")
+    reply = m.respond("/rest.php?num=H&combo_level=3")
+    assert reply.body == b"invalid combo_level 3"
+    reply = m.respond("/rest.php?num=H&format=usine")
+    assert reply.body == b"format usine is not available in the mirror"
+    assert m.respond("/foo.php").status == 404
+
+
+def test_make_server(table, serve):
+    server = serve(make_server(Mirror(Database(table)), port=0))
+    url = f"http://127.0.0.1:{server.server_port}/crdb"
+    tab = crdb.query("B/C", server_url=url)
+    check_equal(tab, select(table, "B/C"))
+    tab = crdb.all(server_url=url)
+    check_equal(tab, table)
+
+    response = net.open_url(f"{url}/rest.php?num=H&energy_type=R", 10)
+    etag = response.headers["ETag"]
+    response.read()
+    response = net.open_url(
+        f"{url}/rest.php?num=H&energy_type=R", 10, {"If-None-Match": etag}
+    )
+    assert response.status == 304
+    response.read()
@@ -50,3 +50,36 @@ def test_draw_timeseries(table):
 def test_draw_timeseries_2(table):
     with pytest.warns(RuntimeWarning, match="input contains"):
         mpl.draw_timeseries(table, show_bin=True)
+
+
+@pytest.fixture
+def synthetic_table():
+    from crdb.core import _CSV_ASIMPORT_FIELDS
+    from crdb.core import _convert_csv
+
+    row = (
+        "{0},Space,html,2011,{0} ({1}),desc,0.02,info,1,"
+        "2011/{1:02}/01-000000:2011/{1:02}/28-000000,ads,origin,H,R,"
+        "{2},{2},{3},1,0.1,0.1,0.2,0.2,{4},500"
+    )
+    data = ["# header"]
+    for exp in ("AMS02", "PAMELA", "BESS-TeV"):
+        for month in range(1, 13):
+            e = 10**month
+            data.append(row.format(exp, month, e, 2 * e, int(month == 12)))
+    data.append("")
+    return _convert_csv(data, _CSV_ASIMPORT_FIELDS)
+
+
+@pytest.mark.parametrize("time_series", (False, True))
+@pytest.mark.parametrize("max_points", (None, 5))
+def test_draw_experiments(synthetic_table, time_series, max_points):
+    result = mpl.draw_experiments(
+        synthetic_table,
+        show_bin=True,
+        time_series=time_series,
+        max_points=max_points,
+    )
+    assert list(result) == ["AMS02", "PAMELA", "BESS"]
+    n = 11 if max_points is None else 5
+    assert [len(s.get_offsets()) for s in result.values()] == [n, n, n]
@@ -0,0 +1,270 @@
+import gzip
+import os
+import re
+import urllib.error
+import zlib
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from crdb import net
+from crdb import request
+from crdb.core import _iter_chunks
+from crdb.request import _open
+from crdb.request import _read_chunks
+
+BODY = b"".join(b"line %i,foo,bar\n" % i for i in range(10000))
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.ports.add(self.client_address[1])
+        if self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", "/gzip")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path == "/missing":
+            self.send_error(404)
+            return
+        if self.path == "/ranges":
+            self.send_ranges()
+            return
+        if self.path == "/busy":
+            if self.server.busy:
+                self.server.busy -= 1
+                self.send_error(503)
+                return
+            self.path = "/gzip"
+        accepted = self.headers.get("Accept-Encoding", "")
+        encoding = self.path[1:]
+        if encoding == "gzip":
+            body = gzip.compress(BODY)
+        elif encoding == "deflate":
+            body = zlib.compress(BODY)
+        elif encoding == "raw":
+            # some servers send raw deflate streams without zlib header
+            c = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+            body = c.compress(BODY) + c.flush()
+            encoding = "deflate"
+        else:
+            body = BODY
+        assert encoding == "identity" or encoding in accepted
+        self.send_response(200)
+        if encoding != "identity":
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.server.cut:
+            # no range support, the transfer breaks off after a quarter
+            self.server.cut -= 1
+            self.wfile.write(body[: len(body) // 4])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def send_ranges(self):
+        # gzip compressed body with support for range requests, the transfer breaks
+        # off after a quarter while server.cut is positive
+        self.server.ranges.append(self.headers.get("Range"))
+        body = gzip.compress(BODY)
+        start, stop = 0, len(body)
+        m = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if m and self.headers.get("If-Range") == '"v1"':
+            start = int(m[1])
+            stop = int(m[2]) + 1 if m[2] else len(body)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{stop - 1}/{len(body)}")
+        else:
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(stop - start))
+        self.end_headers()
+        if self.server.cut:
+            self.server.cut -= 1
+            self.wfile.write(body[start : start + (stop - start) // 4])
+            self.close_connection = True
+            return
+        self.wfile.write(body[start:stop])
+
+    def log_message(self, *args):
+        pass
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_CONNECT(self):
+        self.server.requests.append(
+            ("CONNECT", self.path, self.headers.get("Proxy-Authorization"))
+        )
+        self.send_error(403)
+
+    def do_GET(self):
+        self.server.requests.append(
+            ("GET", self.path, self.headers.get("Proxy-Authorization"))
+        )
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(serve):
+    server = serve(Handler)
+    server.ports = set()
+    server.ranges = []
+    server.cut = 0
+    server.busy = 0
+    return server
+
+
+@pytest.mark.parametrize("encoding", ("gzip", "deflate", "raw", "identity"))
+def test_open_url(server, encoding):
+    url = f"http://127.0.0.1:{server.server_port}/{encoding}"
+    for _ in range(3):
+        response = net.open_url(url, timeout=10)
+        assert response.status == 200
+        assert response.read() == BODY
+    if encoding == "identity":
+        assert response.bytes_received == len(BODY)
+    else:
+        assert response.bytes_received < len(BODY) / 4
+    # connection is reused
+    assert len(server.ports) == 1
+
+
+def test_open_url_redirect_and_errors(server):
+    base = f"http://127.0.0.1:{server.server_port}"
+    response = net.open_url(f"{base}/redirect", timeout=10)
+    assert response.read() == BODY
+
+    with pytest.raises(urllib.error.HTTPError):
+        net.open_url(f"{base}/missing", timeout=10)
+
+    # an incompletely read response closes the connection
+    response = net.open_url(f"{base}/identity", timeout=10)
+    chunks = response.iter_chunks(100)
+    next(chunks)
+    chunks.close()
+    assert response.read() == b""
+    assert net.open_url(f"{base}/gzip", timeout=10).read() == BODY
+
+
+def test_iter_chunks(server, capsys):
+    url = f"http://127.0.0.1:{server.server_port}/gzip"
+    assert b"".join(_iter_chunks(url, 10)) == BODY
+
+    with pytest.raises(ConnectionError):
+        next(_iter_chunks(f"http://127.0.0.1:{server.server_port}/missing", 10))
+
+
+def test_retry(server, monkeypatch):
+    monkeypatch.setattr(request, "_BACKOFF", 0.01)
+    base = f"http://127.0.0.1:{server.server_port}"
+    server.busy = 2
+    assert b"".join(_iter_chunks(f"{base}/busy", 10)) == BODY
+    assert server.busy == 0
+
+    # interrupted transfers are resumed
+    url = f"{base}/ranges"
+    server.cut = 2
+    assert b"".join(_iter_chunks(url, 10)) == BODY
+    assert len(server.ranges) == 3
+    assert server.ranges[0] is None
+    assert server.ranges[1].endswith("-")
+    assert int(server.ranges[2][6:-1]) > int(server.ranges[1][6:-1])
+
+    # several ranges are fetched in parallel
+    monkeypatch.setattr(request, "_PARALLEL_MIN_SIZE", 0)
+    del server.ranges[:]
+    server.cut = 1
+    response = _open(url, 10)
+    assert b"".join(_read_chunks(response, url, 10, parallel=3)) == BODY
+    assert len(server.ranges) == 4
+    assert all(re.fullmatch(r"bytes=\d+-\d+", r) for r in server.ranges[1:])
+
+    # the request fails after the deadline
+    monkeypatch.setattr(request, "_DEADLINE_FACTOR", 0.02)
+    server.cut = 100
+    with pytest.raises(ConnectionError):
+        b"".join(_iter_chunks(url, 10))
+    assert server.cut < 99
+
+
+def test_restart(server, monkeypatch):
+    monkeypatch.setattr(request, "_BACKOFF", 0.01)
+    url = f"http://127.0.0.1:{server.server_port}/gzip"
+    # without range support, a transfer which broke off cannot be resumed
+    server.cut = 1
+    with pytest.raises(ConnectionError):
+        b"".join(_iter_chunks(url, 10))
+
+    # but it is started over if the body is collected before use
+    server.cut = 2
+    assert b"".join(_iter_chunks(url, 10, restart=True)) == BODY
+    assert server.cut == 0
+
+
+def test_proxy(serve, monkeypatch):
+    proxy = serve(ProxyHandler)
+    proxy.requests = []
+    for name in ("no_proxy", "NO_PROXY", "HTTP_PROXY", "HTTPS_PROXY"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("http_proxy", f"http://127.0.0.1:{proxy.server_port}")
+    monkeypatch.setenv("https_proxy", f"user:p%40ss@127.0.0.1:{proxy.server_port}")
+
+    response = net.open_url("http://crdb.invalid/rest.php?num=H", 10)
+    assert response.read() == BODY
+    # the proxy refuses the tunnel
+    with pytest.raises(OSError, match="403"):
+        net.open_url("https://crdb.invalid:8443/rest.php", 10)
+    assert proxy.requests == [
+        ("GET", "http://crdb.invalid/rest.php?num=H", None),
+        ("CONNECT", "crdb.invalid:8443", "Basic dXNlcjpwQHNz"),
+    ]
+
+    # hosts in no_proxy are contacted directly
+    monkeypatch.setenv("no_proxy", "crdb.invalid")
+    with pytest.raises(OSError):
+        net.open_url("http://crdb.invalid/rest.php?num=H", 10)
+    assert len(proxy.requests) == 2
+
+
+def test_record_replay(server, tmp_path):
+    url = f"http://127.0.0.1:{server.server_port}"
+    previous = net.set_transport(net.Recorder(tmp_path))
+    try:
+        for path in ("gzip", "identity", "redirect"):
+            assert b"".join(_iter_chunks(f"{url}/{path}", 10)) == BODY
+        with pytest.raises(ConnectionError):
+            next(_iter_chunks(f"{url}/missing", 10))
+        # the redirect points to /gzip, which is recorded once
+        assert len(os.listdir(tmp_path)) == 4
+
+        server.shutdown()
+        server.server_close()
+        net.close_all()
+
+        net.set_transport(net.Replayer(tmp_path))
+        for path in ("gzip", "identity", "redirect"):
+            assert b"".join(_iter_chunks(f"{url}/{path}", 10)) == BODY
+        response = net.open_url(f"{url}/gzip", 10, {"If-None-Match": '"foo"'})
+        assert response.status == 200
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.read() == BODY
+        with pytest.raises(urllib.error.HTTPError):
+            net.open_url(f"{url}/missing", 10)
+        with pytest.raises(urllib.error.URLError):
+            net.open_url(f"{url}/foo", 10)
+    finally:
+        assert net.set_transport(previous) is not None
@@ -0,0 +1,95 @@
+import pytest
+
+import crdb
+from crdb import cache
+from crdb import observe
+from crdb import synthetic
+from crdb.observe import Event
+
+
+@pytest.fixture
+def server_url(serve):
+    server = serve(synthetic.make_server(synthetic.generate(1000)))
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+@pytest.fixture
+def events():
+    events = []
+    previous = crdb.set_observer(events.append)
+    yield events
+    crdb.set_observer(previous)
+
+
+def test_events(server_url, events):
+    observe.summary.clear()
+    url = f"{server_url}/_export_all_data.php?format=csv-asimport"
+
+    crdb.all(server_url=server_url)
+    # the stand-in does not publish a manifest
+    assert events[2] == Event("request", f"{server_url}/_export_manifest.php")
+    del events[2]
+    kinds = [(e.kind, e.layer, e.result) for e in events if e.kind != "progress"]
+    assert kinds == [
+        ("cache", "memory", "miss"),
+        ("cache", "disk", "miss"),
+        ("request", "", ""),
+        ("response", "", ""),
+        ("download", "", ""),
+        ("parse", "", ""),
+        ("cache", "disk", "store"),
+    ]
+    assert all(e.url == url for e in events)
+    assert events[3].status == 200
+    assert events[-3].bytes > 0
+    assert events[-2].rows == 1000
+
+    del events[:]
+    crdb.all(server_url=server_url)
+    assert events == [Event("cache", url, layer="memory", result="hit")]
+
+    del events[:]
+    cache.memory.clear()
+    crdb.all(server_url=server_url)
+    assert [(e.kind, e.result) for e in events] == [
+        ("cache", "miss"),
+        ("cache", "hit"),
+    ]
+
+    totals = observe.summary.totals()
+    assert totals["parse"].rows == 1000
+    assert totals["cache memory miss"].events == 2
+    assert totals["cache disk hit"].events == 1
+    report = observe.summary.report().split("\n")
+    assert [x[:18].strip() for x in report[1:]] == [
+        "response",
+        "download",
+        "parse",
+        "cache disk hit",
+        "cache disk miss",
+        "cache disk store",
+        "cache memory hit",
+        "cache memory miss",
+    ]
+    observe.summary.clear()
+    assert observe.summary.totals() == {}
+
+
+def test_progress(capsys):
+    progress = observe.Progress()
+    for n in (1024**2, 2 * 1024**2):
+        progress(Event("progress", "a", bytes=n))
+    progress(Event("download", "a", bytes=n))
+    progress(Event("progress", "b", bytes=1024))
+    progress(Event("download", "b", bytes=1024))
+    c = capsys.readouterr()
+    assert c.out == "\r1.00 Mb downloaded\r2.00 Mb downloaded\n\r0.00 Mb downloaded"
+
+
+def test_no_observer(server_url, capsys):
+    previous = crdb.set_observer(None)
+    try:
+        crdb.all(server_url=server_url)
+    finally:
+        crdb.set_observer(previous)
+    assert capsys.readouterr().out == ""
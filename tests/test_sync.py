@@ -0,0 +1,172 @@
+import hashlib
+import urllib.parse
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from crdb import all
+from crdb import cache
+from crdb import core
+from crdb import sync
+
+ROW = (
+    "Exp,Space,html,2011,Exp (2011),desc,0.02,info,1,"
+    "2011/05/19-000000:2016/05/26-000000,{0},origin,H,R,"
+    "2.5,2,3,{1},-0.01,0.01,-0.02,0.02,0,500"
+)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        self.server.requests.append((url.path, params))
+        db = self.server.db
+        content_type = "text/plain"
+        if url.path == "/_export_manifest.php" and self.server.error_page:
+            # page of a server which does not publish a manifest, with status 200
+            lines = ["<html><body>Not found, see a,b</body></html>"]
+            content_type = self.server.error_page
+        elif url.path == "/_export_manifest.php" and self.server.manifest:
+            lines = [
+                f"{k},{hashlib.sha256(str(v).encode()).hexdigest()}"
+                for (k, v) in db.items()
+            ]
+        elif url.path == "/_export_all_data.php":
+            keys = params["ads"][0].split(",") if "ads" in params else list(db)
+            lines = ["# header"]
+            lines += [ROW.format(k, v) for k in keys for v in db[k]]
+        else:
+            self.send_error(404)
+            return
+        body = "\n".join(lines + [""]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(serve):
+    server = serve(Handler)
+    server.requests = []
+    server.manifest = True
+    server.error_page = ""
+    server.db = {"ads1": [1, 2], "ads2": [3], "ads3": [4, 5, 6]}
+    return server
+
+
+@pytest.mark.parametrize("compact", (False, True))
+@pytest.mark.parametrize("manifest", (False, True))
+def test_sync(server, compact, manifest, capsys):
+    server.manifest = manifest
+    url = f"http://127.0.0.1:{server.server_port}"
+
+    tab = all(compact=compact, server_url=url)
+    assert sorted(tab.value) == [1, 2, 3, 4, 5, 6]
+
+    server.db["ads2"] = [7]
+    server.db["ads4"] = [8]
+    del server.db["ads3"]
+    del server.requests[:]
+    tab = all(compact=compact, server_url=url, revalidate=True)
+    assert sorted(zip(tab.ads.tolist(), tab.value.tolist())) == [
+        ("ads1", 1),
+        ("ads1", 2),
+        ("ads2", 7),
+        ("ads4", 8),
+    ]
+    paths = [p for (p, _) in server.requests]
+    assert paths == ["/_export_manifest.php", "/_export_all_data.php"]
+    if manifest:
+        # only changed partitions are downloaded
+        assert server.requests[1][1]["ads"] == ["ads2,ads4"]
+    else:
+        assert "ads" not in server.requests[1][1]
+
+    # nothing changed
+    del server.requests[:]
+    tab2 = all(compact=compact, server_url=url, revalidate=True)
+    assert sorted(tab2.value) == sorted(tab.value)
+    if manifest:
+        assert [p for (p, _) in server.requests] == ["/_export_manifest.php"]
+
+
+def test_sync_unchanged(server, monkeypatch, capsys):
+    url = f"http://127.0.0.1:{server.server_port}"
+    all(server_url=url)
+    saved = []
+    monkeypatch.setattr(cache, "save", lambda *args: saved.append(args))
+    cache.memory.clear()
+    del server.requests[:]
+    all(server_url=url, revalidate=True)
+    assert [p for (p, _) in server.requests] == ["/_export_manifest.php"]
+    # the unchanged table is not stored again
+    assert saved == []
+
+
+def test_sync_no_manifest(server, monkeypatch, capsys):
+    server.manifest = False
+    url = f"http://127.0.0.1:{server.server_port}"
+    all(server_url=url)
+    assert [p for (p, _) in server.requests] == [
+        "/_export_manifest.php",
+        "/_export_all_data.php",
+    ]
+
+    # automatic revalidation does not ask for the manifest again
+    monkeypatch.setattr(core, "_REVALIDATE_UNCONDITIONAL_AFTER", timedelta(0))
+    cache.memory.clear()
+    del server.requests[:]
+    all(server_url=url)
+    assert [p for (p, _) in server.requests] == ["/_export_all_data.php"]
+
+
+@pytest.mark.parametrize("content_type", ("text/html", "text/plain"))
+def test_sync_invalid_manifest(server, content_type, capsys):
+    server.error_page = content_type
+    url = f"http://127.0.0.1:{server.server_port}"
+    all(server_url=url)
+
+    # the snapshot is downloaded as a whole
+    server.db["ads2"] = [7]
+    del server.requests[:]
+    tab = all(server_url=url, revalidate=True)
+    assert sorted(tab.value) == [1, 2, 4, 5, 6, 7]
+    assert [p for (p, _) in server.requests] == [
+        "/_export_manifest.php",
+        "/_export_all_data.php",
+    ]
+    assert "ads" not in server.requests[1][1]
+
+
+def test_sync_manifest_unavailable(server, monkeypatch, capsys):
+    def fail(*args):
+        raise ConnectionError("no manifest")
+
+    monkeypatch.setattr(sync, "fetch_manifest", fail)
+    url = f"http://127.0.0.1:{server.server_port}"
+    tab = all(server_url=url)
+    assert sorted(tab.value) == [1, 2, 3, 4, 5, 6]
+    assert [p for (p, _) in server.requests] == ["/_export_all_data.php"]
+
+    # the error names the URL of the data
+    with pytest.raises(ConnectionError, match="_export_all_data.php"):
+        all(server_url="http://127.0.0.1:1")
+
+
+def test_sync_official_server(monkeypatch):
+    calls = []
+    monkeypatch.setattr(core, "_cached_table", lambda *args: calls.append(args))
+    all()
+    url = "http://127.0.0.1:1"
+    all(server_url=url)
+    # the official server does not publish a manifest, so it is not asked for one
+    assert [args[-1] for args in calls] == [None, url]
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+import crdb
+from crdb import synthetic
+from crdb.core import _CSV_ASIMPORT_FIELDS
+from crdb.core import _convert_csv
+from crdb.local import _time_series_mask
+
+
+def test_generate():
+    data = synthetic.generate(2000, sub_exps=40, time_series=0.5, seed=2)
+    assert data == synthetic.generate(2000, sub_exps=40, time_series=0.5, seed=2)
+    assert data != synthetic.generate(2000, sub_exps=40, time_series=0.5, seed=3)
+
+    tab = _convert_csv(data.split("\n"), _CSV_ASIMPORT_FIELDS)
+    assert len(tab) == 2000
+    assert len(np.unique(tab.sub_exp)) == 40
+    assert np.all(tab.time_start < tab.time_stop)
+    assert np.all(tab.e_bin[:, 0] < tab.e)
+    assert np.all(tab.e < tab.e_bin[:, 1])
+    series = _time_series_mask(tab)
+    assert len(np.unique(tab.sub_exp[series])) == 20
+
+    assert (
+        len(_convert_csv(synthetic.generate(0).split("\n"), _CSV_ASIMPORT_FIELDS)) == 0
+    )
+    with pytest.raises(ValueError):
+        synthetic.generate(10, time_series=2)
+
+
+def test_make_server(serve):
+    server = serve(synthetic.make_server(synthetic.generate(1000)))
+    url = f"http://127.0.0.1:{server.server_port}"
+    tab = crdb.all(server_url=url)
+    assert len(tab) == 1000
+    tab = crdb.query("B/C", combo_level=0, server_url=url)
+    assert len(tab) > 0
+    assert np.all(tab.quantity == "B/C")